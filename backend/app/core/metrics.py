@@ -0,0 +1,280 @@
+import math
+import time
+import uuid
+from contextlib import contextmanager
+
+from app.core.request_context import (
+    REQUEST_ID_HEADER,
+    REQUEST_ID_PATTERN,
+    log,
+    reset_request_id,
+    set_request_id,
+)
+
+
+# upper bounds in seconds, +Inf is added implicitly
+STAGE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+LLM_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120)
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    """ Prometheus label set, e.g. {stage="parse",le="0.5"} """
+    pairs = [f'{name}="{escape_label_value(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    """ A metric family with a fixed set of label names, one series per distinct label values """
+    type_name = "untyped"
+
+    def __init__(self, name: str, help_text: str, label_names: tuple = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._series = {}
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.type_name}"]
+        for key in sorted(self._series):
+            lines.extend(self._render_series(key, self._series[key]))
+        return lines
+
+    def _render_series(self, key: tuple, value) -> list:
+        return [f"{self.name}{format_labels(self.label_names, key)} {format_value(value)}"]
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._series[key] = self._series.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._series.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    type_name = "gauge"
+
+    def set(self, value: float, **labels):
+        self._series[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._series[key] = self._series.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        return self._series.get(self._key(labels), 0)
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, help_text: str, label_names: tuple = (), buckets: tuple = STAGE_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        series = self._series.get(key)
+        if series is None:
+            # [bucket counts..., sum, count]
+            series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+        for position, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[position] += 1
+                break
+        series[-2] += value
+        series[-1] += 1
+
+    def count(self, **labels) -> int:
+        series = self._series.get(self._key(labels))
+        return series[-1] if series else 0
+
+    def total(self, **labels) -> float:
+        """ Sum of the observed values """
+        series = self._series.get(self._key(labels))
+        return series[-2] if series else 0.0
+
+    def _render_series(self, key: tuple, series) -> list:
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, series):
+            cumulative += bucket_count
+            labels = format_labels(self.label_names, key, f'le="{format_value(bound)}"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = format_labels(self.label_names, key)
+        lines.append(f"{self.name}_sum{labels} {format_value(series[-2])}")
+        lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+
+class Registry:
+    """ The metric families exposed by /metrics, in registration order """
+
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """ Prometheus text exposition format 0.0.4 """
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_DURATION = REGISTRY.register(Histogram(
+    "quickthink_stage_duration_seconds", "Duration of ingestion pipeline stages.", ("stage",), STAGE_BUCKETS
+))
+STAGE_IN_FLIGHT = REGISTRY.register(Gauge(
+    "quickthink_stage_in_flight", "Ingestion pipeline stages currently running.", ("stage",)
+))
+STAGE_ERRORS = REGISTRY.register(Counter(
+    "quickthink_stage_errors_total", "Ingestion pipeline stages that raised.", ("stage",)
+))
+LLM_DURATION = REGISTRY.register(Histogram(
+    "quickthink_llm_request_duration_seconds", "Duration of OpenAI completions that missed the cache.", ("operation",), LLM_BUCKETS
+))
+LLM_IN_FLIGHT = REGISTRY.register(Gauge(
+    "quickthink_llm_requests_in_flight", "OpenAI completions currently awaited.", ("operation",)
+))
+LLM_ERRORS = REGISTRY.register(Counter(
+    "quickthink_llm_request_errors_total", "OpenAI completions that raised.", ("operation",)
+))
+LLM_CACHE_HITS = REGISTRY.register(Counter(
+    "quickthink_llm_cache_hits_total", "Completions answered from the completion cache.", ("operation",)
+))
+LLM_TOKENS = REGISTRY.register(Counter(
+    "quickthink_llm_tokens_total", "Tokens reported in the usage of OpenAI completions.", ("operation", "kind")
+))
+LLM_COST = REGISTRY.register(Counter(
+    "quickthink_llm_cost_usd_total", "Estimated OpenAI spend from completion usage and OPENAI_PRICES.", ("operation",)
+))
+HTTP_DURATION = REGISTRY.register(Histogram(
+    "quickthink_http_request_duration_seconds", "HTTP request latency by route template.", ("method", "route", "status"), HTTP_BUCKETS
+))
+HTTP_IN_FLIGHT = REGISTRY.register(Gauge(
+    "quickthink_http_requests_in_flight", "HTTP requests currently being served."
+))
+INGESTION_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "quickthink_ingestion_queue_depth", "Ingestion jobs waiting for a worker."
+))
+INGESTION_ACTIVE = REGISTRY.register(Gauge(
+    "quickthink_ingestion_active", "Ingestions admitted and not finished (queued, running or streaming)."
+))
+
+
+@contextmanager
+def timed(duration: Histogram, in_flight: Gauge, errors: Counter, **labels):
+    """ Records the duration, in-flight count and errors of the wrapped block """
+    in_flight.inc(**labels)
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        errors.inc(**labels)
+        raise
+    finally:
+        in_flight.dec(**labels)
+        duration.observe(time.perf_counter() - start, **labels)
+
+
+@contextmanager
+def stage_span(stage: str, **fields):
+    """
+    Timing span around one pipeline stage (parse, chunk, generate, dedup, insert, ...).
+    Feeds the stage metrics and logs one structured line tagged with the request id.
+    """
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        with timed(STAGE_DURATION, STAGE_IN_FLIGHT, STAGE_ERRORS, stage=stage):
+            yield
+    except Exception as e:
+        status = f"error error={type(e).__name__}"
+        raise
+    except BaseException:
+        # cancelled, e.g. the client of a stream went away
+        status = "cancelled"
+        raise
+    finally:
+        details = "".join(f" {key}={value}" for key, value in fields.items())
+        log(f"stage={stage} status={status} duration_ms={(time.perf_counter() - start) * 1000:.1f}{details}")
+
+
+def llm_span(operation: str):
+    """ Timing span around one OpenAI completion, metrics only (there can be hundreds per file) """
+    return timed(LLM_DURATION, LLM_IN_FLIGHT, LLM_ERRORS, operation=operation)
+
+
+class RequestMetricsMiddleware:
+    """
+    ASGI middleware giving every HTTP request a correlation id, taken from the X-Request-ID
+    header when the client sent a usable one. The id is current for everything the request
+    runs (see request_context.log) and is echoed back in the response headers.
+    Also records the request's latency by route template.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        header = dict(scope["headers"]).get(REQUEST_ID_HEADER.lower().encode("latin-1"), b"").decode("latin-1")
+        request_id = header if REQUEST_ID_PATTERN.match(header) else uuid.uuid4().hex
+        token = set_request_id(request_id)
+        status_code = 500
+
+        async def send_with_request_id(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [
+                    (REQUEST_ID_HEADER.lower().encode("latin-1"), request_id.encode("latin-1"))
+                ]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            # the route template, not the path, so deck ids don't each become a series
+            route = scope.get("route")
+            HTTP_DURATION.observe(
+                time.perf_counter() - start,
+                method=scope["method"],
+                route=getattr(route, "path", "unmatched"),
+                status=status_code
+            )
+            reset_request_id(token)
@@ -0,0 +1,28 @@
+import re
+from contextvars import ContextVar
+
+
+REQUEST_ID_HEADER = "X-Request-ID"
+# a client supplied id is only reused if it looks like one, anything else gets a fresh id
+REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9._-]{1,128}$")
+
+_request_id = ContextVar("request_id", default="-")
+
+
+def current_request_id() -> str:
+    """ Correlation id of the request (or ingestion job) being handled, "-" outside of one """
+    return _request_id.get()
+
+
+def set_request_id(request_id: str):
+    """ Makes request_id current for this task, returns the token to reset it with """
+    return _request_id.set(request_id)
+
+
+def reset_request_id(token):
+    _request_id.reset(token)
+
+
+def log(*parts):
+    """ print, prefixed with the current request id so every line of one upload can be grepped together """
+    print(f"[{current_request_id()}]", *parts)
@@ -1,29 +1,68 @@
+import os
+
+import httpx
 from supabase._async.client import AsyncClient as Client, create_client
 from supabase.lib.client_options import ClientOptions
-from app.config import settings
-
-# async def get_supabase_client(authorization: str = None) -> Client:
-#     headers = {}
-#     if authorization:
-#         headers["Authorization"] = authorization
-
-#     return await create_client(
-#         settings.SUPABASE_URL,
-#         settings.SUPABASE_KEY,
-#         options=ClientOptions(
-#             headers=headers,
-#             persist_session=False,
-#         )
-#     )
+from config import settings
 
-async def get_supabase_client() -> Client:
-    headers = {}
 
-    return await create_client(
+# connection pool of the shared PostgREST session
+SUPABASE_MAX_CONNECTIONS = int(os.getenv("SUPABASE_MAX_CONNECTIONS", "100"))
+SUPABASE_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("SUPABASE_MAX_KEEPALIVE_CONNECTIONS", "20"))
+SUPABASE_KEEPALIVE_EXPIRY = float(os.getenv("SUPABASE_KEEPALIVE_EXPIRY", "30"))
+
+_supabase_client = None
+
+
+async def create_supabase_client() -> Client:
+    """
+    Builds an async supabase client whose PostgREST session is a pooled HTTP/2
+    connection with keep-alive, so concurrent requests reuse the same connections.
+    """
+    client = await create_client(
         settings.SUPABASE_URL,
         settings.SUPABASE_KEY,
-        options=ClientOptions(
-            headers=headers,
-            persist_session=False,
-        )
-    )
\ No newline at end of file
+        options=ClientOptions(persist_session=False)
+    )
+
+    postgrest = client.postgrest
+    default_session = postgrest.session
+    postgrest.session = httpx.AsyncClient(
+        base_url=default_session.base_url,
+        headers=default_session.headers,
+        timeout=default_session.timeout,
+        follow_redirects=True,
+        http2=True,
+        limits=httpx.Limits(
+            max_connections=SUPABASE_MAX_CONNECTIONS,
+            max_keepalive_connections=SUPABASE_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=SUPABASE_KEEPALIVE_EXPIRY,
+        ),
+    )
+    await default_session.aclose()
+    return client
+
+
+async def open_supabase_client():
+    """ Creates the shared client, called from the app lifespan on startup """
+    global _supabase_client
+    if _supabase_client is None:
+        _supabase_client = await create_supabase_client()
+
+
+async def close_supabase_client():
+    """ Closes the shared client's connections, called from the app lifespan on shutdown """
+    global _supabase_client
+    if _supabase_client is not None:
+        await _supabase_client.postgrest.aclose()
+        _supabase_client = None
+
+
+async def get_supabase_client() -> Client:
+    """
+    FastAPI dependency returning the process wide async supabase client.
+    The client is normally opened by the lifespan; it is created on first use otherwise.
+    """
+    if _supabase_client is None:
+        await open_supabase_client()
+    return _supabase_client
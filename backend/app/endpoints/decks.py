@@ -1,28 +1,54 @@
-from fastapi import FastAPI, APIRouter, Depends, HTTPException, status, File, UploadFile
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, status, File, Header, Query, Response, UploadFile
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Annotated, Dict, List, Literal, Optional
+import json
+import orjson
+import time
 from datetime import datetime
 import uuid
 from dotenv import load_dotenv
 import os
-from app.services.file_service import process_file
+from app.services.file_service import process_file, stream_file_flashcards
+from app.services.job_service import get_ingestion_admission, get_job_manager
+from app.services.completion_cache import get_completion_cache
+from app.services.parse_cache import get_parse_cache
+from app.services.deck_service import (
+    PAGE_SIZE_DEFAULT,
+    PAGE_SIZE_MAX,
+    bulk_insert,
+    check_deck_owner,
+    fetch_page,
+    get_deck_ownership_cache,
+    select_columns,
+)
+from app.services.dedup_service import FLASHCARD_DEDUP_ENABLED, card_text, drop_near_duplicates, load_deck_index
+from app.services.upload_service import SpooledUpload, check_upload, spool_upload
+from app.services.usage_service import IngestionUsage, save_ingestion_usage, track_usage
+from app.services.response_cache import CachedPage, etag_matches, get_response_cache, make_etag
+from app.core.metrics import stage_span
+from app.core.request_context import log
+from app.core.supabase import Client, get_supabase_client
 
-from supabase import create_client, Client
 load_dotenv()
 
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# streamed flashcards are written to supabase in batches of this size
+STREAM_INSERT_BATCH_SIZE = int(os.getenv("STREAM_INSERT_BATCH_SIZE", "10"))
+# paginated listings return the cursor of the next page in this header, the body stays a plain list
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+# opt-in: encode listing rows with orjson as supabase returns them instead of re-validating them
+FAST_JSON_RESPONSES = os.getenv("FAST_JSON_RESPONSES", "false").lower() == "true"
 
 app = FastAPI()
 router = APIRouter()
 
 
-def get_current_user():
+async def get_current_user():
     """
     Mock function returning a user_id.
     This is hardcoded to the one created accounts, but will have to be updated.
+    Async so that FastAPI doesn't hand every request to the threadpool just to resolve the user.
     """
 
     return "e13a4297-16ae-4342-8fbf-f45587048596"
@@ -59,17 +85,79 @@ class FlashcardOut(BaseModel):
     created_at: datetime
     updated_at: datetime
 
+class JobOut(BaseModel):
+    id: str
+    deck_id: str
+    user_id: str
+    status: str
+    progress: Dict[str, int]
+    failed_chunks: List[int]
+    usage: IngestionUsage
+    error: Optional[str]
+    created_at: datetime
+    updated_at: datetime
+
+
+PageLimit = Annotated[int, Query(ge=1, le=PAGE_SIZE_MAX, description="Maximum number of rows in the page")]
+PageCursor = Annotated[Optional[str], Query(description=f"Cursor from the {NEXT_CURSOR_HEADER} header of the previous page")]
+PageFields = Annotated[Optional[str], Query(description="Comma separated columns to return, id and created_at are always included")]
+IfNoneMatch = Annotated[Optional[str], Header(description="ETag of a copy of the page the client already has")]
+
+
+def check_bulk_insert(result, total: int):
+    """ Raises if a bulk flashcard insert wrote nothing (400) or only part of the rows (500) """
+    if not result.rows:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Failed to create flashcards."
+        )
+    if result.failed_ids:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to create {len(result.failed_ids)} of {total} flashcards."
+        )
+
+
+def build_page(rows: list, next_cursor: Optional[str], model, partial: bool, fast: bool = FAST_JSON_RESPONSES) -> CachedPage:
+    """
+    Serializes a listing page once so it can be cached and served with an ETag.
+    Full rows go through the response model, rows limited to some fields are sent as they are.
+    With `fast`, rows are trusted as they come from the database: they were selected with exactly
+    the model's columns, so they are encoded with orjson without validating them again.
+    """
+    if fast:
+        body = orjson.dumps(rows)
+    else:
+        if not partial:
+            rows = [model.model_validate(row).model_dump(mode="json") for row in rows]
+        body = json.dumps(jsonable_encoder(rows)).encode("utf-8")
+    return CachedPage(make_etag(body, next_cursor), body, next_cursor)
+
+
+def page_response(page: CachedPage, if_none_match: Optional[str]) -> Response:
+    """ Sends a listing page, or a bodyless 304 when the client's ETag still matches """
+    headers = {"ETag": page.etag, "Cache-Control": "private, no-cache"}
+    if page.next_cursor:
+        headers[NEXT_CURSOR_HEADER] = page.next_cursor
+    if etag_matches(if_none_match, page.etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=page.body, media_type="application/json", headers=headers)
+
 
 # CREATE a new deck for a user
 # POST /api/decks
 @router.post("/api/decks", response_model=DeckOut)
-def create_deck(deck_data: DeckCreate, user_id: str = Depends(get_current_user)):
+async def create_deck(
+    deck_data: DeckCreate,
+    user_id: str = Depends(get_current_user),
+    supabase: Client = Depends(get_supabase_client)
+):
     """
     Create a new deck owned by the current user.
     """
     new_deck_id = str(uuid.uuid4())
 
-    response = (
+    response = await (
         supabase
         .table("flashcard_decks")
         .insert({
@@ -87,76 +175,99 @@ def create_deck(deck_data: DeckCreate, user_id: str = Depends(get_current_user))
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Failed to create deck."
         )
+    get_deck_ownership_cache().invalidate(user_id, new_deck_id)
+    get_response_cache().invalidate(("decks", user_id))
     return response.data[0]
 
 
 # GET all decks for a user
 # GET /api/decks
 @router.get("/api/decks", response_model=List[DeckOut])
-def get_user_decks(user_id: str = Depends(get_current_user)):
+async def get_user_decks(
+    limit: PageLimit = PAGE_SIZE_DEFAULT,
+    cursor: PageCursor = None,
+    fields: PageFields = None,
+    if_none_match: IfNoneMatch = None,
+    user_id: str = Depends(get_current_user),
+    supabase: Client = Depends(get_supabase_client)
+):
     """
-    Get all decks belonging to the current user.
+    Get a page of the decks belonging to the current user, oldest first.
+    Pages are served from the response cache until a deck write invalidates it.
     """
-    print('getting decks')
-    response = (
-        supabase
-        .table("flashcard_decks")
-        .select("*")
-        .eq("user_id", user_id)
-        .execute()
-    )
-    return response.data 
+    log('getting decks')
+    cache = get_response_cache()
+    scope = ("decks", user_id)
+    variant = (limit, cursor, fields)
+    page = cache.get(scope, variant)
+    if page is None:
+        query = (
+            supabase
+            .table("flashcard_decks")
+            .select(select_columns(fields, DeckOut.model_fields))
+            .eq("user_id", user_id)
+        )
+        rows, next_cursor = await fetch_page(query, limit, cursor)
+        page = cache.put(scope, variant, build_page(rows, next_cursor, DeckOut, partial=bool(fields)))
+    return page_response(page, if_none_match)
 
 
 # DELETE a specific deck
 # DELETE /api/decks/:deck_id
 @router.delete("/api/decks/{deck_id}")
-def delete_deck(deck_id: str, user_id: str = Depends(get_current_user)):
+async def delete_deck(
+    deck_id: str,
+    user_id: str = Depends(get_current_user),
+    supabase: Client = Depends(get_supabase_client)
+):
     """
     Delete a deck and its associated flashcards if it belongs to the current user.
+    The delete_deck Postgres function (supabase/migrations) checks ownership and
+    deletes both in one transaction, so this is a single round trip.
     """
-    deck_response = (
-        supabase
-        .table("flashcard_decks")
-        .select("id")
-        .match({"id": deck_id, "user_id": user_id})
-        .execute()
-    )
-
-    if not deck_response.data:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Deck not found or not owned by user."
-        )
-
     try:
-        supabase.table("flashcards").delete().match({"deck_id": deck_id}).execute()
-        
-        supabase.table("flashcard_decks").delete().match({"id": deck_id}).execute()
-
-        return {"detail": "Deck and associated flashcards deleted successfully."}
+        response = await supabase.rpc("delete_deck", {"p_deck_id": deck_id, "p_user_id": user_id}).execute()
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error deleting deck: {str(e)}"
         )
+    finally:
+        # only once the delete is done (or failed half way), so a read racing the delete can't re-cache the deck
+        get_deck_ownership_cache().invalidate(user_id, deck_id)
+        get_response_cache().invalidate(("decks", user_id))
+        get_response_cache().invalidate(("flashcards", deck_id))
+
+    if not response.data:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Deck not found or not owned by user."
+        )
+    return {"detail": "Deck and associated flashcards deleted successfully."}
 
 # UPDATE a deck
 # PATCH /api/decks/:deck_id
 @router.patch("/api/decks/{deck_id}", response_model=DeckOut)
-def update_deck(deck_id: str, deck_data: DeckUpdate, user_id: str = Depends(get_current_user)):
+async def update_deck(
+    deck_id: str,
+    deck_data: DeckUpdate,
+    user_id: str = Depends(get_current_user),
+    supabase: Client = Depends(get_supabase_client)
+):
     """
     Update the deck's name, category, or description if owned by the current user.
     """
     update_dict = {k: v for k, v in deck_data.dict().items() if v is not None}
 
-    response = (
+    response = await (
         supabase
         .table("flashcard_decks")
         .update(update_dict)
         .match({"id": deck_id, "user_id": user_id})
         .execute()
     )
+    get_deck_ownership_cache().invalidate(user_id, deck_id)
+    get_response_cache().invalidate(("decks", user_id))
 
     if not response.data:
         raise HTTPException(
@@ -170,53 +281,52 @@ def update_deck(deck_id: str, deck_data: DeckUpdate, user_id: str = Depends(get_
 # GET all flashcards for a given deck
 # GET /api/decks/:deck_id/flashcards
 @router.get("/api/decks/{deck_id}/flashcards", response_model=List[FlashcardOut])
-def get_deck_flashcards(deck_id: str, user_id: str = Depends(get_current_user)):
+async def get_deck_flashcards(
+    deck_id: str,
+    limit: PageLimit = PAGE_SIZE_DEFAULT,
+    cursor: PageCursor = None,
+    fields: PageFields = None,
+    if_none_match: IfNoneMatch = None,
+    user_id: str = Depends(get_current_user),
+    supabase: Client = Depends(get_supabase_client)
+):
     """
-    Get all flashcards in a specific deck if the deck is owned by the current user.
+    Get a page of the flashcards in a specific deck, oldest first, if the deck is owned by the current user.
+    Pages are served from the response cache until a flashcard write invalidates it.
     """
-    print("getting flashcards for deck", deck_id)
-    deck_check = (
-        supabase
-        .table("flashcard_decks")
-        .select("id")
-        .match({"id": deck_id, "user_id": user_id})
-        .execute()
-    )
-    if not deck_check.data:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Deck not found or not owned by user."
+    log("getting flashcards for deck", deck_id)
+    # ownership is checked before the cache, cached pages are shared by everyone who owns the deck
+    await check_deck_owner(supabase, deck_id, user_id)
+
+    cache = get_response_cache()
+    scope = ("flashcards", deck_id)
+    variant = (limit, cursor, fields)
+    page = cache.get(scope, variant)
+    if page is None:
+        query = (
+            supabase
+            .table("flashcards")
+            .select(select_columns(fields, FlashcardOut.model_fields))
+            .eq("deck_id", deck_id)
         )
-
-    response = (
-        supabase
-        .table("flashcards")
-        .select("*")
-        .eq("deck_id", deck_id)
-        .execute()
-    )
-    return response.data
+        rows, next_cursor = await fetch_page(query, limit, cursor)
+        page = cache.put(scope, variant, build_page(rows, next_cursor, FlashcardOut, partial=bool(fields)))
+    return page_response(page, if_none_match)
 
 
 # CREATE new flashcards for a given deck
 # POST /api/decks/:deck_id/flashcards
 @router.post("/api/decks/{deck_id}/flashcards", response_model=List[FlashcardOut])
-def create_flashcards(deck_id: str, flashcards: List[FlashcardCreate], user_id: str = Depends(get_current_user)):
+async def create_flashcards(
+    deck_id: str,
+    flashcards: List[FlashcardCreate],
+    user_id: str = Depends(get_current_user),
+    supabase: Client = Depends(get_supabase_client)
+):
     """
     Create multiple flashcards for a given deck, if that deck belongs to the current user.
     """
-    deck_check = (
-        supabase
-        .table("flashcard_decks")
-        .select("id")
-        .match({"id": deck_id, "user_id": user_id})
-        .execute()
-    )
-    if not deck_check.data:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Deck not found or not owned by user."
-        )
+    await check_deck_owner(supabase, deck_id, user_id)
 
     flashcard_entries = []
     for fc in flashcards:
@@ -227,28 +337,70 @@ def create_flashcards(deck_id: str, flashcards: List[FlashcardCreate], user_id:
             "answer": fc.answer,
         })
 
-    response = supabase.table("flashcards").insert(flashcard_entries).execute()
+    result = await bulk_insert(supabase, "flashcards", flashcard_entries)
+    get_response_cache().invalidate(("flashcards", deck_id))
+    check_bulk_insert(result, len(flashcard_entries))
 
-    if not response.data:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Failed to create flashcards."
-        )
+    return result.rows
 
-    return response.data
+
+async def receive_upload(file: UploadFile) -> SpooledUpload:
+    """
+    Spools the uploaded file for the ingestion pipeline (size limited, hashed on the way)
+    and rejects empty files. The caller owns the returned upload and must close it.
+    """
+    with stage_span("spool"):
+        upload = await spool_upload(file)
+    if upload.size == 0:
+        upload.close()
+        raise HTTPException(status_code=400, detail="File content is empty.")
+    return upload
 
 
-@router.post("/api/decks/{deck_id}/flashcards/file", summary="Upload and process a file")
-async def create_flashcards_from_file(deck_id: str, file: UploadFile = File(...), user_id: str = Depends(get_current_user)):
+async def admit_upload(supabase: Client, deck_id: str, user_id: str, file: UploadFile) -> SpooledUpload:
     """
-    Create multiple flashcards for a given deck, if that deck belongs to the current user.
+    Preflight for the ingestion endpoints, cheapest checks first: deck ownership, content type
+    and declared size, then an admission slot, and only then the upload is spooled.
+    On success the caller owns both the upload and the slot and must release them.
+    """
+    await check_deck_owner(supabase, deck_id, user_id)
+    check_upload(file)
+
+    job_manager = get_job_manager()
+    admission = get_ingestion_admission()
+    admission.admit(user_id, job_manager.queue_depth, job_manager.num_workers)
+    try:
+        return await receive_upload(file)
+    except BaseException:
+        admission.release(user_id)
+        raise
+
+
+async def ingest_file(job, supabase: Client, deck_id: str, upload: SpooledUpload, chunker: Optional[str] = None):
     """
-    # Load the file
-    print("called create_flashcards_from_file")
-    file_content = await file.read()
-    flashcards = await process_file(file_content)
+    Worker body for a file upload job: parse the file, generate flashcards, drop near duplicates
+    and insert the rest. Chunks whose flashcard could not be generated are recorded in job.failed_chunks,
+    the OpenAI tokens and cost in job.usage (also saved to ingestion_usage, even when the job fails).
+    """
+    try:
+        with track_usage(job.usage):
+            results = await process_file(upload, progress=job.progress, chunker=chunker)
+    finally:
+        upload.close()
+        await save_ingestion_usage(supabase, deck_id, job.user_id, job.usage, job_id=job.id)
+    job.failed_chunks = results.failed_chunks
 
-    print("processed file")
+    log("processed file")
+
+    with stage_span("dedup", cards=len(results.flashcards)):
+        flashcards = await drop_near_duplicates(supabase, deck_id, results.flashcards)
+    job.progress["duplicates_dropped"] = len(results.flashcards) - len(flashcards)
+
+    if not flashcards:
+        # everything was already in the deck (e.g. the same slides uploaded again), nothing to insert
+        job.progress["cards_inserted"] = 0
+        log("no new flashcards to insert")
+        return
 
     flashcard_entries = []
     for i, (question, answer) in enumerate(flashcards):
@@ -259,33 +411,224 @@ async def create_flashcards_from_file(deck_id: str, file: UploadFile = File(...)
             "answer": answer,
         })
 
-#     for i, (question, answer) in enumerate(flashcards):
+    with stage_span("insert", rows=len(flashcard_entries)):
+        result = await bulk_insert(supabase, "flashcards", flashcard_entries)
+    get_response_cache().invalidate(("flashcards", deck_id))
+    job.progress["cards_inserted"] = result.inserted
+
+    log("inserted into supabase")
+
+    check_bulk_insert(result, len(flashcard_entries))
+
+
+# UPLOAD a file and queue flashcard generation for it
+# POST /api/decks/:deck_id/flashcards/file
+@router.post(
+    "/api/decks/{deck_id}/flashcards/file",
+    summary="Upload and process a file",
+    response_model=JobOut,
+    status_code=status.HTTP_202_ACCEPTED
+)
+async def create_flashcards_from_file(
+    deck_id: str,
+    file: UploadFile = File(...),
+    chunker: Optional[Literal["llm", "markdown"]] = None,
+    user_id: str = Depends(get_current_user),
+    supabase: Client = Depends(get_supabase_client)
+):
+    """
+    Queue flashcard generation for an uploaded file, if the deck belongs to the current user.
+    Returns the ingestion job right away; poll GET /api/jobs/:job_id for its progress.
+    `chunker` picks the chunking stage for this upload (defaults to the CHUNKER setting).
+    """
+    log("called create_flashcards_from_file")
+    # the request's own upload is gone once it returns, the job reads from this spool instead
+    upload = await admit_upload(supabase, deck_id, user_id, file)
+
+    async def work(job):
+        started = time.monotonic()
+        try:
+            await ingest_file(job, supabase, deck_id, upload, chunker)
+        finally:
+            get_ingestion_admission().release(user_id, time.monotonic() - started)
 
-    if not file_content:
-        raise HTTPException(status_code=400, detail="File content is empty.")
-    
-    deck_check = (
-        supabase
-        .table("flashcard_decks")
-        .select("id")
-        .match({"id": deck_id, "user_id": user_id})
-        .execute()
+    job = get_job_manager().submit(deck_id, user_id, work)
+    return job.to_dict()
+
+
+class CleanupStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse that calls cleanup once the response is over, however it ended.
+    A generator's own finally never runs if the client disconnects before the first chunk,
+    so slots and files held by the stream are released here as well.
+    """
+
+    def __init__(self, content, cleanup, **kwargs):
+        super().__init__(content, **kwargs)
+        self.cleanup = cleanup
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.cleanup()
+
+
+def format_sse(event: str, data: dict) -> str:
+    """ Formats one Server-Sent Events message """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def insert_flashcard_batch(supabase: Client, deck_id: str, flashcard_entries: list) -> int:
+    """
+    Inserts a batch of streamed flashcards and returns how many rows were written.
+    """
+    with stage_span("insert", rows=len(flashcard_entries)):
+        result = await bulk_insert(supabase, "flashcards", flashcard_entries)
+    get_response_cache().invalidate(("flashcards", deck_id))
+    check_bulk_insert(result, len(flashcard_entries))
+    return result.inserted
+
+
+async def flashcard_event_stream(
+    supabase: Client,
+    deck_id: str,
+    user_id: str,
+    upload: SpooledUpload,
+    chunker: Optional[str] = None
+):
+    """
+    Emits a `flashcard` event per generated card (or `chunk_failed` for a chunk that failed),
+    inserting cards into supabase in small batches, then a final `done` event
+    (or an `error` event if the pipeline fails). Near duplicates of earlier cards or of cards
+    already in the deck are skipped and counted in `done`, which also carries the OpenAI usage.
+    """
+    pending_entries = []
+    failed_chunks = []
+    inserted = 0
+    duplicates = 0
+    usage = IngestionUsage()
+    try:
+        dedup_index = await load_deck_index(supabase, deck_id) if FLASHCARD_DEDUP_ENABLED else None
+        with track_usage(usage):
+            async for index, qa_pair in stream_file_flashcards(upload, chunker=chunker):
+                if qa_pair is None:
+                    failed_chunks.append(index)
+                    yield format_sse("chunk_failed", {"chunk_index": index})
+                    continue
+
+                question, answer = qa_pair
+                if dedup_index is not None and not dedup_index.filter_new([card_text(question, answer)])[0]:
+                    duplicates += 1
+                    continue
+                entry = {
+                    "id": str(uuid.uuid4()),
+                    "deck_id": deck_id,
+                    "question": question,
+                    "answer": answer,
+                }
+                pending_entries.append(entry)
+                yield format_sse("flashcard", {**entry, "chunk_index": index})
+
+                if len(pending_entries) >= STREAM_INSERT_BATCH_SIZE:
+                    inserted += await insert_flashcard_batch(supabase, deck_id, pending_entries)
+                    pending_entries = []
+
+        if pending_entries:
+            inserted += await insert_flashcard_batch(supabase, deck_id, pending_entries)
+        yield format_sse("done", {
+            "cards_inserted": inserted,
+            "failed_chunks": sorted(failed_chunks),
+            "duplicates_dropped": duplicates,
+            "usage": usage.model_dump(),
+        })
+    except HTTPException as e:
+        yield format_sse("error", {"detail": str(e.detail), "cards_inserted": inserted, "usage": usage.model_dump()})
+    except Exception as e:
+        yield format_sse("error", {"detail": str(e), "cards_inserted": inserted, "usage": usage.model_dump()})
+    finally:
+        upload.close()
+        await save_ingestion_usage(supabase, deck_id, user_id, usage)
+
+
+# UPLOAD a file and stream flashcards back as they are generated
+# POST /api/decks/:deck_id/flashcards/file/stream
+@router.post("/api/decks/{deck_id}/flashcards/file/stream", summary="Upload a file and stream generated flashcards")
+async def stream_flashcards_from_file(
+    deck_id: str,
+    file: UploadFile = File(...),
+    chunker: Optional[Literal["llm", "markdown"]] = None,
+    user_id: str = Depends(get_current_user),
+    supabase: Client = Depends(get_supabase_client)
+):
+    """
+    Generate flashcards for an uploaded file and send each one as a Server-Sent Event
+    as soon as it is ready, if the deck belongs to the current user.
+    """
+    upload = await admit_upload(supabase, deck_id, user_id, file)
+    started = time.monotonic()
+    released = False
+
+    def release():
+        # called by the stream and by the response, whichever ends first, only the first one counts
+        nonlocal released
+        if not released:
+            released = True
+            upload.close()
+            get_ingestion_admission().release(user_id, time.monotonic() - started)
+
+    async def events():
+        try:
+            async for event in flashcard_event_stream(supabase, deck_id, user_id, upload, chunker):
+                yield event
+        finally:
+            release()
+
+    return CleanupStreamingResponse(
+        events(),
+        cleanup=release,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
     )
-    if not deck_check.data:
+
+
+# GET the status of a file ingestion job
+# GET /api/jobs/:job_id
+@router.get("/api/jobs/{job_id}", response_model=JobOut)
+async def get_job_status(job_id: str, user_id: str = Depends(get_current_user)):
+    """
+    Get the status, progress and error of an ingestion job started by the current user.
+    """
+    job = get_job_manager().get(job_id)
+    if job is None or job.user_id != user_id:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
-            detail="Deck not found or not owned by user."
+            detail="Job not found or not owned by user."
         )
+    return job.to_dict()
 
 
-    response = supabase.table("flashcards").insert(flashcard_entries).execute()
-
-    print("inserted into supabase")
+# GET all ingestion jobs for a given deck
+# GET /api/decks/:deck_id/jobs
+@router.get("/api/decks/{deck_id}/jobs", response_model=List[JobOut])
+async def get_deck_jobs(deck_id: str, user_id: str = Depends(get_current_user)):
+    """
+    Get the ingestion jobs the current user started for a deck, oldest first.
+    """
+    return [job.to_dict() for job in get_job_manager().list_for_user(user_id, deck_id)]
 
-    if not response.data:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Failed to create flashcards."
-        )
 
-    return response.data
\ No newline at end of file
+# GET hit/miss counters of the ingestion caches
+# GET /api/cache/stats
+@router.get("/api/cache/stats")
+async def get_cache_stats():
+    """
+    Report hit/miss counters for the LLM completion cache, the parse cache, the deck ownership cache
+    and the listing response cache.
+    """
+    return {
+        "completion_cache": get_completion_cache().stats(),
+        "parse_cache": get_parse_cache().stats(),
+        "deck_ownership_cache": get_deck_ownership_cache().stats(),
+        "response_cache": get_response_cache().stats(),
+    }
@@ -1,6 +1,11 @@
 import asyncio
+import tempfile
 from types import SimpleNamespace
-from fastapi import HTTPException, status
+from fastapi import HTTPException, status, UploadFile
+import json
+from datetime import datetime
+import httpx
+from postgrest.exceptions import APIError
 from decks import DeckCreate, DeckUpdate, FlashcardCreate
 from decks import (
     create_deck,
@@ -9,18 +14,25 @@ from decks import (
     update_deck,
     get_deck_flashcards,
     create_flashcards,
+    create_flashcards_from_file,
+    get_job_status,
+    stream_flashcards_from_file,
 )
-# Note: in order to prevent the supabase client from connecting, comment out these 2 lines 
-# in decks.py to allow testing:
-"""
-#from app.services.file_service import process_file
-#supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-"""
+from app.services.job_service import get_ingestion_admission, get_job_manager
+from app.services.file_service import FlashcardResults
+from app.services.deck_service import bulk_insert, get_deck_ownership_cache
+from app.services.response_cache import get_response_cache
+from app.services.usage_service import record_completion
+from benchmarks.bench_startup import LAZY_MODULES, import_main
+import decks
+# Note: the handlers receive the supabase client as a dependency, so the tests
+# pass a FakeSupabase in directly instead of connecting to a real project.
 
 class FakeTable:
-    def __init__(self, table_name: str, response: dict):
+    def __init__(self, table_name: str, response: dict, supabase=None):
         self.table_name = table_name
         self.response = response
+        self.supabase = supabase
         self.called_methods = []
 
     def insert(self, data):
@@ -28,6 +40,11 @@ class FakeTable:
         self.insert_data = data
         return self
 
+    def upsert(self, data, on_conflict=""):
+        self.called_methods.append(("upsert", data))
+        self.insert_data = data
+        return self
+
     def select(self, columns="*"):
         self.called_methods.append(("select", columns))
         return self
@@ -46,29 +63,80 @@ class FakeTable:
         self.eq_data = (key, value)
         return self
 
+    def or_(self, filters):
+        self.called_methods.append(("or_", filters))
+        return self
+
+    def order(self, column, desc=False):
+        self.called_methods.append(("order", column))
+        return self
+
+    def limit(self, size):
+        self.called_methods.append(("limit", size))
+        return self
+
     def match(self, conditions):
         self.called_methods.append(("match", conditions))
         self.match_data = conditions
         return self
 
-    def execute(self):
+    async def execute(self):
         self.called_methods.append(("execute", None))
+        if self.supabase is not None and self.supabase.failures > 0:
+            self.supabase.failures -= 1
+            raise self.supabase.failure()
         # wrap the response dict in a SimpleNamespace so that `data` is accessible as an attribute
         return SimpleNamespace(data=self.response.get("data"))
 
+class FakeRpc:
+    def __init__(self, result, supabase):
+        self.result = result
+        self.supabase = supabase
+
+    async def execute(self):
+        if self.supabase.failures > 0:
+            self.supabase.failures -= 1
+            raise self.supabase.failure()
+        return SimpleNamespace(data=self.result)
+
 class FakeSupabase:
-    def __init__(self, responses: dict):
+    def __init__(self, responses: dict, failures: int = 0, failure=lambda: ConnectionError("simulated transient failure")):
         """
         responses: a dict mapping table names (e.g., "flashcard_decks") to
                    the fake response that should be returned on execute().
+        failures: how many of the next execute() calls raise failure(), a transient error by default.
         simulates evetything we need along with FakeTable
         """
         self.responses = responses
+        self.failures = failures
+        self.failure = failure
+        self.tables = []
+        self.rpc_calls = []
 
     def table(self, table_name: str):
         # If no response is provided for the table, default to empty list.
         response = self.responses.get(table_name, {"data": []})
-        return FakeTable(table_name, response)
+        table = FakeTable(table_name, response, self)
+        self.tables.append(table)
+        return table
+
+    def rpc(self, fn: str, params: dict):
+        # stand-ins for the Postgres functions in backend/supabase/migrations
+        self.rpc_calls.append((fn, params))
+        if fn == "delete_deck":
+            # the deck is owned when the canned flashcard_decks response has rows
+            return FakeRpc(bool(self.responses.get("flashcard_decks", {}).get("data")), self)
+        raise ValueError(f"Unknown rpc {fn}")
+
+def make_upload(content: bytes, filename: str = "notes.pdf") -> UploadFile:
+    """
+    Builds an in-memory UploadFile. A spooled file keeps file.read() off the anyio
+    threadpool, whose idle worker would otherwise keep the test process alive.
+    """
+    spooled = tempfile.SpooledTemporaryFile()
+    spooled.write(content)
+    spooled.seek(0)
+    return UploadFile(file=spooled, filename=filename)
 
 #Test runners
 def run_test(test_func):
@@ -96,24 +164,21 @@ def test_create_deck_success():
         "updated_at": "2025-03-09T00:00:00"
     }
     fake_response = {"data": [fake_deck]}
-    # override the global supabase object in your module with the fake
-    import decks
-    decks.supabase = FakeSupabase({"flashcard_decks": fake_response})
-    
+    supabase = FakeSupabase({"flashcard_decks": fake_response})
+
     deck_data = DeckCreate(name="Test Deck", category="Test", description="A test deck")
-    result = create_deck(deck_data, user_id="e13a4297-16ae-4342-8fbf-f45587048596")
+    result = asyncio.run(create_deck(deck_data, user_id="e13a4297-16ae-4342-8fbf-f45587048596", supabase=supabase))
     assert result["name"] == "Test Deck", "Deck name should match"
     assert result["id"] == "fake-deck-id", "Deck ID should match the fake response"
 
 def test_create_deck_failure():
     # Simulate a failure, nothing returned
     fake_response = {"data": None}
-    import decks
-    decks.supabase = FakeSupabase({"flashcard_decks": fake_response})
-    
+    supabase = FakeSupabase({"flashcard_decks": fake_response})
+
     deck_data = DeckCreate(name="Test Deck", category="Test", description="A test deck")
     try:
-        create_deck(deck_data, user_id="e13a4297-16ae-4342-8fbf-f45587048596")
+        asyncio.run(create_deck(deck_data, user_id="e13a4297-16ae-4342-8fbf-f45587048596", supabase=supabase))
         assert False, "Expected HTTPException to be raised"
     except HTTPException as e:
         assert e.status_code == status.HTTP_400_BAD_REQUEST
@@ -129,11 +194,12 @@ def test_get_user_decks_success():
         "updated_at": "2025-03-09T00:00:00"
     }
     fake_response = {"data": [fake_deck]}
-    import decks
-    decks.supabase = FakeSupabase({"flashcard_decks": fake_response})
-    
-    result = get_user_decks(user_id="e13a4297-16ae-4342-8fbf-f45587048596")
-    assert isinstance(result, list) and len(result) == 1, "Expected one deck in the list"
+    supabase = FakeSupabase({"flashcard_decks": fake_response})
+    get_response_cache().clear()
+
+    result = asyncio.run(get_user_decks(user_id="e13a4297-16ae-4342-8fbf-f45587048596", supabase=supabase))
+    decks_out = json.loads(result.body)
+    assert isinstance(decks_out, list) and len(decks_out) == 1, "Expected one deck in the list"
 
 def test_delete_deck_success():
     # Simulate deck existence and successful deletions.
@@ -143,24 +209,31 @@ def test_delete_deck_success():
         "flashcard_decks": fake_deck_response,
         "flashcards": fake_flashcard_response
     }
-    import decks
-    decks.supabase = FakeSupabase(responses)
-    
-    result = delete_deck("deck1", user_id="e13a4297-16ae-4342-8fbf-f45587048596")
+    supabase = FakeSupabase(responses)
+
+    result = asyncio.run(delete_deck("deck1", user_id="e13a4297-16ae-4342-8fbf-f45587048596", supabase=supabase))
     assert "detail" in result and "deleted successfully" in result["detail"]
+    assert supabase.rpc_calls == [("delete_deck", {"p_deck_id": "deck1", "p_user_id": "e13a4297-16ae-4342-8fbf-f45587048596"})]
+    assert not supabase.tables, "Deletion should be a single rpc round trip"
 
 def test_delete_deck_failure():
     # Simulate deck not found.
     fake_deck_response = {"data": []}
-    import decks
-    decks.supabase = FakeSupabase({"flashcard_decks": fake_deck_response})
-    
+    supabase = FakeSupabase({"flashcard_decks": fake_deck_response})
+
     try:
-        delete_deck("deck1", user_id="e13a4297-16ae-4342-8fbf-f45587048596")
+        asyncio.run(delete_deck("deck1", user_id="e13a4297-16ae-4342-8fbf-f45587048596", supabase=supabase))
         assert False, "Expected HTTPException for deck not found"
     except HTTPException as e:
         assert e.status_code == status.HTTP_404_NOT_FOUND
 
+    supabase = FakeSupabase({"flashcard_decks": {"data": [{"id": "deck1"}]}}, failures=1)
+    try:
+        asyncio.run(delete_deck("deck1", user_id="e13a4297-16ae-4342-8fbf-f45587048596", supabase=supabase))
+        assert False, "Expected HTTPException for a failed rpc"
+    except HTTPException as e:
+        assert e.status_code == status.HTTP_500_INTERNAL_SERVER_ERROR
+
 def test_update_deck_success():
     updated_deck = {
         "id": "deck1",
@@ -172,11 +245,10 @@ def test_update_deck_success():
         "updated_at": "2025-03-09T00:00:00"
     }
     fake_response = {"data": [updated_deck]}
-    import decks
-    decks.supabase = FakeSupabase({"flashcard_decks": fake_response})
-    
+    supabase = FakeSupabase({"flashcard_decks": fake_response})
+
     deck_update = DeckUpdate(name="Updated Deck", description="Updated description")
-    result = update_deck("deck1", deck_update, user_id="e13a4297-16ae-4342-8fbf-f45587048596")
+    result = asyncio.run(update_deck("deck1", deck_update, user_id="e13a4297-16ae-4342-8fbf-f45587048596", supabase=supabase))
     assert result["name"] == "Updated Deck", "Deck name should be updated"
 
 def test_get_deck_flashcards_success():
@@ -193,11 +265,109 @@ def test_get_deck_flashcards_success():
         "flashcard_decks": fake_deck_response,
         "flashcards": {"data": fake_flashcards}
     }
-    import decks
-    decks.supabase = FakeSupabase(responses)
-    
-    result = get_deck_flashcards("deck1", user_id="e13a4297-16ae-4342-8fbf-f45587048596")
-    assert isinstance(result, list) and len(result) == 1, "Should return one flashcard"
+    supabase = FakeSupabase(responses)
+    get_response_cache().clear()
+
+    result = asyncio.run(get_deck_flashcards("deck1", user_id="e13a4297-16ae-4342-8fbf-f45587048596", supabase=supabase))
+    flashcards_out = json.loads(result.body)
+    assert isinstance(flashcards_out, list) and len(flashcards_out) == 1, "Should return one flashcard"
+
+def test_get_deck_flashcards_pagination():
+    fake_flashcards = [{
+        "id": f"fc{i}",
+        "deck_id": "deck1",
+        "question": f"Q{i}",
+        "answer": f"A{i}",
+        "created_at": "2025-03-09T00:00:00",
+        "updated_at": "2025-03-09T00:00:00"
+    } for i in range(3)]
+    supabase = FakeSupabase({
+        "flashcard_decks": {"data": [{"id": "deck1"}]},
+        "flashcards": {"data": fake_flashcards}
+    })
+
+    get_response_cache().clear()
+
+    # the fake returns limit + 1 rows, so there is a next page
+    result = asyncio.run(get_deck_flashcards("deck1", limit=2, user_id="e13a4297-16ae-4342-8fbf-f45587048596", supabase=supabase))
+    assert [row["id"] for row in json.loads(result.body)] == ["fc0", "fc1"], "Expected the first two flashcards"
+    cursor = result.headers.get(decks.NEXT_CURSOR_HEADER)
+    assert cursor, "Expected a cursor for the next page"
+
+    asyncio.run(get_deck_flashcards("deck1", limit=2, cursor=cursor, user_id="e13a4297-16ae-4342-8fbf-f45587048596", supabase=supabase))
+    query = supabase.tables[-1].called_methods
+    assert ("limit", 3) in query, "Pages should fetch one extra row"
+    keyset_filter = [args for name, args in query if name == "or_"][0]
+    assert 'id.gt."fc1"' in keyset_filter, "The next page should start after the cursor row"
+
+    try:
+        asyncio.run(get_deck_flashcards("deck1", cursor="not-a-cursor", user_id="e13a4297-16ae-4342-8fbf-f45587048596", supabase=supabase))
+        assert False, "Expected HTTPException for a malformed cursor"
+    except HTTPException as e:
+        assert e.status_code == status.HTTP_400_BAD_REQUEST
+
+def test_get_user_decks_fields():
+    supabase = FakeSupabase({"flashcard_decks": {"data": [
+        {"id": "deck1", "name": "Test Deck", "created_at": "2025-03-09T00:00:00"}
+    ]}})
+    get_response_cache().clear()
+
+    result = asyncio.run(get_user_decks(fields="name", user_id="e13a4297-16ae-4342-8fbf-f45587048596", supabase=supabase))
+    assert json.loads(result.body)[0]["name"] == "Test Deck", "Partial rows should skip the full response model"
+    assert ("select", "name,created_at,id") in supabase.tables[-1].called_methods
+
+    try:
+        asyncio.run(get_user_decks(fields="name,password", user_id="e13a4297-16ae-4342-8fbf-f45587048596", supabase=supabase))
+        assert False, "Expected HTTPException for an unknown field"
+    except HTTPException as e:
+        assert e.status_code == status.HTTP_400_BAD_REQUEST
+
+def test_get_deck_flashcards_etag():
+    get_response_cache().clear()
+    fake_flashcards = [{
+        "id": "fc1",
+        "deck_id": "deck1",
+        "question": "Q1",
+        "answer": "A1",
+        "created_at": "2025-03-09T00:00:00",
+        "updated_at": "2025-03-09T00:00:00"
+    }]
+    supabase = FakeSupabase({
+        "flashcard_decks": {"data": [{"id": "deck1"}]},
+        "flashcards": {"data": fake_flashcards}
+    })
+
+    first = asyncio.run(get_deck_flashcards("deck1", user_id="e13a4297-16ae-4342-8fbf-f45587048596", supabase=supabase))
+    etag = first.headers["ETag"]
+    assert first.status_code == 200 and etag
+
+    # unchanged deck: 304 straight from the response cache, no flashcards query
+    queries = len(supabase.tables)
+    second = asyncio.run(get_deck_flashcards("deck1", if_none_match=etag, user_id="e13a4297-16ae-4342-8fbf-f45587048596", supabase=supabase))
+    assert second.status_code == status.HTTP_304_NOT_MODIFIED and not second.body
+    assert len(supabase.tables) == queries, "A cached page should not hit supabase"
+
+    # a write invalidates the cached page and the ETag changes
+    asyncio.run(create_flashcards("deck1", [FlashcardCreate(question="Q2", answer="A2")], user_id="e13a4297-16ae-4342-8fbf-f45587048596", supabase=supabase))
+    supabase.responses["flashcards"] = {"data": fake_flashcards + [{**fake_flashcards[0], "id": "fc2", "question": "Q2"}]}
+    third = asyncio.run(get_deck_flashcards("deck1", if_none_match=etag, user_id="e13a4297-16ae-4342-8fbf-f45587048596", supabase=supabase))
+    assert third.status_code == 200 and third.headers["ETag"] != etag, "Expected fresh content after a write"
+    assert len(json.loads(third.body)) == 2
+
+def test_build_page_fast_path():
+    rows = [{
+        "id": f"fc{i}",
+        "deck_id": "deck1",
+        "question": f"Q{i}",
+        "answer": f"A{i}",
+        "created_at": "2025-03-09T00:00:00+00:00",
+        "updated_at": "2025-03-09T00:00:00+00:00"
+    } for i in range(3)]
+    validated = json.loads(decks.build_page(rows, None, decks.FlashcardOut, partial=False, fast=False).body)
+    fast = json.loads(decks.build_page(rows, None, decks.FlashcardOut, partial=False, fast=True).body)
+    assert [row["id"] for row in fast] == [row["id"] for row in validated]
+    assert all(set(row) == set(decks.FlashcardOut.model_fields) for row in fast), "Fast rows should match the response model"
+    assert datetime.fromisoformat(fast[0]["created_at"]) == datetime.fromisoformat(validated[0]["created_at"].replace("Z", "+00:00"))
 
 def test_create_flashcards_success():
     # simulate deck existence and successful flashcard insertion.
@@ -224,19 +394,327 @@ def test_create_flashcards_success():
         "flashcard_decks": fake_deck_response,
         "flashcards": fake_flashcards_response
     }
-    import decks
-    decks.supabase = FakeSupabase(responses)
-    
+    supabase = FakeSupabase(responses)
+
     flashcards = [
         FlashcardCreate(question="Q1", answer="A1"),
         FlashcardCreate(question="Q2", answer="A2")
     ]
-    result = create_flashcards("deck1", flashcards, user_id="e13a4297-16ae-4342-8fbf-f45587048596")
+    result = asyncio.run(create_flashcards("deck1", flashcards, user_id="e13a4297-16ae-4342-8fbf-f45587048596", supabase=supabase))
     assert isinstance(result, list) and len(result) == 2, "Expected two flashcards created"
 
+def test_deck_ownership_is_cached():
+    get_deck_ownership_cache().clear()
+    responses = {
+        "flashcard_decks": {"data": [{"id": "deck1"}]},
+        "flashcards": {"data": []}
+    }
+    supabase = FakeSupabase(responses)
+
+    for _ in range(3):
+        asyncio.run(get_deck_flashcards("deck1", user_id="e13a4297-16ae-4342-8fbf-f45587048596", supabase=supabase))
+    deck_checks = [table for table in supabase.tables if table.table_name == "flashcard_decks"]
+    assert len(deck_checks) == 1, f"Expected one ownership query, got {len(deck_checks)}"
+
+    # deleting the deck invalidates the cached ownership
+    asyncio.run(delete_deck("deck1", user_id="e13a4297-16ae-4342-8fbf-f45587048596", supabase=supabase))
+    supabase.responses["flashcard_decks"] = {"data": []}
+    try:
+        asyncio.run(get_deck_flashcards("deck1", user_id="e13a4297-16ae-4342-8fbf-f45587048596", supabase=supabase))
+        assert False, "Expected HTTPException for a deleted deck"
+    except HTTPException as e:
+        assert e.status_code == status.HTTP_404_NOT_FOUND
+
+def test_delete_deck_invalidates_after_rpc():
+    get_deck_ownership_cache().clear()
+    user_id = "e13a4297-16ae-4342-8fbf-f45587048596"
+    supabase = FakeSupabase({"flashcard_decks": {"data": [{"id": "deck1"}]}, "flashcards": {"data": []}})
+
+    class RacingRpc(FakeRpc):
+        async def execute(self):
+            # a read landing while the delete runs caches the deck again
+            get_deck_ownership_cache().remember(user_id, "deck1")
+            get_response_cache().put(("decks", user_id), (None,), "stale page")
+            return await super().execute()
+
+    supabase.rpc = lambda fn, params: RacingRpc(True, supabase)
+    asyncio.run(delete_deck("deck1", user_id=user_id, supabase=supabase))
+    assert not get_deck_ownership_cache().is_owner(user_id, "deck1"), "Ownership cached during the delete should be dropped"
+    assert get_response_cache().get(("decks", user_id), (None,)) is None, "Pages cached during the delete should be dropped"
+
+def test_bulk_insert_batches_and_retries():
+    rows = [{"id": f"fc{i}", "deck_id": "deck1", "question": f"Q{i}", "answer": f"A{i}"} for i in range(5)]
+    # every fake batch write reports a single row
+    supabase = FakeSupabase({"flashcards": {"data": [{"id": "written"}]}}, failures=1)
+
+    result = asyncio.run(bulk_insert(supabase, "flashcards", rows, batch_rows=2, concurrency=1, retry_delay=0))
+    assert result.batches == 3, f"Expected 5 rows in 3 batches, got {result.batches}"
+    assert result.inserted == 3 and not result.failed_ids, "The failed batch should succeed on retry"
+    upserts = [table for table in supabase.tables if table.called_methods[0][0] == "upsert"]
+    assert len(upserts) == 1 and upserts[0].insert_data == rows[:2], "The retry should upsert the same rows"
+
+    supabase = FakeSupabase({"flashcards": {"data": [{"id": "written"}]}}, failures=1)
+    result = asyncio.run(bulk_insert(supabase, "flashcards", rows, batch_rows=2, concurrency=1, max_attempts=1))
+    assert result.failed_ids == ["fc0", "fc1"], "Rows of a batch that never landed should be reported"
+    assert result.inserted == 2 and result.failed_batches == 1
+
+def test_bulk_insert_retries_only_transient_errors():
+    rows = [{"id": f"fc{i}", "deck_id": "deck1", "question": f"Q{i}", "answer": f"A{i}"} for i in range(2)]
+
+    violation = lambda: APIError({"code": "23503", "message": "insert or update violates foreign key constraint"})
+    supabase = FakeSupabase({"flashcards": {"data": [{"id": "written"}]}}, failures=3, failure=violation)
+    result = asyncio.run(bulk_insert(supabase, "flashcards", rows, concurrency=1, retry_delay=0))
+    assert result.failed_ids == ["fc0", "fc1"] and len(supabase.tables) == 1, "A constraint violation should not be retried"
+
+    for transient in (lambda: APIError({"code": 503, "message": "JSON could not be generated"}),
+                      lambda: APIError({"code": "PGRST003", "message": "Timed out acquiring connection from connection pool."}),
+                      lambda: httpx.ReadTimeout("timed out")):
+        supabase = FakeSupabase({"flashcards": {"data": [{"id": "written"}]}}, failures=1, failure=transient)
+        result = asyncio.run(bulk_insert(supabase, "flashcards", rows, concurrency=1, retry_delay=0))
+        assert result.inserted == 1 and len(supabase.tables) == 2, f"{transient()!r} should be retried"
+
+def test_upload_size_limit_middleware():
+    from fastapi import FastAPI, File
+    from fastapi.testclient import TestClient
+    from app.services.upload_service import UploadSizeLimitMiddleware
+
+    app = FastAPI()
+    app.add_middleware(UploadSizeLimitMiddleware, max_bytes=1024)
+
+    @app.post("/upload")
+    async def upload(file: UploadFile = File(...)):
+        return {"size": len(await file.read())}
+
+    client = TestClient(app)
+    assert client.post("/upload", files={"file": ("small.pdf", b"x" * 100)}).status_code == 200
+    response = client.post("/upload", files={"file": ("big.pdf", b"x" * 4096)})
+    assert response.status_code == 413, f"Expected 413 for an oversized upload, got {response.status_code}"
+
+    # without a Content-Length the limit is enforced on the streamed body
+    def body_chunks():
+        for _ in range(8):
+            yield b"x" * 512
+    response = client.post("/upload", content=body_chunks(), headers={"Content-Type": "multipart/form-data; boundary=b"})
+    assert response.status_code == 413, f"Expected 413 for an oversized streamed body, got {response.status_code}"
+
+def test_request_metrics_middleware():
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from app.core.metrics import HTTP_DURATION, RequestMetricsMiddleware
+    from app.core.request_context import current_request_id
+
+    app = FastAPI()
+    app.add_middleware(RequestMetricsMiddleware)
+
+    @app.get("/api/items/{item_id}")
+    async def item(item_id: str):
+        return {"request_id": current_request_id()}
+
+    client = TestClient(app)
+    response = client.get("/api/items/1", headers={"X-Request-ID": "abc-123"})
+    assert response.headers["X-Request-ID"] == "abc-123"
+    assert response.json()["request_id"] == "abc-123", "The handler should see the request id"
+
+    response = client.get("/api/items/2", headers={"X-Request-ID": "not a valid id!"})
+    assert response.headers["X-Request-ID"] != "not a valid id!" and len(response.headers["X-Request-ID"]) == 32
+    assert HTTP_DURATION.count(method="GET", route="/api/items/{item_id}", status=200) == 2, "Latency should be recorded per route template"
+
+def test_create_flashcards_from_file_queues_job():
+    fake_deck_response = {"data": [{"id": "deck1"}]}
+    fake_flashcards_response = {"data": [{"id": "fc1"}, {"id": "fc2"}]}
+    import decks
+    supabase = FakeSupabase({
+        "flashcard_decks": fake_deck_response,
+        "flashcards": fake_flashcards_response
+    })
+
+    uploads = []
+
+    async def fake_process_file(upload, progress=None, chunker=None):
+        with upload.open() as stream:
+            assert stream.read() == b"%PDF-1.4 fake", "The job should read the spooled upload"
+        uploads.append(upload)
+        progress["pages_parsed"] = 1
+        record_completion("chunk_text", "gpt-4o", SimpleNamespace(prompt_tokens=1000, completion_tokens=1000))
+        record_completion("flashcard_batch", "gpt-4o", SimpleNamespace(prompt_tokens=2000, completion_tokens=200))
+        return FlashcardResults(flashcards=[("Q1", "A1"), ("Q2", "A2")], failed_chunks=[2])
+    decks.process_file = fake_process_file
+
+    async def upload_and_wait():
+        upload = make_upload(b"%PDF-1.4 fake")
+        job = await create_flashcards_from_file("deck1", upload, chunker=None, user_id="e13a4297-16ae-4342-8fbf-f45587048596", supabase=supabase)
+        assert job["status"] == "queued", "Upload should return before the job runs"
+        await get_job_manager().join()
+        return job["id"]
+
+    job_id = asyncio.run(upload_and_wait())
+    result = asyncio.run(get_job_status(job_id, user_id="e13a4297-16ae-4342-8fbf-f45587048596"))
+    assert result["status"] == "completed", f"Expected completed job, got {result['status']}: {result['error']}"
+    assert result["progress"]["cards_inserted"] == 2, "Expected two inserted flashcards"
+    assert result["failed_chunks"] == [2], "Failed chunks should be reported on the job"
+    assert uploads and uploads[0].path is None and uploads[0]._data is None, "The job should release its upload"
+    assert get_ingestion_admission().active == 0, "A finished job should release its admission slot"
+    usage = result["usage"]
+    assert usage["total"]["requests"] == 2 and usage["total"]["prompt_tokens"] == 3000
+    assert usage["stages"]["flashcard_batch"]["completion_tokens"] == 200
+    assert abs(usage["total"]["cost_usd"] - (3000 * 2.5 + 1200 * 10) / 1_000_000) < 1e-9
+    saved = [table.insert_data for table in supabase.tables if table.table_name == "ingestion_usage"]
+    assert len(saved) == 1 and saved[0]["job_id"] == job_id and saved[0]["prompt_tokens"] == 3000, "Usage should be saved against the job"
+
+    try:
+        asyncio.run(get_job_status(job_id, user_id="someone-else"))
+        assert False, "Expected HTTPException for a job owned by another user"
+    except HTTPException as e:
+        assert e.status_code == status.HTTP_404_NOT_FOUND
+
+def test_create_flashcards_from_file_drops_near_duplicates():
+    import decks
+    supabase = FakeSupabase({
+        "flashcard_decks": {"data": [{"id": "deck1"}]},
+        "flashcards": {"data": [{"id": "fc0", "question": "What is photosynthesis?", "answer": "Light to sugar", "created_at": "2025-03-01T00:00:00+00:00"}]}
+    })
+
+    async def fake_process_file(upload, progress=None, chunker=None):
+        return FlashcardResults(flashcards=[
+            ("What is photosynthesis ?", "Light to sugar"),
+            ("Where does the Krebs cycle take place?", "Mitochondrial matrix"),
+            ("Where does the Krebs cycle take place", "Mitochondrial matrix."),
+            ("What enzyme fixes carbon dioxide?", "RuBisCO"),
+        ], failed_chunks=[])
+    decks.process_file = fake_process_file
+
+    async def upload_and_wait():
+        job = await create_flashcards_from_file("deck1", make_upload(b"%PDF-1.4 fake"), chunker=None, user_id="e13a4297-16ae-4342-8fbf-f45587048596", supabase=supabase)
+        await get_job_manager().join()
+        return job["id"]
+
+    job_id = asyncio.run(upload_and_wait())
+    result = asyncio.run(get_job_status(job_id, user_id="e13a4297-16ae-4342-8fbf-f45587048596"))
+    assert result["status"] == "completed", f"Expected completed job, got {result['status']}: {result['error']}"
+    assert result["progress"]["duplicates_dropped"] == 2, "Expected one repeat of a deck card and one repeat within the file"
+    inserted = [table.insert_data for table in supabase.tables if hasattr(table, "insert_data")][0]
+    assert [row["question"] for row in inserted] == ["Where does the Krebs cycle take place?", "What enzyme fixes carbon dioxide?"]
+
+def test_create_flashcards_from_file_all_duplicates():
+    import decks
+    supabase = FakeSupabase({
+        "flashcard_decks": {"data": [{"id": "deck1"}]},
+        "flashcards": {"data": [{"id": "fc0", "question": "What is photosynthesis?", "answer": "Light to sugar", "created_at": "2025-03-01T00:00:00+00:00"}]}
+    })
+
+    async def fake_process_file(upload, progress=None, chunker=None):
+        return FlashcardResults(flashcards=[("What is photosynthesis?", "Light to sugar")], failed_chunks=[])
+    decks.process_file = fake_process_file
+
+    async def upload_and_wait():
+        job = await create_flashcards_from_file("deck1", make_upload(b"%PDF-1.4 fake"), chunker=None, user_id="e13a4297-16ae-4342-8fbf-f45587048596", supabase=supabase)
+        await get_job_manager().join()
+        return job["id"]
+
+    job_id = asyncio.run(upload_and_wait())
+    result = asyncio.run(get_job_status(job_id, user_id="e13a4297-16ae-4342-8fbf-f45587048596"))
+    assert result["status"] == "completed", f"Re-uploading known cards should not fail the job: {result['error']}"
+    assert result["progress"]["duplicates_dropped"] == 1 and result["progress"]["cards_inserted"] == 0
+    assert not any(table.table_name == "flashcards" and hasattr(table, "insert_data") for table in supabase.tables), "Nothing should be inserted"
+
+def test_create_flashcards_from_file_admission():
+    supabase = FakeSupabase({"flashcard_decks": {"data": [{"id": "deck1"}]}})
+    user_id = "e13a4297-16ae-4342-8fbf-f45587048596"
+
+    try:
+        asyncio.run(create_flashcards_from_file("deck1", make_upload(b"hello", "notes.txt"), chunker=None, user_id=user_id, supabase=supabase))
+        assert False, "Expected HTTPException for an unsupported file type"
+    except HTTPException as e:
+        assert e.status_code == status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+
+    admission = get_ingestion_admission()
+    for _ in range(admission.max_active_per_user):
+        admission.admit(user_id)
+    try:
+        asyncio.run(create_flashcards_from_file("deck1", make_upload(b"%PDF-1.4 fake"), chunker=None, user_id=user_id, supabase=supabase))
+        assert False, "Expected HTTPException past the per-user ingestion cap"
+    except HTTPException as e:
+        assert e.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+        assert int(e.headers["Retry-After"]) >= 1
+    finally:
+        for _ in range(admission.max_active_per_user):
+            admission.release(user_id)
+
+    # an empty file gives its slot back
+    try:
+        asyncio.run(create_flashcards_from_file("deck1", make_upload(b""), chunker=None, user_id=user_id, supabase=supabase))
+        assert False, "Expected HTTPException for an empty file"
+    except HTTPException as e:
+        assert e.status_code == status.HTTP_400_BAD_REQUEST
+    assert admission.active == 0, "Rejected uploads should not hold an admission slot"
+
+def test_stream_flashcards_from_file():
+    fake_deck_response = {"data": [{"id": "deck1"}]}
+    fake_flashcards_response = {"data": [{"id": "fc1"}]}
+    import decks
+    supabase = FakeSupabase({
+        "flashcard_decks": fake_deck_response,
+        "flashcards": fake_flashcards_response
+    })
+    decks.STREAM_INSERT_BATCH_SIZE = 2
+
+    async def fake_stream_file_flashcards(upload, progress=None, chunker=None):
+        for i in range(3):
+            yield i, (f"Q{i}", f"A{i}")
+        yield 3, None
+    decks.stream_file_flashcards = fake_stream_file_flashcards
+
+    async def collect_events():
+        upload = make_upload(b"%PDF-1.4 fake")
+        response = await stream_flashcards_from_file("deck1", upload, chunker=None, user_id="e13a4297-16ae-4342-8fbf-f45587048596", supabase=supabase)
+        assert response.media_type == "text/event-stream"
+        return [chunk async for chunk in response.body_iterator]
+
+    events = asyncio.run(collect_events())
+    flashcard_events = [event for event in events if event.startswith("event: flashcard")]
+    assert len(flashcard_events) == 3, "Expected one event per generated flashcard"
+    assert '"question": "Q0"' in flashcard_events[0]
+    # two batches (2 + 1 cards), each fake insert reports one row
+    assert any(event.startswith("event: chunk_failed") for event in events), "Failed chunks should be reported"
+    assert events[-1].startswith("event: done") and '"cards_inserted": 2' in events[-1]
+    assert '"failed_chunks": [3]' in events[-1]
+    assert get_ingestion_admission().active == 0, "A finished stream should release its admission slot"
+
+
+def test_stream_releases_admission_on_early_disconnect():
+    import decks
+    supabase = FakeSupabase({"flashcard_decks": {"data": [{"id": "deck1"}]}, "flashcards": {"data": []}})
+
+    async def slow_stream_file_flashcards(upload, progress=None, chunker=None):
+        await asyncio.sleep(10)
+        yield 0, ("Q0", "A0")
+    decks.stream_file_flashcards = slow_stream_file_flashcards
+
+    async def disconnect_before_first_event():
+        response = await stream_flashcards_from_file("deck1", make_upload(b"%PDF-1.4 fake"), chunker=None, user_id="e13a4297-16ae-4342-8fbf-f45587048596", supabase=supabase)
+        assert get_ingestion_admission().active == 1
+
+        async def receive():
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            await asyncio.sleep(0.01)
+
+        await response({"type": "http", "asgi": {"spec_version": "2.3"}}, receive, send)
+
+    asyncio.run(disconnect_before_first_event())
+    assert get_ingestion_admission().active == 0, "A stream abandoned before its first event should release its slot"
+
+
+def test_main_import_defers_ingestion_dependencies():
+    """ Cold starts must not pay for llama_parse, openai or tiktoken, the ingestion path loads them on first use """
+    result, _ = import_main()
+    assert result["lazy_imported"] == [], f"Imported at startup: {result['lazy_imported']} (expected none of {LAZY_MODULES})"
+
 
 #Main function
-async def main():
+def main():
+    # the tests drive the handlers with asyncio.run themselves, so this must not run inside a loop
     run_test(test_create_deck_success)
     run_test(test_create_deck_failure)
     run_test(test_get_user_decks_success)
@@ -244,8 +722,25 @@ async def main():
     run_test(test_delete_deck_failure)
     run_test(test_update_deck_success)
     run_test(test_get_deck_flashcards_success)
+    run_test(test_get_deck_flashcards_pagination)
+    run_test(test_get_user_decks_fields)
+    run_test(test_get_deck_flashcards_etag)
+    run_test(test_build_page_fast_path)
     run_test(test_create_flashcards_success)
+    run_test(test_deck_ownership_is_cached)
+    run_test(test_delete_deck_invalidates_after_rpc)
+    run_test(test_bulk_insert_batches_and_retries)
+    run_test(test_bulk_insert_retries_only_transient_errors)
+    run_test(test_upload_size_limit_middleware)
+    run_test(test_request_metrics_middleware)
+    run_test(test_create_flashcards_from_file_queues_job)
+    run_test(test_create_flashcards_from_file_drops_near_duplicates)
+    run_test(test_create_flashcards_from_file_all_duplicates)
+    run_test(test_create_flashcards_from_file_admission)
+    run_test(test_stream_flashcards_from_file)
+    run_test(test_stream_releases_admission_on_early_disconnect)
+    run_test(test_main_import_defers_ingestion_dependencies)
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    main()
@@ -0,0 +1,193 @@
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from app.core.request_context import log
+
+
+COMPLETION_CACHE_ENABLED = os.getenv("COMPLETION_CACHE_ENABLED", "true").lower() == "true"
+COMPLETION_CACHE_PATH = os.getenv(
+    "COMPLETION_CACHE_PATH",
+    os.path.join(tempfile.gettempdir(), "quickthink_completion_cache.sqlite3")
+)
+COMPLETION_CACHE_TTL_SECONDS = int(os.getenv("COMPLETION_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+COMPLETION_CACHE_MAX_BYTES = int(os.getenv("COMPLETION_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+# eviction scans the table, so only run it every this many writes
+COMPLETION_CACHE_EVICT_EVERY = 100
+# hits only queue their recency update, queued updates are written in one transaction this often
+COMPLETION_CACHE_TOUCH_EVERY = 100
+
+
+def completion_key(model: str, prompt: str) -> str:
+    """ Cache key for a completion: hash of the model name plus the full prompt """
+    return hashlib.sha256(f"{model}\0{prompt}".encode("utf-8")).hexdigest()
+
+
+class CompletionCache:
+    """
+    Persistent SQLite cache of chat completion replies keyed by completion_key.
+    Entries expire after ttl_seconds and the least recently used ones are dropped
+    once the stored replies exceed max_bytes. Hits and misses are counted for stats().
+    A hit doesn't write: its last_accessed update is queued and flushed with the next
+    write, before eviction, or once COMPLETION_CACHE_TOUCH_EVERY hits have queued up.
+    The methods block on SQLite (a write commits, so it waits for an fsync) and are safe to
+    call from worker threads, async callers run them with asyncio.to_thread.
+    """
+
+    def __init__(self, path: str, ttl_seconds: int, max_bytes: int, enabled: bool = True):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._touched = {}
+        self._conn = None
+        # one connection shared by the worker threads, used by one of them at a time
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS completions ("
+                "key TEXT PRIMARY KEY, model TEXT, response TEXT, size INTEGER, "
+                "created_at REAL, last_accessed REAL)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def get(self, model: str, prompt: str):
+        """
+        Returns the cached reply for (model, prompt), or None on a miss or expired entry.
+        """
+        if not self.enabled:
+            return None
+
+        key = completion_key(model, prompt)
+        now = time.time()
+        try:
+            with self._lock:
+                row = self._read(key, now)
+        except sqlite3.Error as e:
+            log("Completion cache read failed:", str(e))
+            row = None
+
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return row[0]
+
+    def _read(self, key: str, now: float):
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT response, created_at FROM completions WHERE key = ?", (key,)
+        ).fetchone()
+        if row is not None and now - row[1] > self.ttl_seconds:
+            # left for evict() to delete, a read shouldn't write
+            return None
+        if row is not None:
+            self._touched[key] = now
+            if len(self._touched) >= COMPLETION_CACHE_TOUCH_EVERY:
+                self._flush_touches()
+                conn.commit()
+        return row
+
+    def put(self, model: str, prompt: str, response: str):
+        """
+        Stores a reply. Failures are logged and ignored, the cache is best effort.
+        """
+        if not self.enabled:
+            return
+
+        now = time.time()
+        try:
+            with self._lock:
+                conn = self._connection()
+                # rides along in this write's transaction
+                self._flush_touches()
+                conn.execute(
+                    "INSERT OR REPLACE INTO completions (key, model, response, size, created_at, last_accessed) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (completion_key(model, prompt), model, response, len(response.encode("utf-8")), now, now)
+                )
+                conn.commit()
+                self._writes += 1
+                if self._writes % COMPLETION_CACHE_EVICT_EVERY == 0:
+                    self._evict()
+        except sqlite3.Error as e:
+            log("Completion cache write failed:", str(e))
+
+    def _flush_touches(self):
+        """ Writes the queued last_accessed updates, the caller commits """
+        if self._touched:
+            touched, self._touched = self._touched, {}
+            self._connection().executemany(
+                "UPDATE completions SET last_accessed = ? WHERE key = ?",
+                [(accessed, key) for key, accessed in touched.items()]
+            )
+
+    def evict(self):
+        """
+        Drops expired entries, then the least recently used ones until under max_bytes.
+        """
+        with self._lock:
+            self._evict()
+
+    def _evict(self):
+        conn = self._connection()
+        # recency has to be current before picking the least recently used entries
+        self._flush_touches()
+        conn.execute("DELETE FROM completions WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+
+        total_size = conn.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]
+        if total_size > self.max_bytes:
+            stale_keys = []
+            for key, size in conn.execute("SELECT key, size FROM completions ORDER BY last_accessed"):
+                if total_size <= self.max_bytes:
+                    break
+                stale_keys.append((key,))
+                total_size -= size
+            conn.executemany("DELETE FROM completions WHERE key = ?", stale_keys)
+        conn.commit()
+
+    def stats(self) -> dict:
+        entries = 0
+        size = 0
+        if self.enabled:
+            try:
+                with self._lock:
+                    entries, size = self._connection().execute(
+                        "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM completions"
+                    ).fetchone()
+            except sqlite3.Error:
+                pass
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": entries,
+            "bytes": size,
+        }
+
+
+_completion_cache = None
+
+
+def get_completion_cache() -> CompletionCache:
+    """ Returns the process wide completion cache """
+    global _completion_cache
+    if _completion_cache is None:
+        _completion_cache = CompletionCache(
+            COMPLETION_CACHE_PATH,
+            COMPLETION_CACHE_TTL_SECONDS,
+            COMPLETION_CACHE_MAX_BYTES,
+            enabled=COMPLETION_CACHE_ENABLED
+        )
+    return _completion_cache
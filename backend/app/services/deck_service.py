@@ -0,0 +1,280 @@
+import asyncio
+import base64
+import binascii
+import json
+import os
+import random
+import time
+from collections import OrderedDict
+from typing import Iterable, List, Optional
+
+import httpx
+from fastapi import HTTPException, status
+from postgrest.exceptions import APIError
+from pydantic import BaseModel
+
+from app.core.request_context import log
+
+
+DECK_OWNERSHIP_CACHE_TTL_SECONDS = float(os.getenv("DECK_OWNERSHIP_CACHE_TTL_SECONDS", "60"))
+DECK_OWNERSHIP_CACHE_MAX_ENTRIES = int(os.getenv("DECK_OWNERSHIP_CACHE_MAX_ENTRIES", "10000"))
+PAGE_SIZE_DEFAULT = int(os.getenv("PAGE_SIZE_DEFAULT", "100"))
+PAGE_SIZE_MAX = int(os.getenv("PAGE_SIZE_MAX", "1000"))
+# listings are ordered by these columns, so they are always selected to build the next cursor
+KEYSET_COLUMNS = ("created_at", "id")
+# bulk inserts are split so no single PostgREST request gets too large
+BULK_INSERT_BATCH_ROWS = int(os.getenv("BULK_INSERT_BATCH_ROWS", "500"))
+BULK_INSERT_BATCH_BYTES = int(os.getenv("BULK_INSERT_BATCH_BYTES", str(512 * 1024)))
+BULK_INSERT_CONCURRENCY = int(os.getenv("BULK_INSERT_CONCURRENCY", "4"))
+BULK_INSERT_MAX_ATTEMPTS = int(os.getenv("BULK_INSERT_MAX_ATTEMPTS", "3"))
+BULK_INSERT_RETRY_DELAY = float(os.getenv("BULK_INSERT_RETRY_DELAY", "0.5"))
+# SQLSTATE classes that clear on their own: connection exceptions, transaction rollbacks (serialization
+# failures, deadlocks), insufficient resources, operator intervention (statement timeouts) and system errors
+TRANSIENT_SQLSTATE_CLASSES = ("08", "40", "53", "57", "58")
+# PostgREST couldn't reach the database or get a connection from its pool
+TRANSIENT_POSTGREST_CODES = ("PGRST000", "PGRST001", "PGRST002", "PGRST003")
+
+
+class DeckOwnershipCache:
+    """
+    In-process LRU of (user_id, deck_id) pairs known to be owned, each valid for ttl_seconds.
+    Only positive lookups are stored, so a deck created elsewhere is never hidden by the cache;
+    deck writes call invalidate() so a deleted deck stops being reported as owned right away.
+    """
+
+    def __init__(self, ttl_seconds: float, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def is_owner(self, user_id: str, deck_id: str) -> bool:
+        """ True if the pair was confirmed owned less than ttl_seconds ago """
+        key = (user_id, deck_id)
+        expires_at = self._entries.get(key)
+        if expires_at is None or expires_at < time.monotonic():
+            self._entries.pop(key, None)
+            self.misses += 1
+            return False
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return True
+
+    def remember(self, user_id: str, deck_id: str):
+        key = (user_id, deck_id)
+        self._entries[key] = time.monotonic() + self.ttl_seconds
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: str, deck_id: str):
+        self._entries.pop((user_id, deck_id), None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._entries),
+        }
+
+
+_deck_ownership_cache = None
+
+
+def get_deck_ownership_cache() -> DeckOwnershipCache:
+    """ Returns the process wide deck ownership cache """
+    global _deck_ownership_cache
+    if _deck_ownership_cache is None:
+        _deck_ownership_cache = DeckOwnershipCache(DECK_OWNERSHIP_CACHE_TTL_SECONDS, DECK_OWNERSHIP_CACHE_MAX_ENTRIES)
+    return _deck_ownership_cache
+
+
+async def check_deck_owner(supabase, deck_id: str, user_id: str):
+    """
+    Raises a 404 unless the deck belongs to the user. Answers from the ownership cache
+    when it can and only queries flashcard_decks on a miss.
+    """
+    cache = get_deck_ownership_cache()
+    if cache.is_owner(user_id, deck_id):
+        return
+
+    deck_check = await (
+        supabase
+        .table("flashcard_decks")
+        .select("id")
+        .match({"id": deck_id, "user_id": user_id})
+        .execute()
+    )
+    if not deck_check.data:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Deck not found or not owned by user."
+        )
+    cache.remember(user_id, deck_id)
+
+
+def encode_cursor(row: dict) -> str:
+    """ Opaque cursor pointing just after row in (created_at, id) order """
+    raw = json.dumps([row["created_at"], row["id"]]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """ Inverse of encode_cursor, raises a 400 for anything that isn't one of our cursors """
+    try:
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return str(created_at), str(row_id)
+    except (ValueError, TypeError, binascii.Error):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor.")
+
+
+def select_columns(fields: Optional[str], allowed: Iterable[str]) -> str:
+    """
+    Turns a comma separated `fields` query parameter into a PostgREST select list.
+    The keyset columns are always included; None selects every allowed column.
+    """
+    if not fields:
+        return ",".join(allowed)
+
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in requested if field not in allowed]
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown fields: {', '.join(unknown)}."
+        )
+    columns = list(dict.fromkeys(requested + list(KEYSET_COLUMNS)))
+    return ",".join(columns)
+
+
+async def fetch_page(query, limit: int, cursor: Optional[str] = None) -> tuple:
+    """
+    Runs a select query as one keyset page of at most limit rows ordered by (created_at, id).
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        query = query.or_(f'created_at.gt."{created_at}",and(created_at.eq."{created_at}",id.gt."{row_id}")')
+
+    # one extra row tells whether another page follows without a count query
+    response = await query.order("created_at").order("id").limit(limit + 1).execute()
+    rows = response.data or []
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1])
+    return rows, None
+
+
+class BulkInsertResult(BaseModel):
+    """ Aggregate outcome of bulk_insert: the rows written and the ids of the rows that weren't """
+    rows: List[dict]
+    failed_ids: List[str]
+    batches: int
+    failed_batches: int
+
+    @property
+    def inserted(self) -> int:
+        return len(self.rows)
+
+
+def make_insert_batches(rows: list, max_rows: int, max_bytes: int) -> list:
+    """
+    Splits rows into consecutive batches of at most max_rows rows and roughly max_bytes of JSON.
+    A single row larger than max_bytes still gets a batch of its own.
+    """
+    batches = []
+    batch = []
+    batch_bytes = 0
+    for row in rows:
+        row_bytes = len(json.dumps(row, default=str))
+        if batch and (len(batch) >= max_rows or batch_bytes + row_bytes > max_bytes):
+            batches.append(batch)
+            batch = []
+            batch_bytes = 0
+        batch.append(row)
+        batch_bytes += row_bytes
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def is_transient_error(error: Exception) -> bool:
+    """
+    Whether a failed PostgREST request is worth retrying: timeouts, connection errors, 5xx and 429
+    replies and database errors that clear on their own. Constraint, RLS and schema violations never do.
+    """
+    if isinstance(error, APIError):
+        # a reply that wasn't JSON (e.g. a gateway error page) carries the HTTP status as its code
+        if isinstance(error.code, int):
+            return error.code == 429 or error.code >= 500
+        code = str(error.code or "")
+        return code in TRANSIENT_POSTGREST_CODES or code[:2] in TRANSIENT_SQLSTATE_CLASSES
+    return isinstance(error, (httpx.TransportError, ConnectionError, TimeoutError))
+
+
+async def insert_batch(supabase, table_name: str, batch: list, max_attempts: int, retry_delay: float) -> list:
+    """
+    Writes one batch, retrying transient failures with backoff. Rows carry their client side ids, so a
+    retry upserts on id: a batch whose earlier attempt did land is written again instead of failing on
+    duplicates. A permanent failure (see is_transient_error) gives up on the batch right away.
+    """
+    for attempt in range(max_attempts):
+        try:
+            table = supabase.table(table_name)
+            query = table.insert(batch) if attempt == 0 else table.upsert(batch, on_conflict="id")
+            response = await query.execute()
+            if response.data:
+                return response.data
+            error = "empty response"
+        except Exception as e:
+            if not is_transient_error(e):
+                log(f"Insert of {len(batch)} {table_name} rows failed, not retrying:", str(e))
+                return None
+            error = str(e)
+
+        log(f"Insert of {len(batch)} {table_name} rows failed (attempt {attempt + 1}):", error)
+        if attempt + 1 < max_attempts:
+            await asyncio.sleep(retry_delay * (2 ** attempt) * (0.5 + random.random()))
+    return None
+
+
+async def bulk_insert(
+    supabase,
+    table_name: str,
+    rows: list,
+    batch_rows: int = BULK_INSERT_BATCH_ROWS,
+    batch_bytes: int = BULK_INSERT_BATCH_BYTES,
+    concurrency: int = BULK_INSERT_CONCURRENCY,
+    max_attempts: int = BULK_INSERT_MAX_ATTEMPTS,
+    retry_delay: float = BULK_INSERT_RETRY_DELAY
+) -> BulkInsertResult:
+    """
+    Inserts rows in size bounded batches, at most `concurrency` at a time.
+    Every row needs an "id". Batches that still fail after max_attempts are reported, not raised.
+    """
+    batches = make_insert_batches(rows, batch_rows, batch_bytes)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def write(batch):
+        async with semaphore:
+            return await insert_batch(supabase, table_name, batch, max_attempts, retry_delay)
+
+    written = await asyncio.gather(*(write(batch) for batch in batches))
+
+    inserted_rows = []
+    failed_ids = []
+    for batch, batch_rows_written in zip(batches, written):
+        if batch_rows_written is None:
+            failed_ids.extend(row["id"] for row in batch)
+        else:
+            inserted_rows.extend(batch_rows_written)
+    return BulkInsertResult(
+        rows=inserted_rows,
+        failed_ids=failed_ids,
+        batches=len(batches),
+        failed_batches=sum(1 for batch_rows_written in written if batch_rows_written is None)
+    )
@@ -0,0 +1,220 @@
+import asyncio
+import os
+import re
+from typing import TYPE_CHECKING
+
+from app.services.deck_service import PAGE_SIZE_MAX, fetch_page
+
+
+if TYPE_CHECKING:
+    # imported on first use at runtime, only ingestion needs it
+    import numpy as np
+
+
+FLASHCARD_DEDUP_ENABLED = os.getenv("FLASHCARD_DEDUP_ENABLED", "true").lower() == "true"
+# estimated Jaccard similarity of two cards' shingles (question and answer) above which the later card is dropped,
+# high enough that questions differing in one term with different answers (TCP/UDP) are both kept
+FLASHCARD_DEDUP_THRESHOLD = float(os.getenv("FLASHCARD_DEDUP_THRESHOLD", "0.9"))
+FLASHCARD_DEDUP_NUM_PERM = int(os.getenv("FLASHCARD_DEDUP_NUM_PERM", "128"))
+# byte shingles hold up better than word shingles on short questions, 5 bytes fit in a uint64
+SHINGLE_SIZE = 5
+# cards hashed per NumPy batch, bounds the (shingles x permutations) matrix
+SIGNATURE_BATCH_CARDS = 512
+# candidates compared per LSH bucket, keeps templated questions that all share buckets cheap
+MAX_BUCKET_CANDIDATES = 256
+
+
+def normalize_question(text: str) -> str:
+    """ Lowercase, punctuation dropped and whitespace collapsed, so formatting never tells cards apart """
+    return " ".join(re.sub(r"[^\w\s]", " ", text.lower()).split())
+
+
+def card_text(question: str, answer: str) -> str:
+    """ The text a card is compared by, question and answer together """
+    return f"{question}\n{answer}"
+
+
+def shingles(texts: list, size: int = SHINGLE_SIZE) -> tuple:
+    """
+    Every `size` byte window of the normalized texts packed into a uint64, all texts in one array.
+    Returns (shingles, offsets) where offsets[i] is where the shingles of texts[i] start.
+    Texts shorter than a shingle are padded to one.
+    """
+    import numpy as np
+
+    encoded = [normalize_question(text).encode("utf-8").ljust(size) for text in texts]
+    lengths = np.fromiter((len(text) for text in encoded), dtype=np.int64, count=len(encoded))
+    counts = lengths - size + 1
+    text_starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    # position of every window in the joined buffer, windows never cross into the next text
+    positions = np.arange(counts.sum()) + np.repeat(text_starts - offsets, counts)
+    buffer = np.frombuffer(b"".join(encoded), dtype=np.uint8).astype(np.uint64)
+    packed = np.zeros(len(positions), dtype=np.uint64)
+    for byte in range(size):
+        packed |= buffer[positions + byte] << np.uint64(8 * byte)
+    return packed, offsets
+
+
+def lsh_bands(num_perm: int, threshold: float) -> tuple:
+    """
+    Picks (bands, rows) with bands * rows == num_perm whose LSH similarity cutoff (1/b)^(1/r)
+    is the highest one still below threshold, so pairs around the threshold still become candidates.
+    """
+    best = (num_perm, 1)
+    best_cutoff = 0.0
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        cutoff = (1 / bands) ** (1 / rows)
+        if best_cutoff < cutoff <= threshold:
+            best, best_cutoff = (bands, rows), cutoff
+    return best
+
+
+class NearDuplicateIndex:
+    """
+    MinHash/LSH index of flashcards, each indexed as its card_text. Signatures are computed with
+    NumPy in batches, LSH bands narrow the comparisons down to a few candidates per card and the
+    estimated similarity of a candidate is the fraction of signature slots the two cards share.
+    A candidate estimated above the threshold is confirmed on the exact Jaccard similarity of
+    the shingles, so estimation noise never drops a card on its own.
+    Adding a card is roughly constant time, so decks with tens of thousands of cards stay cheap.
+    """
+
+    def __init__(self, threshold: float = FLASHCARD_DEDUP_THRESHOLD, num_perm: int = FLASHCARD_DEDUP_NUM_PERM, seed: int = 1):
+        import numpy as np
+
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands, self.rows = lsh_bands(num_perm, threshold)
+        # a fixed seed keeps signatures comparable between processes and runs
+        rng = np.random.default_rng(seed)
+        # multiply-shift hash functions ((a * x + b) mod 2**64) >> 32, one per permutation
+        self._a = rng.integers(0, np.iinfo(np.uint64).max, size=num_perm, dtype=np.uint64, endpoint=True) | np.uint64(1)
+        self._b = rng.integers(0, np.iinfo(np.uint64).max, size=num_perm, dtype=np.uint64, endpoint=True)
+        # folds the rows of a band into one 64 bit bucket key
+        self._band_mix = rng.integers(0, np.iinfo(np.uint64).max, size=self.rows, dtype=np.uint64, endpoint=True) | np.uint64(1)
+        self._buckets = [{} for _ in range(self.bands)]
+        # signatures of the indexed cards, grown by doubling
+        self._matrix = np.empty((64, num_perm), dtype=np.uint32)
+        # sorted distinct shingles of the indexed cards, for the exact check
+        self._shingles = []
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def signatures(self, texts: list) -> "np.ndarray":
+        """ MinHash signatures of texts as a (len(texts), num_perm) uint32 array """
+        return self._encode(texts)[0]
+
+    def _encode(self, texts: list) -> tuple:
+        """ (signatures, one sorted array of distinct shingles per text) """
+        import numpy as np
+
+        result = np.empty((len(texts), self.num_perm), dtype=np.uint32)
+        shingle_sets = []
+        for start in range(0, len(texts), SIGNATURE_BATCH_CARDS):
+            batch = texts[start:start + SIGNATURE_BATCH_CARDS]
+            packed, offsets = shingles(batch)
+            # uint64 arithmetic wraps around, which is the mod 2**64 of the hash
+            # one contiguous row per permutation, reduceat is much faster along rows
+            permuted = ((self._a[:, None] * packed + self._b[:, None]) >> np.uint64(32)).astype(np.uint32)
+            result[start:start + len(batch)] = np.minimum.reduceat(permuted, offsets, axis=1).T
+            shingle_sets.extend(np.unique(text_shingles) for text_shingles in np.split(packed, offsets[1:]))
+        return result, shingle_sets
+
+    def band_keys(self, signatures: "np.ndarray") -> list:
+        """ One bucket key per band for each signature, as (len(signatures), bands) python ints """
+        import numpy as np
+
+        bands = signatures.reshape(len(signatures), self.bands, self.rows).astype(np.uint64)
+        # wraps around on overflow, which is fine for a hash
+        return (bands * self._band_mix).sum(axis=2, dtype=np.uint64).tolist()
+
+    def _similarity(self, index: int, text_shingles: "np.ndarray") -> float:
+        """ Exact Jaccard similarity of an indexed card's shingles and text_shingles """
+        import numpy as np
+
+        common = len(np.intersect1d(self._shingles[index], text_shingles, assume_unique=True))
+        return common / (len(self._shingles[index]) + len(text_shingles) - common)
+
+    def _find(self, signature: "np.ndarray", text_shingles: "np.ndarray", keys: list) -> bool:
+        import numpy as np
+
+        required = self.threshold * self.num_perm
+        checked = set()
+        for bucket, key in zip(self._buckets, keys):
+            # the newest cards of a bucket are the likeliest repeats, a true duplicate shares many buckets
+            candidates = [index for index in bucket.get(key, ())[-MAX_BUCKET_CANDIDATES:] if index not in checked]
+            if not candidates:
+                continue
+            checked.update(candidates)
+            matches = np.count_nonzero(self._matrix[candidates] == signature, axis=1)
+            for position in np.flatnonzero(matches >= required):
+                if self._similarity(candidates[position], text_shingles) >= self.threshold:
+                    return True
+        return False
+
+    def _insert(self, signature: "np.ndarray", text_shingles: "np.ndarray", keys: list):
+        import numpy as np
+
+        if self._size == len(self._matrix):
+            self._matrix = np.concatenate([self._matrix, np.empty_like(self._matrix)])
+        index = self._size
+        self._matrix[index] = signature
+        self._shingles.append(text_shingles)
+        self._size += 1
+        for bucket, key in zip(self._buckets, keys):
+            bucket.setdefault(key, []).append(index)
+
+    def add(self, texts: list):
+        """ Indexes texts without checking them, e.g. the cards already in a deck """
+        signatures, shingle_sets = self._encode(texts)
+        for signature, text_shingles, keys in zip(signatures, shingle_sets, self.band_keys(signatures)):
+            self._insert(signature, text_shingles, keys)
+
+    def filter_new(self, texts: list) -> list:
+        """
+        One flag per text: True if it is not a near duplicate of an indexed text or of an
+        earlier text in the same call. Texts flagged True are indexed as they pass.
+        """
+        keep = []
+        signatures, shingle_sets = self._encode(texts)
+        for signature, text_shingles, keys in zip(signatures, shingle_sets, self.band_keys(signatures)):
+            is_new = not self._find(signature, text_shingles, keys)
+            if is_new:
+                self._insert(signature, text_shingles, keys)
+            keep.append(is_new)
+        return keep
+
+
+async def load_deck_index(supabase, deck_id: str) -> NearDuplicateIndex:
+    """
+    Builds an index of the cards already in a deck, read page by page.
+    Pages are hashed on a worker thread so a large deck doesn't stall the event loop.
+    """
+    index = NearDuplicateIndex()
+    query = lambda: supabase.table("flashcards").select("question,answer,created_at,id").eq("deck_id", deck_id)
+    rows, cursor = await fetch_page(query(), PAGE_SIZE_MAX)
+    while True:
+        await asyncio.to_thread(index.add, [
+            card_text(row["question"], row.get("answer") or "") for row in rows if row.get("question")
+        ])
+        if cursor is None:
+            return index
+        rows, cursor = await fetch_page(query(), PAGE_SIZE_MAX, cursor)
+
+
+async def drop_near_duplicates(supabase, deck_id: str, flashcards: list) -> list:
+    """
+    Removes generated (question, answer) pairs that nearly repeat an earlier pair or a card
+    already in the deck, comparing questions and answers together. The first card of each group is the one kept.
+    """
+    if not FLASHCARD_DEDUP_ENABLED or not flashcards:
+        return list(flashcards)
+    index = await load_deck_index(supabase, deck_id)
+    keep = await asyncio.to_thread(index.filter_new, [card_text(question, answer) for question, answer in flashcards])
+    return [pair for pair, is_new in zip(flashcards, keep) if is_new]
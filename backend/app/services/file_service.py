@@ -1,23 +1,37 @@
 import uuid
-import io
 from fastapi import HTTPException
+from pydantic import BaseModel
+from typing import List, Tuple
 from dotenv import load_dotenv
 import os
-
-# Llama and OpenAI imports
-from llama_parse import LlamaParse
-from llama_index.llms.openai import OpenAI as LlamaOpenAI  
-from llama_index.core.node_parser import MarkdownElementNodeParser
-from llama_index.embeddings.openai import OpenAIEmbedding
 import asyncio
-import tiktoken
+import functools
 import re
-import nest_asyncio
-import openai
+from app.core.metrics import LLM_CACHE_HITS, llm_span, stage_span
+from app.core.request_context import log
+from app.services.parse_cache import get_parse_cache
+from app.services.upload_service import SpooledUpload
+from app.services.openai_scheduler import estimate_tokens, get_openai_client, get_openai_scheduler
+from app.services.page_packer import pack_pages
+from app.services.markdown_chunker import chunk_markdown_pages
+from app.services.completion_cache import get_completion_cache
+from app.services.usage_service import record_cache_hit, record_completion
+from app.services.pdf_text import PDF_FAST_PATH, PDF_MAX_BAD_PAGE_RATIO, bad_page_numbers, extract_pdf_pages
 load_dotenv()
 
-nest_asyncio.apply()
+COMPLETION_MODEL = "gpt-4o"
 
+# batched flashcard generation sends several chunks per completion
+FLASHCARD_BATCH_MODE = os.getenv("FLASHCARD_BATCH_MODE", "true").lower() == "true"
+FLASHCARD_BATCH_TOKEN_BUDGET = int(os.getenv("FLASHCARD_BATCH_TOKEN_BUDGET", "6000"))
+FLASHCARD_BATCH_MAX_CHUNKS = int(os.getenv("FLASHCARD_BATCH_MAX_CHUNKS", "20"))
+# rough completion allowance for a single question/answer pair
+FLASHCARD_OUTPUT_TOKENS = 200
+# attempts per chunk before it is reported as failed
+FLASHCARD_MAX_ATTEMPTS = int(os.getenv("FLASHCARD_MAX_ATTEMPTS", "2"))
+# "llm" splits blocks with gpt-4o (chunk_text), "markdown" uses the local structural chunker
+DEFAULT_CHUNKER = os.getenv("CHUNKER", "llm")
+CHUNKERS = ("llm", "markdown")
 
 
 def chunking_instructions(text):
@@ -45,53 +59,309 @@ def create_flashcard_instructions(chunk):
     return (
         "Based on the following text chunk, create a flashcard with a question and answer. "
         "The flashcard should capture the main ideas of the text. "
-        "Format your response exactly as follows, without any additional commentary:\n\n"
-        "Question: <Your question here>\n"
-        "Answer: <Your answer here>\n\n"
+        "Respond with a JSON object with a \"question\" field and an \"answer\" field, "
+        "without any additional commentary.\n\n"
         f"Text chunk: {chunk}"
     )
 
+def create_flashcard_batch_instructions(chunks):
+    # Same task as create_flashcard_instructions, but for several numbered chunks at once.
+    # Ids are positions within the batch so identical batches produce identical prompts.
+    numbered_chunks = "".join(
+        f'<chunk id="{position}">\n{chunk}\n</chunk>\n' for position, chunk in enumerate(chunks)
+    )
+    return (
+        "For each of the following text chunks, create a flashcard with a question and answer. "
+        "Each flashcard should capture the main ideas of its own chunk only. "
+        "Create exactly one flashcard per chunk and use the chunk id given in the chunk tag. "
+        "Respond with a JSON object whose \"flashcards\" list holds one entry per chunk with "
+        "\"chunk_id\", \"question\" and \"answer\" fields, without any additional commentary.\n\n"
+        f"Text chunks:\n{numbered_chunks}"
+    )
+
+
+class Flashcard(BaseModel):
+    question: str
+    answer: str
+
+class BatchFlashcard(Flashcard):
+    chunk_id: int
+
+class FlashcardBatch(BaseModel):
+    flashcards: List[BatchFlashcard]
+
+class FlashcardResults(BaseModel):
+    """ Outcome of generating flashcards for a list of chunks """
+    flashcards: List[Tuple[str, str]]
+    failed_chunks: List[int]
+
+
+# JSON schemas for OpenAI structured outputs, matching Flashcard and FlashcardBatch
+_FLASHCARD_PROPERTIES = {
+    "question": {"type": "string"},
+    "answer": {"type": "string"},
+}
+FLASHCARD_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "flashcard",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": _FLASHCARD_PROPERTIES,
+            "required": ["question", "answer"],
+            "additionalProperties": False,
+        },
+    },
+}
+FLASHCARD_BATCH_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "flashcard_batch",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "flashcards": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {"chunk_id": {"type": "integer"}, **_FLASHCARD_PROPERTIES},
+                        "required": ["chunk_id", "question", "answer"],
+                        "additionalProperties": False,
+                    },
+                },
+            },
+            "required": ["flashcards"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+
+async def complete(client, prompt, estimated_tokens, parse=lambda response: response,
+                   response_format=None, model=COMPLETION_MODEL, operation="completion"):
+    """
+    Runs one chat completion for prompt through the completion cache and the shared
+    OpenAI scheduler, and returns parse(reply). Only replies that parse (no exception,
+    result not None) are cached, so a malformed reply is never served again.
+    operation names the prompt (chunk_text, flashcard, ...) in the LLM metrics.
+    """
+    # replies in different formats must not share a cache entry
+    cache_model = model if response_format is None else f"{model}+{response_format['json_schema']['name']}"
+    cache = get_completion_cache()
+    # SQLite reads and commits block, keep them off the event loop
+    cached = await asyncio.to_thread(cache.get, cache_model, prompt)
+    if cached is not None:
+        LLM_CACHE_HITS.inc(operation=operation)
+        record_cache_hit(operation)
+        return parse(cached)
+
+    request = {"model": model, "messages": [{"role": "user", "content": prompt}]}
+    if response_format is not None:
+        request["response_format"] = response_format
+    with llm_span(operation):
+        completion = await get_openai_scheduler().run(
+            lambda: client.chat.completions.create(**request),
+            estimated_tokens=estimated_tokens
+        )
+    # every request is billed, even one whose reply turns out malformed
+    record_completion(operation, model, getattr(completion, "usage", None))
+    response = completion.choices[0].message.content
+
+    result = parse(response)
+    if result is not None:
+        await asyncio.to_thread(cache.put, cache_model, prompt, response)
+    return result
+
+
+def parse_flashcard(response):
+    """
+    Parses a structured flashcard reply into (question, answer).
+    Raises ValueError (pydantic's ValidationError is one) if the reply does not match the schema.
+    """
+    flashcard = Flashcard.model_validate_json(response)
+    question = flashcard.question.strip()
+    answer = flashcard.answer.strip()
+    if not question or not answer:
+        raise ValueError("Flashcard response has an empty question or answer.")
+
+    return (question, answer)
+
+
 async def create_flashcard(client, chunk, index):
+    """
+    Generates one flashcard for a chunk, retrying malformed replies up to FLASHCARD_MAX_ATTEMPTS times.
+    """
+    prompt = create_flashcard_instructions(chunk)
+    error = None
+    for attempt in range(FLASHCARD_MAX_ATTEMPTS):
+        try:
+            # a flashcard reply is short, budget a fixed allowance for it
+            return await complete(
+                client,
+                prompt,
+                estimated_tokens=estimate_tokens(prompt) + FLASHCARD_OUTPUT_TOKENS,
+                parse=parse_flashcard,
+                response_format=FLASHCARD_RESPONSE_FORMAT,
+                operation="flashcard"
+            )
+        except ValueError as e:
+            # malformed replies are not cached, so another attempt makes a fresh request
+            error = e
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Flashcard for chunk {index} failed: {str(e)}")
+
+    raise HTTPException(status_code=500, detail=f"Flashcard for chunk {index} failed: {str(error)}")
+
+
+async def try_create_flashcard(client, chunk, index):
+    """
+    create_flashcard that reports a failed chunk as None instead of raising.
+    """
     try:
-        context = [
-            {"role": "user", "content": create_flashcard_instructions(chunk)}
-        ]
-        completion = await client.chat.completions.create(
-            model="gpt-4o",
-            messages=context
-        )
-        response = completion.choices[0].message.content
+        return await create_flashcard(client, chunk, index)
+    except HTTPException as e:
+        log(e.detail)
+        return None
 
-        # Split the response into question and answer using regex
-        question_match = re.search(r'Question:\s*(.*?)\nAnswer:', response, re.DOTALL)
-        answer_match = re.search(r'Answer:\s*(.*)', response, re.DOTALL)
-        
-        if question_match and answer_match:
-            question = question_match.group(1).strip()
-            answer = answer_match.group(1).strip()
-        else:
-            raise ValueError("Flashcard response not in expected format. Expected 'Question:' and 'Answer:' markers.")
 
-        # Return the original index along with the flashcard (question, answer)
-        return (question, answer)
+def make_flashcard_batches(chunks, token_budget=FLASHCARD_BATCH_TOKEN_BUDGET, max_chunks=FLASHCARD_BATCH_MAX_CHUNKS):
+    """
+    Groups (index, chunk) pairs into batches whose prompt plus expected output stays under token_budget.
+    """
+    batches = []
+    current = []
+    current_tokens = 0
+
+    for index, chunk in enumerate(chunks):
+        chunk_tokens = estimate_tokens(chunk) + FLASHCARD_OUTPUT_TOKENS
+        if current and (current_tokens + chunk_tokens > token_budget or len(current) >= max_chunks):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append((index, chunk))
+        current_tokens += chunk_tokens
+
+    if current:
+        batches.append(current)
+    return batches
+
+
+def parse_flashcard_batch(response, indices):
+    """
+    Parses a structured batch reply into {chunk index: (question, answer)}.
+    Returns None if the reply does not match the schema, references chunks that
+    were not in the batch or repeats one.
+    """
+    try:
+        batch = FlashcardBatch.model_validate_json(response)
+    except ValueError:
+        return None
+
+    expected = set(indices)
+    flashcards = {}
+
+    for flashcard in batch.flashcards:
+        if flashcard.chunk_id not in expected or flashcard.chunk_id in flashcards:
+            return None
+        question = flashcard.question.strip()
+        answer = flashcard.answer.strip()
+        if question and answer:
+            flashcards[flashcard.chunk_id] = (question, answer)
+
+    return flashcards
+
+
+async def create_flashcard_batch(client, batch):
+    """
+    Generates flashcards for a batch of (index, chunk) pairs in one completion.
+    Returns {chunk index: (question, answer) or None if that chunk failed}.
+    Chunks missing from a malformed reply fall back to one create_flashcard call each.
+    """
+    if len(batch) == 1:
+        index, chunk = batch[0]
+        return {index: await try_create_flashcard(client, chunk, index)}
+
+    indices = [index for index, _ in batch]
+    try:
+        prompt = create_flashcard_batch_instructions([chunk for _, chunk in batch])
+        by_position = await complete(
+            client,
+            prompt,
+            estimated_tokens=estimate_tokens(prompt) + FLASHCARD_OUTPUT_TOKENS * len(batch),
+            parse=lambda response: parse_flashcard_batch(response, range(len(batch))),
+            response_format=FLASHCARD_BATCH_RESPONSE_FORMAT,
+            operation="flashcard_batch"
+        )
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Chunking page {index} failed: {str(e)}")
+        log(f"Flashcard batch {indices[0]}-{indices[-1]} failed: {str(e)}")
+        by_position = None
+
+    if by_position is None:
+        log(f"Flashcard batch {indices[0]}-{indices[-1]} malformed, falling back to per-chunk calls")
+        by_position = {}
+    flashcards = {indices[position]: qa_pair for position, qa_pair in by_position.items()}
+
+    missing = [(index, chunk) for index, chunk in batch if index not in flashcards]
+    fallback_pairs = await asyncio.gather(*[try_create_flashcard(client, chunk, index) for index, chunk in missing])
+    for (index, _), qa_pair in zip(missing, fallback_pairs):
+        flashcards[index] = qa_pair
+
+    return flashcards
+
 
+def flashcard_batches(chunks, batch_mode):
+    """ Batches of (index, chunk) pairs, one chunk per batch unless batch_mode is on """
+    if batch_mode:
+        return make_flashcard_batches(chunks)
+    return [[(index, chunk)] for index, chunk in enumerate(chunks)]
 
 
-async def process_chunks(client, chunks):
+async def process_chunks(client, chunks, batch_mode=FLASHCARD_BATCH_MODE, progress=None) -> FlashcardResults:
     """
-    Processes all chunks in parallel, generating a QA flashcard for each
+    Processes all chunks in parallel, generating a QA flashcard for each.
+    In batch mode several chunks share one completion (see make_flashcard_batches).
+    Actual request concurrency is bounded by the shared OpenAI scheduler.
+    A chunk that still fails after retries is reported in failed_chunks instead of
+    failing the others. If a progress dict is given, progress["chunks_done"] is
+    advanced as cards come back.
     """
-    tasks = [create_flashcard(client, chunk, i) for i, chunk in enumerate(chunks)]
-    qa_pairs = await asyncio.gather(*tasks)
+    async def track(batch):
+        result = await create_flashcard_batch(client, batch)
+        if progress is not None:
+            progress["chunks_done"] += len(batch)
+        return result
 
-    return qa_pairs
+    batch_results = await asyncio.gather(*[track(batch) for batch in flashcard_batches(chunks, batch_mode)])
 
-def count_tokens(text: str, model: str = "gpt-3.5-turbo") -> int:
-    """ Helper function to count tokens """
-    encoding = tiktoken.encoding_for_model(model)
-    return len(encoding.encode(text))
+    flashcards = {}
+    for result in batch_results:
+        flashcards.update(result)
+
+    return FlashcardResults(
+        flashcards=[flashcards[i] for i in range(len(chunks)) if flashcards[i] is not None],
+        failed_chunks=[i for i in range(len(chunks)) if flashcards[i] is None]
+    )
+
+async def stream_chunks(client, chunks, batch_mode=FLASHCARD_BATCH_MODE, progress=None):
+    """
+    Like process_chunks, but yields (chunk index, (question, answer)) as soon as each
+    completion returns instead of waiting for every chunk. A failed chunk yields (chunk index, None).
+    """
+    tasks = [asyncio.ensure_future(create_flashcard_batch(client, batch)) for batch in flashcard_batches(chunks, batch_mode)]
+
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            flashcards = await next_done
+            if progress is not None:
+                progress["chunks_done"] += len(flashcards)
+            for index in sorted(flashcards):
+                yield index, flashcards[index]
+    finally:
+        # the consumer may stop early (e.g. the client disconnected)
+        for task in tasks:
+            task.cancel()
 
 
 async def chunk_text(client, block_text, index):
@@ -99,23 +369,25 @@ async def chunk_text(client, block_text, index):
     Sends a request to OpenAI to chunk a block of text and returns the result with its index.
     """
     try:
-        context = [
-            {"role": "user", "content": chunking_instructions(block_text)}
-        ]
+        prompt = chunking_instructions(block_text)
         
-        completion = await client.chat.completions.create(
-            model="gpt-4o",
-            messages=context
+        # the reply echoes the whole block back with chunk delimiters added
+        chunks = await complete(
+            client,
+            prompt,
+            estimated_tokens=estimate_tokens(prompt) + estimate_tokens(block_text),
+            parse=lambda response: response.split("<CHUNK_BREAK>"),
+            operation="chunk_text"
         )
-        print(f"Page {index} completed")
-        return index, completion.choices[0].message.content.split("<CHUNK_BREAK>")
+        log(f"Page {index} completed")
+        return index, chunks
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Chunking page {index} failed: {str(e)}")
 
 
 async def process_blocks(client, blocks):
     """
-    run chunking requests concurrently
+    run chunking requests concurrently, bounded by the shared OpenAI scheduler
     """
     tasks = [chunk_text(client, block, i) for i, block in enumerate(blocks)]
     chunked_results = await asyncio.gather(*tasks)
@@ -151,62 +423,179 @@ def filter_markdown_chunks(chunks):
 
 
 
-async def process_file(file_content: bytes) -> list:
+@functools.lru_cache(maxsize=None)
+def load_llama_parse():
+    """
+    Imports LlamaParse on first use. llama_parse pulls in most of llama_index and takes
+    seconds to import, which would otherwise be paid by every cold start.
+    """
+    import nest_asyncio
+    from llama_parse import LlamaParse
+
+    nest_asyncio.apply()
+    return LlamaParse
+
+
+async def llama_parse_pages(upload: SpooledUpload, target_pages: list = None) -> list:
     """
-    Process the file and return a list of document sections with embeddings.
+    Parse the file (or only target_pages, 0-based) with LlamaParse into markdown page texts.
     """
     try:
-        parser = LlamaParse(
+        parser = load_llama_parse()(
             api_key= os.getenv("LLAMA_CLOUD_API_KEY"),
-            result_type="markdown"
+            result_type="markdown",
+            target_pages=",".join(str(page_num) for page_num in target_pages) if target_pages else None
         )
-        documents = await parser.aload_data(file_path=io.BytesIO(file_content), extra_info={"file_name": "uploaded file"})
+        # the upload is streamed from its spool, LlamaParse gets a file handle rather than a copy
+        with stage_span("llama_parse", pages=len(target_pages) if target_pages else "all"), upload.open() as stream:
+            documents = await parser.aload_data(file_path=stream, extra_info={"file_name": upload.filename})
     except Exception as e:
-        print("Parser init failed:", str(e))
+        log("Parser init failed:", str(e))
         raise HTTPException(status_code=500, detail=f"Parser init failed: {str(e)}")
+
+    return [doc.text for doc in documents]
+
+
+def read_text_layer(upload: SpooledUpload) -> tuple:
+    """ (page texts, bad page numbers) of the PDF's own text layer, or (None, None) if it has none """
+    with upload.open() as stream:
+        local_pages = extract_pdf_pages(stream)
+    if not local_pages:
+        return None, None
+    return local_pages, bad_page_numbers(local_pages)
+
+
+async def extract_pages(upload: SpooledUpload) -> list:
+    """
+    Try the PDF's own text layer first and only send pages that fail the quality
+    heuristic (or the whole document, if most pages fail) to LlamaParse.
+    """
+    local_pages = None
+    if PDF_FAST_PATH:
+        # pypdf is pure python and takes seconds on a large file, keep it off the event loop
+        with stage_span("pdf_text"):
+            local_pages, bad_pages = await asyncio.to_thread(read_text_layer, upload)
+    if not local_pages:
+        return await llama_parse_pages(upload)
+
+    if not bad_pages:
+        log(f"Local text layer accepted for all {len(local_pages)} pages")
+        return local_pages
+
+    if len(bad_pages) > PDF_MAX_BAD_PAGE_RATIO * len(local_pages):
+        return await llama_parse_pages(upload)
+
+    log(f"Sending {len(bad_pages)} of {len(local_pages)} pages to LlamaParse")
+    parsed_pages = await llama_parse_pages(upload, target_pages=bad_pages)
+    if len(parsed_pages) != len(bad_pages):
+        # can't tell which parsed text belongs to which page, parse the whole document instead
+        return await llama_parse_pages(upload)
+
+    pages = list(local_pages)
+    for page_num, text in zip(bad_pages, parsed_pages):
+        pages[page_num] = text
+    return pages
+
+
+async def parse_file(upload: SpooledUpload) -> list:
+    """
+    Parse the file into a list of page texts, reusing cached results for identical uploads.
+    """
+    # identical uploads (e.g. the same lecture slides) skip parsing entirely,
+    # the digest was computed while the upload was spooled
+    file_hash = upload.digest
+    parse_cache = get_parse_cache()
+    # the disk tier reads and writes json files, keep them off the event loop
+    pages = await asyncio.to_thread(parse_cache.get, file_hash)
+
+    if pages is None:
+        with stage_span("parse", bytes=upload.size):
+            pages = await extract_pages(upload)
+        if pages:
+            await asyncio.to_thread(parse_cache.put, file_hash, pages)
+    else:
+        log("Parse cache hit:", file_hash)
+
+    return pages
+
+
+async def file_to_chunks(client, upload: SpooledUpload, progress: dict = None, chunker: str = None) -> list:
+    """
+    Parse the file and split it into approved chunks, either semantically with the LLM
+    or structurally with the local markdown chunker (see CHUNKERS).
+    """
+    chunker = chunker or DEFAULT_CHUNKER
+    if chunker not in CHUNKERS:
+        raise HTTPException(status_code=400, detail=f"Unknown chunker '{chunker}', expected one of {', '.join(CHUNKERS)}.")
+
+    pages = await parse_file(upload)
     
-    print("Processing file...")
-    max_tokens_to_split = 1000
-    # must be at least the size of the largest page
-    # max_tokens_to_split = max(
-    #     max_tokens_to_split,
-    #     max(count_tokens(doc.text) for doc in documents) + 1
-    # )
-
-    # group pages into large blocks that will be chunked
-    blocks = []
-    pending_text = ""
-    page_num = 0
-
-    while page_num < len(documents):
-        page_tokens = count_tokens(documents[page_num].text)
-        
-        if count_tokens(pending_text) + page_tokens <= max_tokens_to_split:
-            pending_text += documents[page_num].text
-            page_num += 1
+    log("Processing file...")
+    if progress is not None:
+        progress["pages_parsed"] = len(pages)
+
+    with stage_span("chunk", chunker=chunker, pages=len(pages)):
+        if chunker == "markdown":
+            # headings, lists and tables already mark the structure, no LLM round trip needed
+            document_chunks = chunk_markdown_pages(pages)
         else:
-            if pending_text:  
-                blocks.append(pending_text)
-            pending_text = ""
-    if pending_text:
-        blocks.append(pending_text)
+            max_tokens_to_split = 1000
 
-    # init client
-    openai_client = openai.AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+            # group pages into large blocks that will be chunked,
+            # pages larger than a block are split at paragraph/sentence boundaries
+            blocks = pack_pages(pages, max_tokens_to_split)
 
-    try:
-        # semantically split chunks from blocks
-        document_chunks = await process_blocks(openai_client,blocks)
+            try:
+                # semantically split chunks from blocks
+                document_chunks = await process_blocks(client, blocks)
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"Semantic splitting failed: {str(e)}")
 
-        # remove empty chunks or chunks that only have headers in them w no content
-        approved_chunks, flagged_chunks = filter_markdown_chunks(document_chunks)
-        
-        # generate flashcards
-        qa_pairs = await process_chunks(openai_client, approved_chunks)
+    # remove empty chunks or chunks that only have headers in them w no content
+    approved_chunks, flagged_chunks = filter_markdown_chunks(document_chunks)
+    if progress is not None:
+        progress["chunks_total"] = len(approved_chunks)
 
-        return qa_pairs
-    
+    return approved_chunks
+
+
+async def process_file(upload: SpooledUpload, progress: dict = None, chunker: str = None) -> FlashcardResults:
+    """
+    Process the file and return its (question, answer) flashcards plus the indices of chunks that failed.
+    If a progress dict is given (see job_service.IngestionJob), it is updated with
+    pages_parsed, chunks_total and chunks_done as the pipeline advances.
+    chunker overrides the CHUNKER setting for this file.
+    """
+    openai_client = get_openai_client()
+
+    approved_chunks = await file_to_chunks(openai_client, upload, progress, chunker)
+
+    try:
+        # generate flashcards
+        with stage_span("generate", chunks=len(approved_chunks)):
+            results = await process_chunks(openai_client, approved_chunks, progress=progress)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Semantic splitting failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Flashcard generation failed: {str(e)}")
+
+    if approved_chunks and not results.flashcards:
+        raise HTTPException(status_code=500, detail="Flashcard generation failed for every chunk.")
+    return results
 
 
+async def stream_file_flashcards(upload: SpooledUpload, progress: dict = None, chunker: str = None):
+    """
+    Streaming variant of process_file: yields (chunk index, (question, answer)) as each card is generated,
+    or (chunk index, None) for a chunk that failed.
+    """
+    openai_client = get_openai_client()
+
+    approved_chunks = await file_to_chunks(openai_client, upload, progress, chunker)
+
+    try:
+        with stage_span("generate", chunks=len(approved_chunks)):
+            async for index, qa_pair in stream_chunks(openai_client, approved_chunks, progress=progress):
+                yield index, qa_pair
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Flashcard generation failed: {str(e)}")
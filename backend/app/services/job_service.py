@@ -0,0 +1,233 @@
+import asyncio
+import math
+import os
+import uuid
+from collections import Counter, OrderedDict
+from datetime import datetime, timezone
+
+from fastapi import HTTPException, status
+
+from app.core.request_context import current_request_id, log, reset_request_id, set_request_id
+from app.services.usage_service import IngestionUsage
+
+
+INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", "2"))
+INGESTION_MAX_JOBS_KEPT = int(os.getenv("INGESTION_MAX_JOBS_KEPT", "1000"))
+# ingestions admitted at once (queued, running or streaming), across all users and per user
+INGESTION_MAX_ACTIVE = int(os.getenv("INGESTION_MAX_ACTIVE", "16"))
+INGESTION_MAX_ACTIVE_PER_USER = int(os.getenv("INGESTION_MAX_ACTIVE_PER_USER", "2"))
+# starting estimate of how long one ingestion takes, refined as ingestions finish
+INGESTION_ESTIMATED_SECONDS = float(os.getenv("INGESTION_ESTIMATED_SECONDS", "30"))
+INGESTION_MAX_RETRY_AFTER_SECONDS = 600
+
+
+class IngestionJob:
+    """
+    Status and progress of one file upload being turned into flashcards.
+    status moves from queued -> running -> completed | failed.
+    """
+
+    def __init__(self, deck_id: str, user_id: str):
+        self.id = str(uuid.uuid4())
+        self.deck_id = deck_id
+        self.user_id = user_id
+        # the upload's correlation id, so the job's log lines can be matched to the request
+        self.request_id = current_request_id()
+        self.status = "queued"
+        self.progress = {
+            "pages_parsed": 0,
+            "chunks_total": 0,
+            "chunks_done": 0,
+            "cards_inserted": 0,
+        }
+        self.failed_chunks = []
+        # OpenAI tokens and cost spent on this upload so far
+        self.usage = IngestionUsage()
+        self.error = None
+        self.created_at = datetime.now(timezone.utc)
+        self.updated_at = self.created_at
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("completed", "failed")
+
+    def set_status(self, status: str, error: str = None):
+        self.status = status
+        self.error = error
+        self.updated_at = datetime.now(timezone.utc)
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "deck_id": self.deck_id,
+            "user_id": self.user_id,
+            "status": self.status,
+            "progress": dict(self.progress),
+            "failed_chunks": list(self.failed_chunks),
+            "usage": self.usage.model_dump(),
+            "error": self.error,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+
+
+class JobManager:
+    """
+    In-process ingestion queue drained by a fixed number of asyncio workers.
+    Each submitted job carries a coroutine function `work(job)` that does the
+    actual parsing/generation/insert and updates job.progress as it goes.
+    """
+
+    def __init__(self, num_workers: int, max_jobs_kept: int):
+        self.num_workers = num_workers
+        self.max_jobs_kept = max_jobs_kept
+        self.jobs = OrderedDict()
+        self._queue = None
+        self._workers = []
+        self._loop = None
+
+    def _ensure_workers(self):
+        # the queue and workers belong to whichever event loop first submits a job
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._workers = [loop.create_task(self._worker()) for _ in range(self.num_workers)]
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def submit(self, deck_id: str, user_id: str, work) -> IngestionJob:
+        """
+        Registers a job and queues it for the worker pool. Returns immediately.
+        """
+        self._ensure_workers()
+        job = IngestionJob(deck_id, user_id)
+        self.jobs[job.id] = job
+        self._trim()
+        self._queue.put_nowait((job, work))
+        return job
+
+    def get(self, job_id: str) -> IngestionJob:
+        return self.jobs.get(job_id)
+
+    def list_for_user(self, user_id: str, deck_id: str = None) -> list:
+        return [
+            job for job in self.jobs.values()
+            if job.user_id == user_id and (deck_id is None or job.deck_id == deck_id)
+        ]
+
+    def _trim(self):
+        # forget the oldest finished jobs once too many are kept around
+        if len(self.jobs) <= self.max_jobs_kept:
+            return
+        for job_id in [job_id for job_id, job in self.jobs.items() if job.finished]:
+            del self.jobs[job_id]
+            if len(self.jobs) <= self.max_jobs_kept:
+                break
+
+    async def _worker(self):
+        while True:
+            job, work = await self._queue.get()
+            token = set_request_id(job.request_id)
+            job.set_status("running")
+            try:
+                await work(job)
+                job.set_status("completed")
+            except HTTPException as e:
+                job.set_status("failed", error=str(e.detail))
+            except Exception as e:
+                job.set_status("failed", error=str(e))
+            finally:
+                self._queue.task_done()
+            log(f"Ingestion job {job.id} {job.status}")
+            reset_request_id(token)
+
+    async def join(self):
+        """ Waits until every queued job has finished """
+        if self._queue is not None:
+            await self._queue.join()
+
+
+class IngestionAdmission:
+    """
+    Admission control for file ingestion. Every upload takes a slot before its file is spooled
+    and gives it back with release() when its job or stream ends. Past the global or per-user
+    cap the upload is refused with a 429 whose Retry-After grows with the job queue depth,
+    so a single heavy user can't fill the worker pool and everyone gets a realistic wait.
+    """
+
+    def __init__(self, max_active: int, max_active_per_user: int, estimated_seconds: float):
+        self.max_active = max_active
+        self.max_active_per_user = max_active_per_user
+        # moving average of how long an ingestion takes once it runs
+        self.estimated_seconds = estimated_seconds
+        self.active = 0
+        self.active_per_user = Counter()
+        self.admitted = 0
+        self.rejected = 0
+
+    def retry_after(self, queue_depth: int, num_workers: int) -> int:
+        """ Seconds until a slot is likely free: one ingestion per round of queued jobs ahead """
+        rounds = queue_depth // max(num_workers, 1) + 1
+        return min(max(math.ceil(self.estimated_seconds * rounds), 1), INGESTION_MAX_RETRY_AFTER_SECONDS)
+
+    def admit(self, user_id: str, queue_depth: int = 0, num_workers: int = 1):
+        """ Takes a slot for user_id or raises a 429 with a Retry-After header """
+        if self.active >= self.max_active:
+            detail = "The service is busy processing other files, try again later."
+        elif self.active_per_user[user_id] >= self.max_active_per_user:
+            detail = f"You already have {self.max_active_per_user} files being processed, try again once one finishes."
+        else:
+            self.active += 1
+            self.active_per_user[user_id] += 1
+            self.admitted += 1
+            return
+
+        self.rejected += 1
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=detail,
+            headers={"Retry-After": str(self.retry_after(queue_depth, num_workers))}
+        )
+
+    def release(self, user_id: str, elapsed_seconds: float = None):
+        """ Gives back a slot; elapsed_seconds (how long the ingestion ran) refines the estimate """
+        self.active = max(self.active - 1, 0)
+        self.active_per_user[user_id] -= 1
+        if self.active_per_user[user_id] <= 0:
+            del self.active_per_user[user_id]
+        if elapsed_seconds is not None:
+            self.estimated_seconds = 0.8 * self.estimated_seconds + 0.2 * elapsed_seconds
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "active_users": len(self.active_per_user),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "estimated_seconds": round(self.estimated_seconds, 1),
+        }
+
+
+_job_manager = None
+_ingestion_admission = None
+
+
+def get_job_manager() -> JobManager:
+    """ Returns the process wide ingestion job manager """
+    global _job_manager
+    if _job_manager is None:
+        _job_manager = JobManager(INGESTION_WORKERS, INGESTION_MAX_JOBS_KEPT)
+    return _job_manager
+
+
+def get_ingestion_admission() -> IngestionAdmission:
+    """ Returns the process wide ingestion admission control """
+    global _ingestion_admission
+    if _ingestion_admission is None:
+        _ingestion_admission = IngestionAdmission(
+            INGESTION_MAX_ACTIVE, INGESTION_MAX_ACTIVE_PER_USER, INGESTION_ESTIMATED_SECONDS
+        )
+    return _ingestion_admission
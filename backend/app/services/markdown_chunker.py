@@ -0,0 +1,117 @@
+import os
+import re
+
+from app.services.openai_scheduler import estimate_tokens
+from app.services.page_packer import split_oversized_page
+
+
+MARKDOWN_CHUNK_TOKENS = int(os.getenv("MARKDOWN_CHUNK_TOKENS", "500"))
+# headings at or above this level always start a new chunk
+MARKDOWN_SPLIT_LEVEL = int(os.getenv("MARKDOWN_SPLIT_LEVEL", "3"))
+
+_HEADING = re.compile(r'^(#{1,6})\s+\S')
+_LIST_ITEM = re.compile(r'^\s*(?:[-*+]|\d+[.)])\s+')
+_TABLE_ROW = re.compile(r'^\s*\|')
+_PAGE_MARKER = re.compile(r'^\s*</?page_number>')
+
+
+def markdown_units(text):
+    """
+    Splits markdown into structural units: headings, page markers, tables, lists and paragraphs.
+    Returns (kind, heading level, text) tuples whose texts join back into the original text.
+    """
+    units = []
+    kind = None
+    lines = []
+
+    def flush():
+        nonlocal kind, lines
+        if lines:
+            level = len(_HEADING.match(lines[0]).group(1)) if kind == "heading" else 0
+            units.append([kind, level, "".join(lines)])
+        kind = None
+        lines = []
+
+    for line in text.splitlines(keepends=True):
+        if not line.strip():
+            # blank lines close the current unit
+            if lines:
+                lines.append(line)
+                flush()
+            elif units:
+                units[-1][2] += line
+            else:
+                units.append(["blank", 0, line])
+            continue
+
+        if _HEADING.match(line):
+            line_kind = "heading"
+        elif _PAGE_MARKER.match(line):
+            line_kind = "marker"
+        elif _TABLE_ROW.match(line):
+            line_kind = "table"
+        elif _LIST_ITEM.match(line) or (kind == "list" and line[:1].isspace()):
+            line_kind = "list"
+        else:
+            line_kind = "paragraph"
+
+        if line_kind != kind or line_kind in ("heading", "marker"):
+            flush()
+            kind = line_kind
+        lines.append(line)
+
+    flush()
+    return [tuple(unit) for unit in units]
+
+
+def chunk_markdown(text, max_tokens=MARKDOWN_CHUNK_TOKENS, split_level=MARKDOWN_SPLIT_LEVEL, count=estimate_tokens):
+    """
+    Local replacement for the LLM chunk_text stage. Starts a new chunk at every heading of
+    level <= split_level and whenever the token budget would be exceeded, never splitting a
+    table, list or paragraph unless it alone is over budget. Headings and <page_number>
+    markers stay attached to the content that follows them, and no text is changed.
+    """
+    chunks = []
+    current = []
+    current_tokens = 0
+    has_content = False
+
+    def flush():
+        nonlocal current, current_tokens, has_content
+        if current:
+            chunks.append("".join(current))
+        current = []
+        current_tokens = 0
+        has_content = False
+
+    for kind, level, unit_text in markdown_units(text):
+        is_content = kind not in ("heading", "marker", "blank")
+        tokens = count(unit_text)
+
+        # only close a chunk once it holds real content, so a header never ends up alone
+        starts_section = kind == "heading" and level <= split_level
+        if has_content and (starts_section or current_tokens + tokens > max_tokens):
+            flush()
+
+        if is_content and tokens > max_tokens:
+            for piece, piece_tokens in split_oversized_page(unit_text, max_tokens, count):
+                if has_content and current_tokens + piece_tokens > max_tokens:
+                    flush()
+                current.append(piece)
+                current_tokens += piece_tokens
+                has_content = True
+            continue
+
+        current.append(unit_text)
+        current_tokens += tokens
+        has_content = has_content or is_content
+
+    flush()
+    return chunks
+
+
+def chunk_markdown_pages(pages, max_tokens=MARKDOWN_CHUNK_TOKENS, split_level=MARKDOWN_SPLIT_LEVEL):
+    """
+    Chunks a parsed document, treating page boundaries as paragraph breaks.
+    """
+    return chunk_markdown("\n\n".join(pages), max_tokens, split_level)
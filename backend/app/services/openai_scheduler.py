@@ -0,0 +1,159 @@
+import asyncio
+import os
+import random
+import time
+from typing import TYPE_CHECKING
+
+from app.core.request_context import log
+
+if TYPE_CHECKING:
+    # imported on first use at runtime, see get_openai_client
+    import openai
+
+
+OPENAI_MAX_IN_FLIGHT = int(os.getenv("OPENAI_MAX_IN_FLIGHT", "16"))
+OPENAI_REQUESTS_PER_MINUTE = int(os.getenv("OPENAI_REQUESTS_PER_MINUTE", "500"))
+OPENAI_TOKENS_PER_MINUTE = int(os.getenv("OPENAI_TOKENS_PER_MINUTE", "30000"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "6"))
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap token estimate (~4 characters per token) used for rate budgeting.
+    The budget only has to be roughly right, so this avoids running tiktoken per request.
+    """
+    return len(text) // 4 + 1
+
+
+class TokenBucket:
+    """
+    Continuously refilling budget of `per_minute` units.
+    """
+
+    def __init__(self, per_minute: int):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.available = float(per_minute)
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self, amount: int):
+        # a single request larger than the whole budget would otherwise wait forever
+        amount = min(amount, self.capacity)
+        while True:
+            self._refill()
+            if self.available >= amount:
+                self.available -= amount
+                return
+            await asyncio.sleep((amount - self.available) / self.rate)
+
+
+class OpenAIScheduler:
+    """
+    Shared gate for every OpenAI call made by the ingestion pipeline.
+    Caps the number of in-flight requests, budgets requests and tokens per minute
+    and retries rate limited requests with jittered exponential backoff.
+    """
+
+    def __init__(self, max_in_flight: int, requests_per_minute: int, tokens_per_minute: int,
+                 max_retries: int, base_delay: float = 1.0, max_delay: float = 60.0):
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._requests = TokenBucket(requests_per_minute)
+        self._tokens = TokenBucket(tokens_per_minute)
+        self._semaphore = None
+        self._loop = None
+        self.in_flight = 0
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # asyncio primitives are bound to one event loop, tests and scripts may use several
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        return self._semaphore
+
+    def _backoff(self, attempt: int, error: "openai.APIError") -> float:
+        retry_after = None
+        # connection errors have no response
+        if getattr(error, "response", None) is not None:
+            retry_after = error.response.headers.get("retry-after")
+        try:
+            if retry_after is not None:
+                return min(self.max_delay, float(retry_after)) + random.uniform(0, self.base_delay)
+        except ValueError:
+            pass
+        # full jitter so that a burst of 429s does not retry in lockstep
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    async def run(self, request, estimated_tokens: int = 0):
+        """
+        Runs `request` (a zero argument callable returning an awaitable) under the
+        concurrency and rate budget, retrying on rate limit errors, 5xx replies and
+        connection failures. This is the only retry loop, the client is built with max_retries=0.
+        """
+        import openai
+
+        for attempt in range(self.max_retries + 1):
+            await self._requests.acquire(1)
+            await self._tokens.acquire(estimated_tokens)
+
+            async with self._get_semaphore():
+                self.in_flight += 1
+                try:
+                    return await request()
+                except (openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError) as e:
+                    # an exhausted quota will not recover by waiting
+                    if attempt == self.max_retries or getattr(e, "code", None) == "insufficient_quota":
+                        raise
+                    delay = self._backoff(attempt, e)
+                    reason = type(e).__name__
+                finally:
+                    self.in_flight -= 1
+
+            log(f"OpenAI request failed ({reason}), retrying in {delay:.2f}s (attempt {attempt + 1})")
+            await asyncio.sleep(delay)
+
+
+_openai_scheduler = None
+
+
+def get_openai_scheduler() -> OpenAIScheduler:
+    """ Returns the process wide OpenAI scheduler """
+    global _openai_scheduler
+    if _openai_scheduler is None:
+        _openai_scheduler = OpenAIScheduler(
+            OPENAI_MAX_IN_FLIGHT,
+            OPENAI_REQUESTS_PER_MINUTE,
+            OPENAI_TOKENS_PER_MINUTE,
+            OPENAI_MAX_RETRIES
+        )
+    return _openai_scheduler
+
+
+_openai_client = None
+_openai_client_loop = None
+
+
+def get_openai_client():
+    """
+    Returns the process wide openai.AsyncOpenAI client, built on first use.
+    openai takes most of a second to import and only the ingestion path needs it,
+    so it is imported here rather than when the app starts.
+    """
+    global _openai_client, _openai_client_loop
+    # the client's connection pool is bound to one event loop, tests and scripts may use several
+    loop = asyncio.get_running_loop()
+    if _openai_client is None or _openai_client_loop is not loop:
+        import openai
+
+        # the scheduler owns retries, SDK retries would bypass its budget and backoff
+        _openai_client = openai.AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+        _openai_client_loop = loop
+    return _openai_client
@@ -0,0 +1,77 @@
+import functools
+import re
+
+
+# finer and finer boundaries used to break up a page that does not fit in one block;
+# the splits are zero width so the pieces always join back into the original text
+_SPLIT_PATTERNS = [
+    re.compile(r'(?<=\n\n)'),        # paragraphs
+    re.compile(r'(?<=[.!?]\s)'),     # sentences
+    re.compile(r'(?<=\s)'),          # words
+]
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(model: str):
+    """ tiktoken encodings are expensive to build, so build each one once """
+    # imported on first use, like the other ingestion-only dependencies
+    import tiktoken
+
+    return tiktoken.encoding_for_model(model)
+
+
+def count_tokens(text: str, model: str = "gpt-3.5-turbo") -> int:
+    """ Helper function to count tokens """
+    return len(get_encoding(model).encode(text))
+
+
+def split_oversized_page(text, max_tokens, count=count_tokens, level=0):
+    """
+    Splits text at paragraph, then sentence, then word boundaries until every
+    piece fits in max_tokens. Returns a list of (piece, token count) pairs.
+    A single word larger than max_tokens is returned as is.
+    """
+    if level >= len(_SPLIT_PATTERNS):
+        return [(text, count(text))]
+
+    pieces = []
+    for piece in _SPLIT_PATTERNS[level].split(text):
+        if not piece:
+            continue
+        tokens = count(piece)
+        if tokens > max_tokens:
+            pieces.extend(split_oversized_page(piece, max_tokens, count, level + 1))
+        else:
+            pieces.append((piece, tokens))
+    return pieces
+
+
+def pack_pages(pages, max_tokens, count=count_tokens):
+    """
+    Greedily groups consecutive pages into blocks of at most max_tokens.
+    Every page is tokenized once and the running block size is tracked as a sum,
+    so packing is linear in the document size. Pages larger than max_tokens are
+    split with split_oversized_page instead of stalling the packer.
+    """
+    blocks = []
+    pending = []
+    pending_tokens = 0
+
+    for page in pages:
+        page_tokens = count(page)
+        if page_tokens > max_tokens:
+            pieces = split_oversized_page(page, max_tokens, count)
+        else:
+            pieces = [(page, page_tokens)]
+
+        for piece, tokens in pieces:
+            if pending and pending_tokens + tokens > max_tokens:
+                blocks.append("".join(pending))
+                pending = []
+                pending_tokens = 0
+            pending.append(piece)
+            pending_tokens += tokens
+
+    if pending:
+        blocks.append("".join(pending))
+    return blocks
@@ -0,0 +1,157 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+
+from app.core.request_context import log
+
+
+PARSE_CACHE_DIR = os.getenv(
+    "PARSE_CACHE_DIR",
+    os.path.join(tempfile.gettempdir(), "quickthink_parse_cache")
+)
+PARSE_CACHE_MEMORY_ENTRIES = int(os.getenv("PARSE_CACHE_MEMORY_ENTRIES", "64"))
+PARSE_CACHE_MAX_BYTES = int(os.getenv("PARSE_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+
+def file_digest(file_content: bytes) -> str:
+    """ SHA-256 hex digest used as the cache key for an upload """
+    return hashlib.sha256(file_content).hexdigest()
+
+
+class ParseCache:
+    """
+    Two tier cache of parsed pages keyed by the SHA-256 of the uploaded file.
+    The memory tier is a small LRU, the disk tier is a directory of json files
+    that is trimmed (least recently used first) once it grows past max_disk_bytes.
+    The directory is listed once, on first use, after that its size is tracked as entries
+    are written and deleted. get and put block on file I/O and are safe to call from
+    worker threads, async callers run them with asyncio.to_thread.
+    """
+
+    def __init__(self, cache_dir: str, max_memory_entries: int, max_disk_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        # key -> file size of the disk tier, least recently used first, None until the directory is listed
+        self._disk = None
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key: str) -> Optional[List[str]]:
+        """
+        Returns the cached page texts for key, or None on a miss.
+        """
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return self._memory[key]
+
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                pages = json.load(f)
+            # bump the mtime so the next listing of the directory still sees this entry as recently used
+            os.utime(path)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+            self._remember(key, pages)
+            if self._disk is not None and key in self._disk:
+                self._disk.move_to_end(key)
+        return pages
+
+    def put(self, key: str, pages: List[str]):
+        """
+        Stores page texts in both tiers.
+        """
+        with self._lock:
+            self._remember(key, pages)
+
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with self._lock:
+                self._load_disk()
+            tmp_path = self._path(key) + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(pages, f)
+                size = f.tell()
+            os.replace(tmp_path, self._path(key))
+            with self._lock:
+                self._disk_bytes += size - self._disk.pop(key, 0)
+                self._disk[key] = size
+                stale_keys = self._pick_disk_evictions()
+            for stale_key in stale_keys:
+                try:
+                    os.remove(self._path(stale_key))
+                except FileNotFoundError:
+                    pass
+        except OSError as e:
+            # the disk tier is best effort, a failed write only costs a future parse
+            log("Parse cache write failed:", str(e))
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "memory_entries": len(self._memory),
+        }
+
+    def _remember(self, key: str, pages: List[str]):
+        self._memory[key] = pages
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _load_disk(self):
+        """
+        Lists the cache directory once, entries left by earlier processes ordered by mtime.
+        """
+        if self._disk is not None:
+            return
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".json"):
+                continue
+            stat = os.stat(os.path.join(self.cache_dir, name))
+            entries.append((stat.st_mtime, name[:-len(".json")], stat.st_size))
+        entries.sort()
+        self._disk = OrderedDict((key, size) for _, key, size in entries)
+        self._disk_bytes = sum(self._disk.values())
+
+    def _pick_disk_evictions(self) -> list:
+        """
+        Drops the least recently used entries from the disk index until it fits max_disk_bytes,
+        returns their keys so the caller deletes the files outside the lock.
+        """
+        stale_keys = []
+        while self._disk_bytes > self.max_disk_bytes and self._disk:
+            key, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            stale_keys.append(key)
+        return stale_keys
+
+
+_parse_cache = None
+
+
+def get_parse_cache() -> ParseCache:
+    """ Returns the process wide parse cache """
+    global _parse_cache
+    if _parse_cache is None:
+        _parse_cache = ParseCache(PARSE_CACHE_DIR, PARSE_CACHE_MEMORY_ENTRIES, PARSE_CACHE_MAX_BYTES)
+    return _parse_cache
@@ -0,0 +1,53 @@
+import os
+import re
+
+from app.core.request_context import log
+
+
+PDF_FAST_PATH = os.getenv("PDF_FAST_PATH", "true").lower() == "true"
+# pages with fewer visible characters than this are probably scanned or image-only
+PDF_MIN_PAGE_CHARS = int(os.getenv("PDF_MIN_PAGE_CHARS", "40"))
+PDF_MAX_GARBLED_RATIO = float(os.getenv("PDF_MAX_GARBLED_RATIO", "0.05"))
+# above this share of bad pages the whole document goes to LlamaParse
+PDF_MAX_BAD_PAGE_RATIO = float(os.getenv("PDF_MAX_BAD_PAGE_RATIO", "0.5"))
+
+# replacement characters, control characters, private use glyphs and unmapped "(cid:123)" glyphs
+_GARBLED = re.compile(r'[\ufffd\x00-\x08\x0b\x0c\x0e-\x1f\ue000-\uf8ff]|\(cid:\d+\)')
+
+
+def extract_pdf_pages(stream) -> list:
+    """
+    Extracts the text layer of every page with pypdf from a binary file object.
+    Returns None if the file can't be read as a PDF.
+    """
+    # imported on first use, like the other ingestion-only dependencies
+    from pypdf import PdfReader
+
+    try:
+        reader = PdfReader(stream)
+        return [page.extract_text() or "" for page in reader.pages]
+    except Exception as e:
+        log("Local PDF extraction failed:", str(e))
+        return None
+
+
+def garbled_ratio(text: str) -> float:
+    """ Share of visible characters that look like broken font mappings """
+    visible = len(text) - sum(1 for char in text if char.isspace())
+    if visible == 0:
+        return 1.0
+    garbled = sum(len(match) for match in _GARBLED.findall(text))
+    return garbled / visible
+
+
+def page_text_ok(text: str, min_chars: int = PDF_MIN_PAGE_CHARS, max_garbled_ratio: float = PDF_MAX_GARBLED_RATIO) -> bool:
+    """
+    Quality heuristic for an extracted page: enough text density and few garbled characters.
+    """
+    visible = len(text) - sum(1 for char in text if char.isspace())
+    return visible >= min_chars and garbled_ratio(text) <= max_garbled_ratio
+
+
+def bad_page_numbers(pages: list) -> list:
+    """ 0-based numbers of the pages whose local text should be replaced by LlamaParse """
+    return [page_num for page_num, text in enumerate(pages) if not page_text_ok(text)]
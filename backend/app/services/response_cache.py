@@ -0,0 +1,97 @@
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+
+# bounds staleness when another instance writes, local writes invalidate right away
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "30"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1024"))
+
+
+class CachedPage(NamedTuple):
+    """ A serialized listing page with its strong ETag """
+    etag: str
+    body: bytes
+    next_cursor: Optional[str]
+
+
+def make_etag(body: bytes, next_cursor: Optional[str] = None) -> str:
+    """ Strong ETag of a response body: identical bytes (and next page) give the same tag """
+    digest = hashlib.sha256(body)
+    digest.update(b"\0" + (next_cursor or "").encode("utf-8"))
+    return f'"{digest.hexdigest()[:32]}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    If-None-Match check. The header can list several tags or be "*";
+    W/ prefixes are ignored since If-None-Match uses weak comparison.
+    """
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+class ResponseCache:
+    """
+    LRU of serialized listing pages. Entries are grouped by a scope, e.g. ("flashcards", deck_id),
+    and every write to that scope calls invalidate(scope). Entries also expire after ttl_seconds.
+    """
+
+    def __init__(self, ttl_seconds: float, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, scope: tuple, variant: tuple) -> Optional[CachedPage]:
+        key = (scope, variant)
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            self._entries.pop(key, None)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, scope: tuple, variant: tuple, page: CachedPage) -> CachedPage:
+        key = (scope, variant)
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, page)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return page
+
+    def invalidate(self, scope: tuple):
+        """ Drops every cached page of a scope """
+        for key in [key for key in self._entries if key[0] == scope]:
+            del self._entries[key]
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._entries),
+        }
+
+
+_response_cache = None
+
+
+def get_response_cache() -> ResponseCache:
+    """ Returns the process wide response cache """
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = ResponseCache(RESPONSE_CACHE_TTL_SECONDS, RESPONSE_CACHE_MAX_ENTRIES)
+    return _response_cache
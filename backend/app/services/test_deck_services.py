@@ -1,10 +1,13 @@
 import asyncio
 import os
+import time
 import openai
 from dotenv import load_dotenv
 
 load_dotenv()
 openai.api_key = os.getenv("OPENAI_API_KEY")
+# keep the persistent completion cache out of the tests, fake replies must not leak between runs
+os.environ["COMPLETION_CACHE_ENABLED"] = "false"
 
 # Import everything from your file_service.py
 # Adjust the import path if needed
@@ -13,12 +16,37 @@ from file_service import (
     create_flashcard_instructions,
     create_flashcard,
     process_chunks,
-    count_tokens,
     chunk_text,
     process_blocks,
     filter_markdown_chunks,
-    process_file
+    process_file,
+    make_flashcard_batches,
+    parse_flashcard_batch,
+    create_flashcard_batch,
+    stream_chunks
 )
+from parse_cache import ParseCache, file_digest
+from openai_scheduler import OpenAIScheduler, get_openai_client
+from page_packer import count_tokens, pack_pages, split_oversized_page
+from job_service import IngestionAdmission, JobManager
+from markdown_chunker import chunk_markdown
+from completion_cache import CompletionCache
+from deck_service import DeckOwnershipCache
+from dedup_service import NearDuplicateIndex, card_text, lsh_bands
+from upload_service import SpooledUpload, check_upload, spool_upload
+from response_cache import CachedPage, ResponseCache, etag_matches, make_etag
+from pdf_text import page_text_ok
+from app.core.metrics import Counter, Gauge, Histogram, Registry, STAGE_DURATION, STAGE_ERRORS, stage_span
+from app.core.request_context import current_request_id, reset_request_id, set_request_id
+from app.services.usage_service import IngestionUsage, completion_cost, track_usage
+import file_service
+import tempfile
+import threading
+import json
+import httpx
+from fastapi import HTTPException, UploadFile
+from types import SimpleNamespace
+from unittest import mock
 
 
 #Helper for the functions that need the openai client
@@ -30,6 +58,59 @@ def get_openai_async_client():
     return openai.AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
 
+class FakeOpenAIClient:
+    """
+    Stand-in for openai.AsyncOpenAI that returns canned replies in order
+    and records every prompt it was sent. Usage is reported as one token per 4 characters.
+    """
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.prompts = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, model, messages, **kwargs):
+        self.prompts.append(messages[-1]["content"])
+        content = self.replies.pop(0)
+        usage = SimpleNamespace(
+            prompt_tokens=len(messages[-1]["content"]) // 4,
+            completion_tokens=len(content) // 4,
+            prompt_tokens_details=SimpleNamespace(cached_tokens=0)
+        )
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=usage)
+
+
+def make_text_pdf(page_texts):
+    """
+    Builds a minimal PDF with one Helvetica text line per page (an empty string gives a blank page).
+    """
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for text in page_texts:
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET" if text else ""
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        page_ids.append(len(objects))
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids)
+    objects[1] = f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>"
+
+    pdf = "%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += f"{number} 0 obj\n{body}\nendobj\n"
+    xref_offset = len(pdf)
+    pdf += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n"
+    pdf += "".join(f"{offset:010d} 00000 n \n" for offset in offsets)
+    pdf += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n"
+    return pdf.encode("latin-1")
+
+
+def flashcard_reply(question, answer):
+    """ A structured flashcard reply as the model would send it """
+    return json.dumps({"question": question, "answer": answer})
+
+
 #test runner functions
 def run_test(test_func):
     """Runs a single synchronous test function and prints result."""
@@ -63,7 +144,7 @@ def test_create_flashcard_instructions_basic():
     chunk = "Photosynthesis explanation..."
     result = create_flashcard_instructions(chunk)
     assert "Based on the following text chunk" in result
-    assert "Question:" in result and "Answer:" in result
+    assert '"question"' in result and '"answer"' in result
     assert chunk in result
 
 def test_count_tokens_basic():
@@ -89,6 +170,520 @@ def test_filter_markdown_chunks_basic():
     for chunk in approved:
         assert chunk not in flagged, "Chunk should not appear in both approved and flagged lists."
 
+def test_parse_cache_memory_and_disk():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        key = file_digest(b"%PDF-1.4 lecture slides")
+        cache = ParseCache(cache_dir, max_memory_entries=4, max_disk_bytes=1024 * 1024)
+        assert cache.get(key) is None, "Expected a miss on an empty cache"
+
+        cache.put(key, ["page one", "page two"])
+        assert cache.get(key) == ["page one", "page two"]
+
+        # a fresh instance has an empty memory tier, so this hit comes from disk
+        reloaded = ParseCache(cache_dir, max_memory_entries=4, max_disk_bytes=1024 * 1024)
+        assert reloaded.get(key) == ["page one", "page two"]
+
+def test_parse_cache_eviction():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = ParseCache(cache_dir, max_memory_entries=1, max_disk_bytes=64)
+        cache.put("first", ["x" * 40])
+        cache.put("second", ["y" * 40])
+
+        assert list(cache._memory.keys()) == ["second"], "Memory tier should only keep the newest entry"
+        assert not os.path.exists(os.path.join(cache_dir, "first.json")), "Oldest disk entry should be evicted"
+        assert cache.get("second") == ["y" * 40]
+
+def test_parse_cache_tracks_disk_size():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        ParseCache(cache_dir, max_memory_entries=1, max_disk_bytes=1024).put("earlier", ["z" * 40])
+        cache = ParseCache(cache_dir, max_memory_entries=1, max_disk_bytes=100)
+        with mock.patch("os.listdir", wraps=os.listdir) as listdir:
+            for num in range(5):
+                cache.put(f"entry{num}", [str(num) * 40])
+        assert listdir.call_count == 1, "The directory should be listed once, not on every put"
+        assert sorted(os.listdir(cache_dir)) == ["entry3.json", "entry4.json"], "Entries from earlier processes count too"
+        assert cache._disk_bytes == sum(os.path.getsize(os.path.join(cache_dir, name)) for name in os.listdir(cache_dir))
+
+def make_rate_limit_error():
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    response = httpx.Response(429, request=request)
+    return openai.RateLimitError("Rate limit reached", response=response, body=None)
+
+def test_make_flashcard_batches_budget():
+    chunks = ["word " * 100 for _ in range(10)]
+    batches = make_flashcard_batches(chunks, token_budget=1000, max_chunks=20)
+    assert len(batches) > 1, "Chunks over the token budget should be split into several batches"
+    assert [i for batch in batches for i, _ in batch] == list(range(10)), "Every chunk index should appear once, in order"
+
+    capped = make_flashcard_batches(["a", "b", "c"], token_budget=100000, max_chunks=2)
+    assert [len(batch) for batch in capped] == [2, 1]
+
+def test_parse_flashcard_batch():
+    response = json.dumps({"flashcards": [
+        {"chunk_id": 3, "question": "What is A?", "answer": "A letter."},
+        {"chunk_id": 4, "question": "What is B?", "answer": "Another\nletter."},
+    ]})
+    parsed = parse_flashcard_batch(response, [3, 4])
+    assert parsed == {3: ("What is A?", "A letter."), 4: ("What is B?", "Another\nletter.")}
+    unknown = json.dumps({"flashcards": [{"chunk_id": 9, "question": "Q", "answer": "A"}]})
+    assert parse_flashcard_batch(unknown, [3, 4]) is None, "Unknown chunk ids should be rejected"
+    assert parse_flashcard_batch("Chunk: 3\nQuestion: Q\nAnswer: A", [3, 4]) is None, "Free text should be rejected"
+
+def word_count(text):
+    """ Whitespace token counter so packer tests don't need tiktoken encodings """
+    return len(text.split())
+
+def test_pack_pages_groups_pages():
+    pages = ["one two three ", "four five ", "six seven eight nine "]
+    blocks = pack_pages(pages, max_tokens=5, count=word_count)
+    assert blocks == ["one two three four five ", "six seven eight nine "]
+
+def test_pack_pages_splits_oversized_page():
+    page = "First paragraph is here.\n\nSecond one. It has two sentences.\n\n" + "word " * 12
+    blocks = pack_pages([page], max_tokens=6, count=word_count)
+    assert "".join(blocks) == page, "Splitting must not lose or change any text"
+    assert all(word_count(block) <= 6 for block in blocks), "Every block should fit the token budget"
+
+    pieces = split_oversized_page("Short. Also short. ", max_tokens=2, count=word_count)
+    assert [piece for piece, _ in pieces] == ["Short. ", "Also short. "], "Sentences should be split before words"
+
+def test_chunk_markdown_structure():
+    text = (
+        "# Chapter 1\n\n"
+        "## Cells\n\n"
+        "Cells are the basic unit of life.\n\n"
+        "| Organelle | Role |\n| --- | --- |\n| Nucleus | DNA |\n\n"
+        "<page_number>2</page_number>\n"
+        "## Energy\n\n"
+        "- Glycolysis\n- Krebs cycle\n  - in mitochondria\n"
+    )
+    chunks = chunk_markdown(text, max_tokens=500)
+
+    assert "".join(chunks) == text, "Chunking must not change or drop any text"
+    assert len(chunks) == 2, f"Expected one chunk per level 2 section, got {len(chunks)}"
+    assert chunks[0].startswith("# Chapter 1") and "| Nucleus | DNA |" in chunks[0], "Headers stay with their content"
+    assert "<page_number>2</page_number>" in chunks[0]
+    assert "- Krebs cycle\n  - in mitochondria" in chunks[1], "Lists should not be split"
+
+    approved, flagged = filter_markdown_chunks(chunks)
+    assert approved == chunks and not flagged, "No chunk should be header-only"
+
+def test_chunk_markdown_token_budget():
+    text = "".join(f"Paragraph {i} " + "word " * 20 + "\n\n" for i in range(10))
+    chunks = chunk_markdown(text, max_tokens=60, count=word_count)
+    assert "".join(chunks) == text
+    assert len(chunks) > 1 and all(word_count(chunk) <= 60 for chunk in chunks)
+
+def test_deck_ownership_cache():
+    cache = DeckOwnershipCache(ttl_seconds=60, max_entries=2)
+    assert not cache.is_owner("user", "deck1"), "Unknown decks should miss"
+    cache.remember("user", "deck1")
+    assert cache.is_owner("user", "deck1")
+    assert not cache.is_owner("other-user", "deck1"), "Ownership is per user"
+
+    cache.remember("user", "deck2")
+    cache.remember("user", "deck3")
+    assert not cache.is_owner("user", "deck1"), "Least recently used entry should be evicted"
+
+    cache.invalidate("user", "deck3")
+    assert not cache.is_owner("user", "deck3"), "Invalidated entries should miss"
+
+    expired = DeckOwnershipCache(ttl_seconds=0, max_entries=2)
+    expired.remember("user", "deck1")
+    time.sleep(0.01)
+    assert not expired.is_owner("user", "deck1"), "Entries should expire after the TTL"
+
+def test_response_cache_and_etags():
+    cache = ResponseCache(ttl_seconds=60, max_entries=10)
+    body = b'[{"id": "fc1"}]'
+    page = CachedPage(make_etag(body), body, None)
+    cache.put(("flashcards", "deck1"), (100, None, None), page)
+    cache.put(("flashcards", "deck2"), (100, None, None), page)
+    assert cache.get(("flashcards", "deck1"), (100, None, None)) == page
+
+    cache.invalidate(("flashcards", "deck1"))
+    assert cache.get(("flashcards", "deck1"), (100, None, None)) is None, "Invalidated scopes should miss"
+    assert cache.get(("flashcards", "deck2"), (100, None, None)) == page, "Other scopes should be kept"
+
+    assert make_etag(body) == make_etag(body) != make_etag(body + b" ")
+    assert make_etag(body) != make_etag(body, "next-cursor"), "The next page is part of the ETag"
+    assert etag_matches(f'"other", W/{page.etag}', page.etag)
+    assert etag_matches("*", page.etag)
+    assert not etag_matches('"other"', page.etag) and not etag_matches(None, page.etag)
+
+def test_spooled_upload_rolls_over_to_disk():
+    small = SpooledUpload.from_bytes(b"%PDF-1.4 small", spool_bytes=1024)
+    assert small.path is None, "Small uploads should stay in memory"
+    with small.open() as stream:
+        assert stream.read() == b"%PDF-1.4 small"
+
+    content = b"%PDF-1.4 " + b"x" * 4096
+    large = SpooledUpload.from_bytes(content, filename="slides.pdf", spool_bytes=1024)
+    path = large.path
+    assert path is not None and path.endswith(".pdf"), "Large uploads should be spooled to a named .pdf file"
+    with large.open() as stream:
+        assert stream.read() == content
+    assert large.digest == file_digest(content), "The digest should be computed while spooling"
+    large.close()
+    assert not os.path.exists(path), "close() should delete the spool file"
+
+def test_completion_cache_ttl_and_size():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        path = os.path.join(cache_dir, "completions.sqlite3")
+        cache = CompletionCache(path, ttl_seconds=3600, max_bytes=10)
+        assert cache.get("gpt-4o", "prompt") is None
+        cache.put("gpt-4o", "prompt", "reply")
+        assert cache.get("gpt-4o", "prompt") == "reply"
+        assert cache.get("gpt-4o-mini", "prompt") is None, "The model name is part of the key"
+
+        cache.put("gpt-4o", "other prompt", "longer reply")
+        cache.evict()
+        assert cache.stats()["bytes"] <= 10, "Least recently used replies should be evicted over max_bytes"
+
+        expired = CompletionCache(path, ttl_seconds=-1, max_bytes=1000)
+        assert expired.get("gpt-4o", "other prompt") is None, "Expired entries should miss"
+
+        stats = cache.stats()
+        assert stats["hits"] == 1 and stats["misses"] == 2
+
+def test_completion_cache_hits_batch_recency_updates():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = CompletionCache(os.path.join(cache_dir, "completions.sqlite3"), ttl_seconds=3600, max_bytes=5)
+        cache.put("gpt-4o", "old prompt", "reply")
+        time.sleep(0.01)
+        cache.put("gpt-4o", "new prompt", "reply")
+        time.sleep(0.01)
+
+        changes = cache._connection().total_changes
+        assert cache.get("gpt-4o", "old prompt") == "reply"
+        assert cache._connection().total_changes == changes, "A hit should not write to the database"
+
+        # the queued touch makes "old prompt" the most recently used entry before eviction
+        cache.evict()
+        assert cache.get("gpt-4o", "old prompt") == "reply", "The entry read last should survive eviction"
+        assert cache.get("gpt-4o", "new prompt") is None, "The least recently used entry should be evicted"
+
+def test_page_text_ok_heuristic():
+    assert page_text_ok("Photosynthesis converts light energy into chemical energy in plants.")
+    assert not page_text_ok("   \n  "), "Empty pages should be rejected"
+    assert not page_text_ok("(cid:12)(cid:40)(cid:3) " * 10 + "some text"), "Unmapped glyphs should be rejected"
+
+
+#async tests with a fake request
+async def test_create_flashcard_batch_fallback():
+    client = FakeOpenAIClient([
+        json.dumps({"flashcards": [{"chunk_id": 0, "question": "What is Python?", "answer": "A language."}]}),
+        flashcard_reply("What is FastAPI?", "A framework."),
+    ])
+    batch = [(0, "Python is a language."), (1, "FastAPI is a framework.")]
+    flashcards = await create_flashcard_batch(client, batch)
+
+    assert len(client.prompts) == 2, "Missing chunk should be retried with a single-chunk call"
+    assert flashcards[0] == ("What is Python?", "A language.")
+    assert flashcards[1] == ("What is FastAPI?", "A framework.")
+
+async def test_scheduler_retries_rate_limit():
+    scheduler = OpenAIScheduler(max_in_flight=2, requests_per_minute=6000, tokens_per_minute=100000,
+                                max_retries=3, base_delay=0.01)
+    attempts = []
+
+    async def flaky_request():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise make_rate_limit_error()
+        return "ok"
+
+    result = await scheduler.run(flaky_request, estimated_tokens=10)
+    assert result == "ok", "Request should succeed after the rate limit clears"
+    assert len(attempts) == 3, "Expected two retries before success"
+
+async def test_scheduler_retries_server_errors():
+    scheduler = OpenAIScheduler(max_in_flight=2, requests_per_minute=6000, tokens_per_minute=100000,
+                                max_retries=3, base_delay=0.01)
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    errors = [
+        openai.InternalServerError("Server error", response=httpx.Response(500, request=request), body=None),
+        openai.APIConnectionError(request=request),
+    ]
+
+    async def flaky_request():
+        if errors:
+            raise errors.pop(0)
+        return "ok"
+
+    result = await scheduler.run(flaky_request)
+    assert result == "ok" and not errors, "5xx replies and connection errors should be retried by the scheduler"
+
+async def test_openai_client_has_no_sdk_retries():
+    # the client refuses to build without a key, no request is sent
+    with mock.patch.dict(os.environ, {"OPENAI_API_KEY": "test"}):
+        assert get_openai_client().max_retries == 0, "Retries belong to the scheduler, not the SDK"
+
+async def test_scheduler_caps_in_flight():
+    scheduler = OpenAIScheduler(max_in_flight=3, requests_per_minute=6000, tokens_per_minute=100000,
+                                max_retries=0)
+    peak = []
+
+    async def slow_request():
+        peak.append(scheduler.in_flight)
+        await asyncio.sleep(0.01)
+        return True
+
+    await asyncio.gather(*[scheduler.run(slow_request) for _ in range(20)])
+    assert max(peak) <= 3, f"In-flight requests exceeded the cap: {max(peak)}"
+
+async def test_job_manager_records_failure():
+    manager = JobManager(num_workers=2, max_jobs_kept=10)
+
+    async def good_work(job):
+        job.progress["chunks_done"] = 3
+
+    async def bad_work(job):
+        raise ValueError("parser exploded")
+
+    good = manager.submit("deck1", "user1", good_work)
+    bad = manager.submit("deck1", "user1", bad_work)
+    assert manager.queue_depth == 2, "Both jobs should be queued before the workers run"
+    await manager.join()
+
+    assert good.status == "completed" and good.progress["chunks_done"] == 3
+    assert bad.status == "failed" and "parser exploded" in bad.error
+    assert len(manager.list_for_user("user1", "deck1")) == 2
+
+async def test_stream_chunks_yields_every_card():
+    client = FakeOpenAIClient([
+        flashcard_reply("What is Python?", "A language."),
+        flashcard_reply("What is FastAPI?", "A framework."),
+    ])
+    progress = {"chunks_done": 0}
+    chunks = ["Python is a language.", "FastAPI is a framework."]
+    results = [item async for item in stream_chunks(client, chunks, batch_mode=False, progress=progress)]
+
+    assert sorted(index for index, _ in results) == [0, 1], "Every chunk should yield exactly one card"
+    assert progress["chunks_done"] == 2
+
+async def test_create_flashcard_uses_completion_cache():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = CompletionCache(os.path.join(cache_dir, "completions.sqlite3"), ttl_seconds=3600, max_bytes=1024 * 1024)
+        original_get_cache = file_service.get_completion_cache
+        file_service.get_completion_cache = lambda: cache
+        cache_threads = set()
+        for name in ("get", "put"):
+            method = getattr(cache, name)
+            setattr(cache, name, lambda *args, method=method: cache_threads.add(threading.get_ident()) or method(*args))
+        try:
+            client = FakeOpenAIClient([flashcard_reply("What is Python?", "A language.")])
+            first = await create_flashcard(client, "Python is a language.", 0)
+            second = await create_flashcard(client, "Python is a language.", 5)
+        finally:
+            file_service.get_completion_cache = original_get_cache
+
+    assert first == second == ("What is Python?", "A language.")
+    assert len(client.prompts) == 1, "The repeated chunk should be served from the cache"
+    assert cache.hits == 1
+    assert threading.get_ident() not in cache_threads, "SQLite I/O should run on worker threads, not the event loop"
+
+async def test_spool_upload_enforces_max_size():
+    spooled = tempfile.SpooledTemporaryFile()
+    spooled.write(b"x" * 2048)
+    spooled.seek(0)
+    upload_file = UploadFile(file=spooled, filename="big.pdf")
+    try:
+        await spool_upload(upload_file, max_bytes=1024)
+        assert False, "Expected HTTPException for an oversized upload"
+    except HTTPException as e:
+        assert e.status_code == 413
+
+def test_check_upload_preflight():
+    check_upload(UploadFile(file=tempfile.SpooledTemporaryFile(), filename="notes.pdf"))
+    checks = [
+        (UploadFile(file=tempfile.SpooledTemporaryFile(), filename="notes.txt"), 415),
+        (UploadFile(file=tempfile.SpooledTemporaryFile(), filename="notes.pdf", headers={"content-type": "image/png"}), 415),
+        (UploadFile(file=tempfile.SpooledTemporaryFile(), filename="notes.pdf", size=2048), 413),
+    ]
+    for upload_file, expected_status in checks:
+        try:
+            check_upload(upload_file, max_bytes=1024)
+            assert False, f"Expected a {expected_status} for {upload_file.filename}"
+        except HTTPException as e:
+            assert e.status_code == expected_status, f"Expected {expected_status}, got {e.status_code}"
+
+def test_ingestion_admission_caps():
+    admission = IngestionAdmission(max_active=3, max_active_per_user=2, estimated_seconds=10)
+    admission.admit("heavy")
+    admission.admit("heavy")
+    try:
+        admission.admit("heavy", queue_depth=0, num_workers=2)
+        assert False, "Expected a 429 past the per-user cap"
+    except HTTPException as e:
+        assert e.status_code == 429
+        assert e.headers["Retry-After"] == "10"
+
+    admission.admit("light")
+    try:
+        admission.admit("other", queue_depth=4, num_workers=2)
+        assert False, "Expected a 429 past the global cap"
+    except HTTPException as e:
+        assert e.status_code == 429
+        # two rounds of queued jobs ahead plus the running one
+        assert e.headers["Retry-After"] == "30", "Retry-After should grow with the queue depth"
+
+    admission.release("heavy", elapsed_seconds=20)
+    assert admission.estimated_seconds == 12, "Finished ingestions should refine the estimate"
+    admission.admit("heavy")
+    assert admission.stats()["rejected"] == 2 and admission.active == 3
+
+def test_near_duplicate_index():
+    index = NearDuplicateIndex(threshold=0.8)
+    assert lsh_bands(128, 0.8) == (16, 8)
+    index.add(["What does the mitochondria produce for the cell?"])
+    keep = index.filter_new([
+        "What does the mitochondria produce for the cell ?",
+        "What is the function of the ribosome in protein synthesis?",
+        "what is the FUNCTION of the ribosome in protein synthesis",
+        "What is DNA?",
+        "What is RNA?",
+    ])
+    assert keep == [False, True, False, True, True], f"Unexpected duplicate flags {keep}"
+    assert len(index) == 4, "Only the cards that were kept should be indexed"
+
+def test_near_duplicate_index_keeps_near_misses():
+    index = NearDuplicateIndex()
+    keep = index.filter_new([
+        card_text("What does the acronym TCP stand for in computer networking?", "Transmission Control Protocol"),
+        card_text("What does the acronym UDP stand for in computer networking?", "User Datagram Protocol"),
+        card_text("What is the time complexity of inserting an element into a binary heap?", "O(log n)"),
+        card_text("What is the time complexity of inserting an element into a binary search tree?", "O(log n)"),
+        card_text("In which year did World War II end?", "1945"),
+        card_text("In which year did World War I end?", "1918"),
+        card_text("what does the acronym TCP stand for in computer networking", "Transmission Control Protocol."),
+    ])
+    assert keep == [True] * 6 + [False], f"Unexpected duplicate flags {keep}"
+
+    templated = NearDuplicateIndex()
+    keep = templated.filter_new([
+        card_text(f"In which year did the treaty of city number {num} get signed?", f"In {1000 + num}.")
+        for num in range(2000)
+    ])
+    assert all(keep), f"{keep.count(False)} distinct templated cards were dropped"
+
+def test_near_duplicate_index_scales():
+    index = NearDuplicateIndex(threshold=0.8)
+    questions = [f"Which year did event number {num} of the {num % 7} era happen in?" for num in range(20000)]
+    start = time.perf_counter()
+    index.add(questions)
+    keep = index.filter_new([questions[123].upper(), "A brand new question about the Krebs cycle?"])
+    elapsed = time.perf_counter() - start
+    assert keep == [False, True]
+    assert elapsed < 10, f"Indexing 20000 cards took {elapsed:.1f}s"
+
+def test_metrics_render_prometheus_text():
+    registry = Registry()
+    latency = registry.register(Histogram("test_latency_seconds", "Latency.", ("stage",), buckets=(0.1, 1)))
+    errors = registry.register(Counter("test_errors_total", "Errors.", ("stage",)))
+    in_flight = registry.register(Gauge("test_in_flight", "In flight."))
+    latency.observe(0.05, stage="parse")
+    latency.observe(0.5, stage="parse")
+    latency.observe(5, stage='say "hi"')
+    errors.inc(stage="parse")
+    in_flight.inc()
+    text = registry.render()
+    assert "# TYPE test_latency_seconds histogram" in text
+    assert 'test_latency_seconds_bucket{stage="parse",le="0.1"} 1' in text
+    assert 'test_latency_seconds_bucket{stage="parse",le="1"} 2' in text
+    assert 'test_latency_seconds_bucket{stage="parse",le="+Inf"} 2' in text
+    assert 'test_latency_seconds_count{stage="parse"} 2' in text
+    assert 'test_latency_seconds_count{stage="say \\"hi\\""} 1' in text, "Label values should be escaped"
+    assert 'test_errors_total{stage="parse"} 1' in text
+    assert "test_in_flight 1" in text
+
+def test_stage_span_records_errors():
+    before = STAGE_DURATION.count(stage="unit_test")
+    with stage_span("unit_test"):
+        pass
+    try:
+        with stage_span("unit_test"):
+            raise ValueError("boom")
+    except ValueError:
+        pass
+    assert STAGE_DURATION.count(stage="unit_test") == before + 2
+    assert STAGE_ERRORS.value(stage="unit_test") == 1
+
+async def test_job_carries_request_id():
+    manager = JobManager(num_workers=1, max_jobs_kept=10)
+    seen = []
+
+    async def work(job):
+        seen.append(current_request_id())
+
+    token = set_request_id("req-123")
+    job = manager.submit("deck1", "user1", work)
+    reset_request_id(token)
+    await manager.join()
+    assert job.request_id == "req-123" and seen == ["req-123"], "The job should run under its upload's request id"
+
+async def test_parse_file_local_fast_path():
+    good_text = "Photosynthesis converts light energy into chemical energy stored in glucose."
+    pdf_bytes = make_text_pdf([good_text, ""])
+    requested = []
+
+    async def fake_llama_parse_pages(upload, target_pages=None):
+        requested.append(target_pages)
+        return ["# Scanned page"]
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        original_parser, original_cache = file_service.llama_parse_pages, file_service.get_parse_cache
+        cache = ParseCache(cache_dir, max_memory_entries=4, max_disk_bytes=1024 * 1024)
+        file_service.llama_parse_pages = fake_llama_parse_pages
+        file_service.get_parse_cache = lambda: cache
+        try:
+            pages = await file_service.parse_file(SpooledUpload.from_bytes(pdf_bytes))
+        finally:
+            file_service.llama_parse_pages, file_service.get_parse_cache = original_parser, original_cache
+
+    assert good_text in pages[0], "The text layer should be used for the good page"
+    assert pages[1] == "# Scanned page", "The blank page should come from LlamaParse"
+    assert requested == [[1]], "Only the bad page should be sent to LlamaParse"
+
+async def test_create_flashcard_retries_malformed_reply():
+    client = FakeOpenAIClient([
+        "Question: not JSON\nAnswer: at all",
+        flashcard_reply("What is Python?", "A language."),
+    ])
+    question, answer = await create_flashcard(client, "Python is a language.", 0)
+    assert (question, answer) == ("What is Python?", "A language.")
+    assert len(client.prompts) == 2, "A malformed reply should be retried once"
+
+async def test_process_chunks_reports_failed_chunks():
+    client = FakeOpenAIClient([
+        flashcard_reply("What is Python?", "A language."),
+        "garbage",
+        "more garbage",
+    ])
+    chunks = ["Python is a language.", "Unparseable chunk."]
+    results = await process_chunks(client, chunks, batch_mode=False)
+
+    assert results.flashcards == [("What is Python?", "A language.")], "Successful cards should be kept"
+    assert results.failed_chunks == [1], "The chunk that failed every attempt should be reported"
+
+async def test_process_chunks_tracks_usage():
+    client = FakeOpenAIClient([
+        flashcard_reply("What is Python?", "A language."),
+        "garbage",
+        "more garbage",
+    ])
+    usage = IngestionUsage()
+    with track_usage(usage):
+        await process_chunks(client, ["Python is a language.", "Unparseable chunk."], batch_mode=False)
+    await process_chunks(FakeOpenAIClient([flashcard_reply("Q", "A")]), ["Not tracked."], batch_mode=False)
+
+    expected_prompt = sum(len(prompt) // 4 for prompt in client.prompts)
+    assert usage.total.requests == 3, "Malformed replies are billed too"
+    assert usage.stages["flashcard"].prompt_tokens == usage.total.prompt_tokens == expected_prompt
+    assert usage.total.cost_usd == completion_cost("gpt-4o", usage.total.prompt_tokens, 0, usage.total.completion_tokens)
+    assert completion_cost("gpt-4o", 1_000_000, 500_000, 100_000) == 1.25 + 0.625 + 1.0
+    assert completion_cost("unknown-model", 1000, 0, 1000) == 0
+
 
 #async tests that call the api
 
@@ -123,21 +718,21 @@ async def test_process_chunks_real_call():
         "Python is an interpreted language.",
         "FastAPI is a modern web framework in Python."
     ]
-    qa_pairs = await process_chunks(openai_client, chunks)
-    print("QA PAIRS:", qa_pairs)
-    assert len(qa_pairs) == len(chunks), "We should get a flashcard for each chunk."
-    for q, a in qa_pairs:
+    results = await process_chunks(openai_client, chunks)
+    print("QA PAIRS:", results.flashcards)
+    assert len(results.flashcards) == len(chunks), "We should get a flashcard for each chunk."
+    for q, a in results.flashcards:
         assert len(q) > 5 and len(a) > 5, "Each question/answer should have content."
 
 async def test_process_file_real_call():
     """
-    This function already does openai.AsyncOpenAI(...) internally, 
+    This function already gets its OpenAI client internally (get_openai_client),
     so we just call it, no need for the client helper.
     """
     fake_pdf_content = b"Introduction: This is a test PDF.\n\nPage2: Some more text."
-    qa_pairs = await process_file(fake_pdf_content)
-    print("FILE QA PAIRS:", qa_pairs)
-    assert len(qa_pairs) > 0, "We expect at least one Q/A pair from the processed file."
+    results = await process_file(SpooledUpload.from_bytes(fake_pdf_content))
+    print("FILE QA PAIRS:", results.flashcards)
+    assert len(results.flashcards) > 0, "We expect at least one Q/A pair from the processed file."
 
 async def test_chunk_text_real_call():
     openai_client = get_openai_async_client()
@@ -159,6 +754,44 @@ async def main():
     run_test(test_create_flashcard_instructions_basic)
     run_test(test_count_tokens_basic)
     run_test(test_filter_markdown_chunks_basic)
+    run_test(test_parse_cache_memory_and_disk)
+    run_test(test_parse_cache_eviction)
+    run_test(test_parse_cache_tracks_disk_size)
+    run_test(test_make_flashcard_batches_budget)
+    run_test(test_parse_flashcard_batch)
+    run_test(test_pack_pages_groups_pages)
+    run_test(test_pack_pages_splits_oversized_page)
+    run_test(test_chunk_markdown_structure)
+    run_test(test_chunk_markdown_token_budget)
+    run_test(test_completion_cache_ttl_and_size)
+    run_test(test_completion_cache_hits_batch_recency_updates)
+    run_test(test_page_text_ok_heuristic)
+    run_test(test_deck_ownership_cache)
+    run_test(test_response_cache_and_etags)
+    run_test(test_spooled_upload_rolls_over_to_disk)
+
+    # Asynchronous tests with fake requests
+    await run_async_test(test_scheduler_retries_rate_limit)
+    await run_async_test(test_scheduler_retries_server_errors)
+    await run_async_test(test_openai_client_has_no_sdk_retries)
+    await run_async_test(test_scheduler_caps_in_flight)
+    await run_async_test(test_create_flashcard_batch_fallback)
+    await run_async_test(test_job_manager_records_failure)
+    await run_async_test(test_stream_chunks_yields_every_card)
+    await run_async_test(test_create_flashcard_uses_completion_cache)
+    await run_async_test(test_spool_upload_enforces_max_size)
+    run_test(test_check_upload_preflight)
+    run_test(test_ingestion_admission_caps)
+    run_test(test_near_duplicate_index)
+    run_test(test_near_duplicate_index_keeps_near_misses)
+    run_test(test_near_duplicate_index_scales)
+    run_test(test_metrics_render_prometheus_text)
+    run_test(test_stage_span_records_errors)
+    await run_async_test(test_job_carries_request_id)
+    await run_async_test(test_parse_file_local_fast_path)
+    await run_async_test(test_create_flashcard_retries_malformed_reply)
+    await run_async_test(test_process_chunks_reports_failed_chunks)
+    await run_async_test(test_process_chunks_tracks_usage)
 
     # Asynchronous (real GPT) tests
     await run_async_test(test_create_flashcard_real_call)
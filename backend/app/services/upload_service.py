@@ -0,0 +1,178 @@
+import hashlib
+import io
+import mimetypes
+import os
+import tempfile
+
+from fastapi import HTTPException, UploadFile, status
+from fastapi.responses import JSONResponse
+
+
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(50 * 1024 * 1024)))
+# uploads up to this size stay in memory, larger ones are written to a temp file
+UPLOAD_SPOOL_BYTES = int(os.getenv("UPLOAD_SPOOL_BYTES", str(1024 * 1024)))
+UPLOAD_READ_CHUNK_BYTES = 256 * 1024
+# room for multipart boundaries and headers on top of the file itself
+UPLOAD_BODY_OVERHEAD_BYTES = 64 * 1024
+# content types the ingestion pipeline accepts, comma separated
+UPLOAD_ALLOWED_TYPES = tuple(
+    content_type.strip() for content_type in os.getenv("UPLOAD_ALLOWED_TYPES", "application/pdf").split(",")
+    if content_type.strip()
+)
+
+
+class SpooledUpload:
+    """
+    An uploaded file owned by the ingestion pipeline. It is hashed while it is written,
+    kept in memory up to spool_bytes and moved to a named temp file past that, so
+    parsers read it through open() instead of getting their own copy of the bytes.
+    close() deletes the temp file.
+    """
+
+    def __init__(self, filename: str = "upload.pdf", spool_bytes: int = UPLOAD_SPOOL_BYTES):
+        self.filename = filename or "upload.pdf"
+        self.spool_bytes = spool_bytes
+        self.size = 0
+        self.path = None
+        self._hash = hashlib.sha256()
+        self._memory = io.BytesIO()
+        self._data = None
+        self._file = None
+
+    @classmethod
+    def from_bytes(cls, data: bytes, filename: str = "upload.pdf", spool_bytes: int = UPLOAD_SPOOL_BYTES) -> "SpooledUpload":
+        upload = cls(filename, spool_bytes)
+        upload.write(data)
+        upload.finish()
+        return upload
+
+    def write(self, data: bytes):
+        self._hash.update(data)
+        self.size += len(data)
+        if self._file is None and self.size > self.spool_bytes:
+            # keep the upload's extension, LlamaParse picks the file type from it
+            suffix = os.path.splitext(self.filename)[1] or ".pdf"
+            self._file = tempfile.NamedTemporaryFile(prefix="quickthink_upload_", suffix=suffix, delete=False)
+            self.path = self._file.name
+            self._file.write(self._memory.getbuffer())
+            self._memory = None
+        if self._file is not None:
+            self._file.write(data)
+        else:
+            self._memory.write(data)
+
+    def finish(self):
+        """ Called once everything is written, after that the upload can only be read """
+        if self._file is not None:
+            self._file.close()
+        else:
+            # BytesIO shares an immutable bytes object, so every open() below is zero copy
+            self._data = self._memory.getvalue()
+            self._memory = None
+
+    @property
+    def digest(self) -> str:
+        """ SHA-256 hex digest of the content, the same key parse_cache.file_digest computes """
+        return self._hash.hexdigest()
+
+    def open(self):
+        """ A new binary reader positioned at the start of the upload """
+        if self.path is not None:
+            return open(self.path, "rb")
+        return io.BytesIO(self._data)
+
+    def close(self):
+        if self.path is not None:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+            self.path = None
+        self._data = None
+
+
+async def spool_upload(file: UploadFile, max_bytes: int = UPLOAD_MAX_BYTES) -> SpooledUpload:
+    """
+    Copies an UploadFile into a SpooledUpload chunk by chunk, hashing it in the same pass.
+    Raises a 413 as soon as the upload grows past max_bytes.
+    """
+    if file.size is not None and file.size > max_bytes:
+        raise upload_too_large(max_bytes)
+
+    upload = SpooledUpload(file.filename)
+    try:
+        while True:
+            data = await file.read(UPLOAD_READ_CHUNK_BYTES)
+            if not data:
+                break
+            if upload.size + len(data) > max_bytes:
+                raise upload_too_large(max_bytes)
+            upload.write(data)
+        upload.finish()
+    except BaseException:
+        upload.finish()
+        upload.close()
+        raise
+    return upload
+
+
+def check_upload(file: UploadFile, max_bytes: int = UPLOAD_MAX_BYTES):
+    """
+    Preflight run before an upload is admitted or spooled: raises a 415 for a content type
+    outside UPLOAD_ALLOWED_TYPES and a 413 when the declared size is already over max_bytes.
+    A missing or generic content type falls back to the file extension.
+    """
+    content_type = (file.content_type or "").split(";")[0].strip().lower()
+    if content_type in ("", "application/octet-stream"):
+        content_type = mimetypes.guess_type(file.filename or "")[0] or content_type
+    if content_type not in UPLOAD_ALLOWED_TYPES:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail=f"Unsupported file type {content_type or 'unknown'}, expected {', '.join(UPLOAD_ALLOWED_TYPES)}."
+        )
+    if file.size is not None and file.size > max_bytes:
+        raise upload_too_large(max_bytes)
+
+
+def upload_too_large(max_bytes: int) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"File is larger than the {max_bytes // (1024 * 1024)} MB upload limit."
+    )
+
+
+class UploadSizeLimitMiddleware:
+    """
+    ASGI middleware that stops reading a request body once it passes max_bytes and answers 413,
+    so oversized uploads are refused while they stream in instead of being spooled to disk first.
+    A declared Content-Length over the limit is refused before any of the body is read.
+    """
+
+    def __init__(self, app, max_bytes: int = UPLOAD_MAX_BYTES + UPLOAD_BODY_OVERHEAD_BYTES):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_bytes:
+            error = upload_too_large(self.max_bytes)
+            await JSONResponse({"detail": error.detail}, status_code=error.status_code)(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # FastAPI re-raises HTTPExceptions from body parsing, so this becomes the 413 response
+                    raise upload_too_large(self.max_bytes)
+            return message
+
+        await self.app(scope, limited_receive, send)
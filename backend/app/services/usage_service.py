@@ -0,0 +1,133 @@
+import json
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from pydantic import BaseModel, Field
+
+from app.core.metrics import LLM_COST, LLM_TOKENS
+from app.core.request_context import log
+
+
+# USD per million tokens, OPENAI_PRICES (same JSON shape) overrides or adds models
+OPENAI_PRICES = {
+    "gpt-4o": {"input": 2.50, "cached_input": 1.25, "output": 10.00},
+    **json.loads(os.getenv("OPENAI_PRICES", "{}")),
+}
+
+_current_usage = ContextVar("ingestion_usage", default=None)
+
+
+class UsageTotals(BaseModel):
+    """ Token counts and cost of a group of completions """
+    requests: int = 0
+    cache_hits: int = 0
+    prompt_tokens: int = 0
+    cached_prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cost_usd: float = 0.0
+
+    def add(self, prompt_tokens: int, cached_prompt_tokens: int, completion_tokens: int, cost_usd: float):
+        self.requests += 1
+        self.prompt_tokens += prompt_tokens
+        self.cached_prompt_tokens += cached_prompt_tokens
+        self.completion_tokens += completion_tokens
+        self.cost_usd += cost_usd
+
+
+class IngestionUsage(BaseModel):
+    """
+    OpenAI usage of one upload, in total and per stage (the `operation` of each completion:
+    chunk_text, flashcard, flashcard_batch). Completion cache hits cost nothing and are only counted.
+    """
+    total: UsageTotals = Field(default_factory=UsageTotals)
+    stages: Dict[str, UsageTotals] = Field(default_factory=dict)
+
+    def stage(self, operation: str) -> UsageTotals:
+        return self.stages.setdefault(operation, UsageTotals())
+
+
+def completion_cost(model: str, prompt_tokens: int, cached_prompt_tokens: int, completion_tokens: int) -> float:
+    """ USD cost of one completion, 0 for a model without a price """
+    prices = OPENAI_PRICES.get(model)
+    if prices is None:
+        return 0.0
+    uncached = prompt_tokens - cached_prompt_tokens
+    return (
+        uncached * prices["input"]
+        + cached_prompt_tokens * prices.get("cached_input", prices["input"])
+        + completion_tokens * prices["output"]
+    ) / 1_000_000
+
+
+@contextmanager
+def track_usage(usage: IngestionUsage):
+    """ Completions made inside the block (and in tasks it starts) are added to usage """
+    token = _current_usage.set(usage)
+    try:
+        yield usage
+    finally:
+        try:
+            _current_usage.reset(token)
+        except ValueError:
+            # an abandoned stream is finalized from another context, which has nothing to reset
+            pass
+
+
+def current_usage() -> Optional[IngestionUsage]:
+    return _current_usage.get()
+
+
+def record_completion(operation: str, model: str, usage):
+    """
+    Adds the `usage` block of a chat completion to the metrics and to the upload being tracked.
+    A completion without one (e.g. a stand-in client) counts as a request with no tokens.
+    """
+    prompt_tokens = getattr(usage, "prompt_tokens", None) or 0
+    completion_tokens = getattr(usage, "completion_tokens", None) or 0
+    cached_prompt_tokens = getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", None) or 0
+    cost_usd = completion_cost(model, prompt_tokens, cached_prompt_tokens, completion_tokens)
+
+    LLM_TOKENS.inc(prompt_tokens, operation=operation, kind="prompt")
+    LLM_TOKENS.inc(completion_tokens, operation=operation, kind="completion")
+    LLM_COST.inc(cost_usd, operation=operation)
+
+    tracked = current_usage()
+    if tracked is not None:
+        tracked.total.add(prompt_tokens, cached_prompt_tokens, completion_tokens, cost_usd)
+        tracked.stage(operation).add(prompt_tokens, cached_prompt_tokens, completion_tokens, cost_usd)
+
+
+def record_cache_hit(operation: str):
+    tracked = current_usage()
+    if tracked is not None:
+        tracked.total.cache_hits += 1
+        tracked.stage(operation).cache_hits += 1
+
+
+async def save_ingestion_usage(supabase, deck_id: str, user_id: str, usage: IngestionUsage, job_id: str = None):
+    """
+    Stores the usage of one upload in the ingestion_usage table (see supabase/migrations).
+    Accounting must never fail an upload, so errors are logged and swallowed.
+    """
+    total = usage.total
+    log(f"usage requests={total.requests} cache_hits={total.cache_hits} prompt_tokens={total.prompt_tokens} "
+        f"completion_tokens={total.completion_tokens} cost_usd={total.cost_usd:.4f}")
+    if not total.requests and not total.cache_hits:
+        return
+    try:
+        await supabase.table("ingestion_usage").insert({
+            "job_id": job_id,
+            "deck_id": deck_id,
+            "user_id": user_id,
+            "requests": total.requests,
+            "cache_hits": total.cache_hits,
+            "prompt_tokens": total.prompt_tokens,
+            "cached_prompt_tokens": total.cached_prompt_tokens,
+            "completion_tokens": total.completion_tokens,
+            "cost_usd": round(total.cost_usd, 6),
+            "stages": {operation: stage.model_dump() for operation, stage in usage.stages.items()},
+        }).execute()
+    except Exception as e:
+        log("Saving ingestion usage failed:", str(e))
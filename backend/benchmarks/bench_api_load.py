@@ -0,0 +1,338 @@
+"""
+In-process load test of the deck CRUD API.
+
+Drives the real app from main.py (all middleware included) through httpx's ASGI transport,
+with the Supabase client replaced by the in-memory FakeSupabase from benchmarks/fake_backends.py.
+Each endpoint is run on its own at every concurrency level, with that many clients sending
+requests back to back, and reported as requests/s and p50/p95/p99 latency.
+
+The app runs on its own event loop in a separate thread, the clients on the main thread's loop,
+so the driver's own work doesn't show up as app blocking. The listing response cache is off
+by default so every request reaches the handlers and the fake database, --response-cache
+turns it on to measure cached listings.
+
+Two columns show whether the event loop or the threadpool is the bottleneck:
+  threads  most threadpool workers busy at once / pool size, and the most requests queued for one.
+           FastAPI runs sync dependencies and handlers on this pool, the app's own are all async.
+  stall    the longest single step the app's event loop ran (a task step or callback), i.e. the
+           longest everything else on the loop had to wait for one piece of code. It grows when
+           something blocks the loop (a sync client called from an async handler, CPU heavy code),
+           not with the number of requests queued. Full garbage collections land here too, and
+           both threads share the GIL, so a few ms of it can be the driver holding it.
+
+Run from the backend directory:
+    python -m benchmarks.bench_api_load
+    python -m benchmarks.bench_api_load --concurrency 1,16,64,256 --db-latency 0.02
+    python -m benchmarks.bench_api_load --blocking-auth-ms 5 --thread-tokens 8   # saturate the threadpool
+    python -m benchmarks.bench_api_load --blocking-db                            # stall the event loop
+    python -m benchmarks.bench_api_load --response-cache                         # serve listings from the cache
+"""
+import argparse
+import asyncio
+import contextlib
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from collections import Counter
+
+import anyio.to_thread
+import httpx
+
+from app.core.supabase import get_supabase_client
+from app.endpoints.decks import get_current_user
+from app.services import response_cache
+from benchmarks.fake_backends import FakeSupabase, Latency
+from main import app
+
+
+USER_ID = asyncio.run(get_current_user())
+
+
+class Fixture:
+    """ The fake database and the decks the requests point at """
+
+    def __init__(self, supabase: FakeSupabase, num_decks: int, num_cards: int):
+        self.supabase = supabase
+        decks = supabase.seed("flashcard_decks", [
+            {"user_id": USER_ID, "name": f"Deck {deck_num}", "category": "bench", "description": None}
+            for deck_num in range(num_decks + 1)
+        ])
+        # reads go to read_deck, writes to write_deck, so write traffic doesn't grow the pages being read
+        self.read_deck = decks[0]["id"]
+        self.write_deck = decks[1]["id"]
+        supabase.seed("flashcards", [
+            {"deck_id": self.read_deck, "question": f"Question {card_num}?", "answer": f"Answer {card_num}."}
+            for card_num in range(num_cards)
+        ])
+        self._disposable = []
+
+    def seed_disposable(self, count: int):
+        """ Decks for the DELETE requests, seeded while the app is idle since it runs on another thread """
+        self._disposable.extend(deck["id"] for deck in self.supabase.seed("flashcard_decks", [
+            {"user_id": USER_ID, "name": "Disposable", "category": "bench", "description": None}
+            for _ in range(count)
+        ]))
+
+    def disposable_deck(self) -> str:
+        return self._disposable.pop()
+
+
+# endpoint -> function of (fixture, request number) returning (method, path, json body)
+REQUESTS = {
+    "GET /api/decks": lambda fixture, n: ("GET", "/api/decks", None),
+    "GET /api/decks/{id}/flashcards": lambda fixture, n: (
+        "GET", f"/api/decks/{fixture.read_deck}/flashcards", None
+    ),
+    "POST /api/decks": lambda fixture, n: (
+        "POST", "/api/decks", {"name": f"Load {n}", "category": "bench", "description": "created by the load test"}
+    ),
+    "PATCH /api/decks/{id}": lambda fixture, n: (
+        "PATCH", f"/api/decks/{fixture.write_deck}", {"description": f"updated {n}"}
+    ),
+    "POST /api/decks/{id}/flashcards": lambda fixture, n: (
+        "POST", f"/api/decks/{fixture.write_deck}/flashcards",
+        [{"question": f"Load question {n}.{card}?", "answer": f"Load answer {n}.{card}."} for card in range(5)]
+    ),
+    "DELETE /api/decks/{id}": lambda fixture, n: ("DELETE", f"/api/decks/{fixture.disposable_deck()}", None),
+}
+
+# endpoint -> function of (fixture, number of requests) run before a level starts
+SETUP = {
+    "DELETE /api/decks/{id}": lambda fixture, total: fixture.seed_disposable(total),
+}
+
+
+class AppThread:
+    """ An event loop on its own thread, the app and the LoopMonitor run there """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="app-loop", daemon=True)
+        self._thread.start()
+        self.thread_id = self._thread.ident
+
+    async def run(self, coroutine):
+        """ Runs coroutine on the app loop and waits for it from the caller's loop """
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coroutine, self.loop))
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+
+class AppThreadTransport(httpx.AsyncBaseTransport):
+    """ httpx's ASGI transport with the app called on the AppThread's loop """
+
+    def __init__(self, app_thread: AppThread, transport: httpx.ASGITransport):
+        self.app_thread = app_thread
+        self.transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        # the ASGI transport buffers the whole response body, it can be read from the client's loop
+        return await self.app_thread.run(self.transport.handle_async_request(request))
+
+
+class StepTimer:
+    """
+    Times every step the event loop on one thread runs, by wrapping asyncio's Handle._run
+    (task steps, call_soon callbacks and timers all go through it) while installed.
+    Steps on other threads, e.g. the benchmark's clients, are not timed.
+    """
+
+    def __init__(self, thread_id: int):
+        self.thread_id = thread_id
+        self.max_step = 0.0
+        self._original = None
+
+    def __enter__(self):
+        original = self._original = asyncio.events.Handle._run
+        timer = self
+
+        def timed_run(handle):
+            if threading.get_ident() != timer.thread_id:
+                return original(handle)
+            start = time.perf_counter()
+            try:
+                return original(handle)
+            finally:
+                timer.max_step = max(timer.max_step, time.perf_counter() - start)
+
+        asyncio.events.Handle._run = timed_run
+        return self
+
+    def __exit__(self, *exc_info):
+        asyncio.events.Handle._run = self._original
+
+
+class LoopMonitor:
+    """
+    Samples the threadpool every interval: its busy workers and queued callers (anyio's default
+    thread limiter). Runs on the app's loop, where that limiter lives.
+    """
+
+    def __init__(self, interval: float = 0.001):
+        self.interval = interval
+        self.max_busy = 0
+        self.max_waiting = 0
+        self._running = True
+
+    async def run(self):
+        limiter = anyio.to_thread.current_default_thread_limiter()
+        while self._running:
+            await asyncio.sleep(self.interval)
+            statistics = limiter.statistics()
+            self.max_busy = max(self.max_busy, statistics.borrowed_tokens)
+            self.max_waiting = max(self.max_waiting, statistics.tasks_waiting)
+
+    def stop(self):
+        self._running = False
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    """ Nearest rank percentile of an already sorted list """
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+async def run_level(client: httpx.AsyncClient, app_thread: AppThread, fixture: Fixture,
+                    endpoint: str, concurrency: int, total: int) -> dict:
+    build_request = REQUESTS[endpoint]
+    if endpoint in SETUP:
+        SETUP[endpoint](fixture, total)
+    request_numbers = itertools.count()
+    latencies = []
+    statuses = Counter()
+
+    async def client_loop():
+        # closed loop: each simulated client sends its next request as soon as the last one returns
+        while (n := next(request_numbers)) < total:
+            method, path, body = build_request(fixture, n)
+            start = time.perf_counter()
+            response = await client.request(method, path, json=body)
+            latencies.append(time.perf_counter() - start)
+            statuses[response.status_code] += 1
+
+    monitor = LoopMonitor()
+    with StepTimer(app_thread.thread_id) as step_timer:
+        monitor_task = asyncio.create_task(app_thread.run(monitor.run()))
+        start = time.perf_counter()
+        await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+        wall = time.perf_counter() - start
+        monitor.stop()
+        await monitor_task
+
+    latencies.sort()
+    return {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "rps": round(len(latencies) / wall, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "errors": sum(count for status_code, count in statuses.items() if status_code >= 400),
+        "statuses": {str(status_code): count for status_code, count in sorted(statuses.items())},
+        "threads_busy_max": monitor.max_busy,
+        "threads_waiting_max": monitor.max_waiting,
+        "loop_stall_max_ms": round(step_timer.max_step * 1000, 2),
+    }
+
+
+async def run_all(args) -> tuple:
+    rng = random.Random(args.seed)
+    supabase = FakeSupabase(Latency(args.db_latency, args.jitter, rng, blocking=args.blocking_db), rng, args.db_error_rate)
+    fixture = Fixture(supabase, args.decks, args.cards)
+
+    async def fake_supabase_client():
+        # async, a sync override would itself take a threadpool worker per request
+        return supabase
+
+    app.dependency_overrides[get_supabase_client] = fake_supabase_client
+    if args.blocking_auth_ms:
+        def blocking_current_user():
+            # a sync stand-in, e.g. verifying a token with a sync library, runs on the threadpool
+            time.sleep(args.blocking_auth_ms / 1000)
+            return USER_ID
+
+        app.dependency_overrides[get_current_user] = blocking_current_user
+    if not args.response_cache:
+        response_cache._response_cache = response_cache.ResponseCache(0, 1)
+
+    async def thread_limiter():
+        # the default thread limiter belongs to the loop the app runs on
+        limiter = anyio.to_thread.current_default_thread_limiter()
+        if args.thread_tokens:
+            limiter.total_tokens = args.thread_tokens
+        return limiter
+
+    endpoints = [endpoint for endpoint in REQUESTS if not args.endpoints or any(part in endpoint for part in args.endpoints.split(","))]
+    app_thread = AppThread()
+    # the lifespan would open a real Supabase client, the transport doesn't run it
+    transport = AppThreadTransport(app_thread, httpx.ASGITransport(app=app, raise_app_exceptions=False))
+    results = []
+    try:
+        limiter = await app_thread.run(thread_limiter())
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest") as client:
+            for endpoint in endpoints:
+                await run_level(client, app_thread, fixture, endpoint, 1, args.warmup)
+                for concurrency in [int(level) for level in args.concurrency.split(",")]:
+                    results.append(await run_level(client, app_thread, fixture, endpoint, concurrency, args.requests))
+    finally:
+        app.dependency_overrides.clear()
+        app_thread.stop()
+    return results, limiter.total_tokens
+
+
+def print_table(results: list, thread_tokens: int):
+    print(f"{'endpoint':<34} {'conc':>5} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'errors':>6} {'threads':>9} {'queued':>7} {'stall ms':>9}")
+    for result in results:
+        print(f"{result['endpoint']:<34} {result['concurrency']:>5} {result['rps']:>9.1f} "
+              f"{result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} {result['p99_ms']:>8.2f} {result['errors']:>6} "
+              f"{result['threads_busy_max']:>4}/{thread_tokens:<4} {result['threads_waiting_max']:>7} "
+              f"{result['loop_stall_max_ms']:>9.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", default="1,8,32,128", help="comma separated numbers of concurrent clients")
+    parser.add_argument("--requests", type=int, default=500, help="requests per endpoint and concurrency level")
+    parser.add_argument("--warmup", type=int, default=10, help="unmeasured requests per endpoint")
+    parser.add_argument("--endpoints", default="", help="comma separated substrings, only matching endpoints run")
+    parser.add_argument("--decks", type=int, default=50, help="decks owned by the user")
+    parser.add_argument("--cards", type=int, default=200, help="flashcards in the deck being read")
+    parser.add_argument("--db-latency", type=float, default=0.005, help="seconds per Supabase request")
+    parser.add_argument("--jitter", type=float, default=0.5, help="extra latency, as a fraction of the base")
+    parser.add_argument("--db-error-rate", type=float, default=0.0, help="fraction of Supabase requests that fail")
+    parser.add_argument("--blocking-db", action="store_true",
+                        help="Supabase latency blocks the event loop, like a sync client in an async handler")
+    parser.add_argument("--blocking-auth-ms", type=float, default=0.0,
+                        help="replace get_current_user with a sync dependency blocking its worker thread this long")
+    parser.add_argument("--thread-tokens", type=int, default=0, help="threadpool size (anyio's default is 40)")
+    parser.add_argument("--response-cache", action="store_true",
+                        help="keep the listing response cache on, repeated GETs then skip the handlers and database")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print the results as json")
+    parser.add_argument("--verbose", action="store_true", help="show the app's log lines")
+    args = parser.parse_args()
+
+    with contextlib.ExitStack() as stack:
+        if not args.verbose:
+            devnull = stack.enter_context(open(os.devnull, "w"))
+            stack.enter_context(contextlib.redirect_stdout(devnull))
+        results, thread_tokens = asyncio.run(run_all(args))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_table(results, thread_tokens)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+End-to-end benchmark of the file ingestion pipeline, fully offline.
+
+Runs the upload job body (decks.ingest_file: parse, chunk, generate, dedup, insert) on
+synthetic PDFs of increasing size, with LlamaParse, OpenAI and Supabase replaced by the
+deterministic stand-ins in benchmarks/fake_backends.py. Latency, rate limit errors and
+malformed LLM replies are injected from a seeded rng, so runs are reproducible and a
+change to batching, concurrency or retries shows up as a change in wall time and requests.
+
+Reported per document size: wall time, cards/s, peak traced memory, requests per backend,
+tokens and cost from the job's usage, and the time spent in each pipeline stage.
+
+Run from the backend directory:
+    python -m benchmarks.bench_ingestion
+    python -m benchmarks.bench_ingestion --pages 1,10,100 --llm-latency 0.2 --error-rate 0.05
+    python -m benchmarks.bench_ingestion --chunker markdown --scanned-ratio 0.2 --json
+    python -m benchmarks.bench_ingestion --fake-tokenizer   # no tiktoken download needed
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+from unittest import mock
+
+from app.core.metrics import STAGE_DURATION
+from app.endpoints.decks import ingest_file
+from app.services import completion_cache, openai_scheduler, parse_cache
+from app.services.job_service import IngestionJob
+from app.services.upload_service import SpooledUpload
+from benchmarks.fake_backends import (
+    FakeLlamaParse,
+    FakeOpenAI,
+    FakeSupabase,
+    Latency,
+    make_page_texts,
+    make_pdf,
+)
+
+
+STAGES = ("pdf_text", "llama_parse", "parse", "chunk", "generate", "dedup", "insert")
+
+
+def word_encoding(model: str):
+    """ Stand-in for a tiktoken encoding, one token per whitespace separated word """
+    return SimpleNamespace(encode=lambda text: text.split())
+
+
+def fresh_singletons(workdir: str, args):
+    """ Per run caches and scheduler, so no run reuses another's parses or completions """
+    parse_cache._parse_cache = parse_cache.ParseCache(os.path.join(workdir, "parse"), 64, 1 << 30)
+    completion_cache._completion_cache = completion_cache.CompletionCache(
+        os.path.join(workdir, "completions.sqlite3"), 3600, 1 << 30, enabled=args.completion_cache
+    )
+    openai_scheduler._openai_scheduler = openai_scheduler.OpenAIScheduler(
+        args.max_in_flight, args.rpm, args.tpm, openai_scheduler.OPENAI_MAX_RETRIES, base_delay=args.retry_delay
+    )
+
+
+async def run_once(num_pages: int, args, rng: random.Random) -> dict:
+    scanned = {page_num for page_num in range(num_pages) if rng.random() < args.scanned_ratio}
+    page_texts = make_page_texts(num_pages, seed=args.seed + num_pages)
+    pdf = make_pdf(page_texts, scanned)
+
+    openai_client = FakeOpenAI(Latency(args.llm_latency, args.jitter, rng), rng,
+                               args.error_rate, args.malformed_rate)
+    llama_parse = FakeLlamaParse(page_texts, Latency(args.parse_latency, args.jitter, rng))
+    supabase = FakeSupabase(Latency(args.db_latency, args.jitter, rng), rng, args.db_error_rate)
+    user_id = "bench-user"
+    deck = supabase.seed("flashcard_decks", [{"user_id": user_id, "name": "bench"}])[0]
+    job = IngestionJob(deck["id"], user_id)
+
+    stage_before = {stage: STAGE_DURATION.total(stage=stage) for stage in STAGES}
+    error = None
+    if args.trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    with mock.patch("app.services.file_service.get_openai_client", lambda: openai_client), \
+            mock.patch("app.services.file_service.load_llama_parse", lambda: llama_parse):
+        try:
+            await ingest_file(job, supabase, deck["id"], SpooledUpload.from_bytes(pdf), args.chunker)
+        except Exception as e:
+            error = f"{type(e).__name__}: {getattr(e, 'detail', e)}"
+    wall = time.perf_counter() - start
+    peak = 0
+    if args.trace_memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    cards = job.progress.get("cards_inserted", 0)
+    return {
+        "pages": num_pages,
+        "scanned_pages": len(scanned),
+        "wall_seconds": round(wall, 4),
+        "cards": cards,
+        "cards_per_second": round(cards / wall, 2) if wall else 0.0,
+        "failed_chunks": len(job.failed_chunks),
+        "duplicates_dropped": job.progress.get("duplicates_dropped", 0),
+        "peak_mib": round(peak / 2 ** 20, 2),
+        "openai_requests": dict(openai_client.requests),
+        "llama_parse_requests": dict(llama_parse.requests),
+        "supabase_requests": dict(supabase.requests),
+        "usage": job.usage.total.model_dump(),
+        "stage_seconds": {
+            stage: round(STAGE_DURATION.total(stage=stage) - stage_before[stage], 4)
+            for stage in STAGES if STAGE_DURATION.total(stage=stage) > stage_before[stage]
+        },
+        "error": error,
+    }
+
+
+def print_table(results: list):
+    print(f"{'pages':>6} {'wall (s)':>9} {'cards':>6} {'cards/s':>8} {'failed':>6} {'dups':>5} "
+          f"{'peak MiB':>9} {'llm req':>8} {'429s':>5} {'parse req':>9} {'db req':>7} {'tokens':>9} {'cost $':>8}")
+    for result in results:
+        llm = result["openai_requests"]
+        llm_requests = sum(count for operation, count in llm.items() if operation not in ("rate_limited", "malformed"))
+        usage = result["usage"]
+        print(f"{result['pages']:>6} {result['wall_seconds']:>9.3f} {result['cards']:>6} "
+              f"{result['cards_per_second']:>8.1f} {result['failed_chunks']:>6} {result['duplicates_dropped']:>5} "
+              f"{result['peak_mib']:>9.1f} {llm_requests:>8} {llm.get('rate_limited', 0):>5} "
+              f"{result['llama_parse_requests'].get('aload_data', 0):>9} "
+              f"{sum(result['supabase_requests'].values()):>7} "
+              f"{usage['prompt_tokens'] + usage['completion_tokens']:>9} {usage['cost_usd']:>8.4f}")
+
+    print()
+    print(f"{'pages':>6} " + " ".join(f"{stage:>11}" for stage in STAGES))
+    for result in results:
+        cells = " ".join(f"{result['stage_seconds'].get(stage, 0.0):>11.3f}" for stage in STAGES)
+        print(f"{result['pages']:>6} {cells}")
+
+    for result in results:
+        if result["error"]:
+            print(f"\n{result['pages']} pages failed: {result['error']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", default="1,10,100,1000", help="comma separated document sizes in pages")
+    parser.add_argument("--chunker", choices=("llm", "markdown"), default="llm")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="seconds per OpenAI completion")
+    parser.add_argument("--parse-latency", type=float, default=0.02, help="seconds per page sent to LlamaParse")
+    parser.add_argument("--db-latency", type=float, default=0.005, help="seconds per Supabase request")
+    parser.add_argument("--jitter", type=float, default=0.5, help="extra latency, as a fraction of the base")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of completions answered with a 429")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="fraction of flashcard replies that are not JSON")
+    parser.add_argument("--db-error-rate", type=float, default=0.0, help="fraction of Supabase requests that fail")
+    parser.add_argument("--scanned-ratio", type=float, default=0.0, help="fraction of pages without a text layer")
+    parser.add_argument("--max-in-flight", type=int, default=openai_scheduler.OPENAI_MAX_IN_FLIGHT)
+    parser.add_argument("--rpm", type=int, default=1_000_000, help="OpenAI requests per minute budget")
+    parser.add_argument("--tpm", type=int, default=100_000_000, help="OpenAI tokens per minute budget")
+    parser.add_argument("--retry-delay", type=float, default=0.05, help="base backoff after a 429, in seconds")
+    parser.add_argument("--completion-cache", action="store_true", help="keep the completion cache enabled")
+    parser.add_argument("--fake-tokenizer", action="store_true",
+                        help="count whitespace separated words instead of tiktoken tokens")
+    parser.add_argument("--no-trace-memory", dest="trace_memory", action="store_false",
+                        help="skip tracemalloc, which slows the CPU bound stages down noticeably")
+    parser.add_argument("--json", action="store_true", help="print the results as json")
+    parser.add_argument("--verbose", action="store_true", help="show the pipeline's log lines")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    results = []
+    with contextlib.ExitStack() as stack:
+        if args.fake_tokenizer:
+            stack.enter_context(mock.patch("app.services.page_packer.get_encoding", word_encoding))
+        if not args.verbose:
+            devnull = stack.enter_context(open(os.devnull, "w"))
+            stack.enter_context(contextlib.redirect_stdout(devnull))
+        for num_pages in [int(size) for size in args.pages.split(",")]:
+            with tempfile.TemporaryDirectory() as workdir:
+                fresh_singletons(workdir, args)
+                results.append(asyncio.run(run_once(num_pages, args, rng)))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_table(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Micro-benchmark for grouping parsed pages into token-bounded blocks.
+
+Compares the previous packing loop in process_file, which re-tokenized the
+growing block for every page, against pack_pages.
+
+Run from the backend directory:
+    python -m benchmarks.bench_page_packer
+    python -m benchmarks.bench_page_packer --fake-tokenizer   # no tiktoken download needed
+"""
+import argparse
+import random
+import time
+
+from app.services.page_packer import count_tokens, pack_pages
+
+
+WORDS = ["lecture", "theorem", "proof", "lemma", "graph", "vertex", "edge", "cycle",
+         "matrix", "vector", "entropy", "gradient", "the", "of", "and", "is", "a"]
+
+
+def make_pages(num_pages, words_per_page=120, seed=0):
+    rng = random.Random(seed)
+    pages = []
+    for page_num in range(num_pages):
+        paragraphs = []
+        for _ in range(3):
+            sentence_words = [rng.choice(WORDS) for _ in range(words_per_page // 3)]
+            paragraphs.append(" ".join(sentence_words) + ".")
+        pages.append(f"# Page {page_num}\n\n" + "\n\n".join(paragraphs) + "\n\n")
+    return pages
+
+
+def legacy_pack(pages, max_tokens, count):
+    """ The loop process_file used before pack_pages (assumes every page fits in a block) """
+    blocks = []
+    pending_text = ""
+    page_num = 0
+    while page_num < len(pages):
+        page_tokens = count(pages[page_num])
+        if count(pending_text) + page_tokens <= max_tokens:
+            pending_text += pages[page_num]
+            page_num += 1
+        else:
+            if pending_text:
+                blocks.append(pending_text)
+            pending_text = ""
+    if pending_text:
+        blocks.append(pending_text)
+    return blocks
+
+
+def time_call(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10,100,500,1000,2000,5000", help="comma separated page counts")
+    parser.add_argument("--max-tokens", type=int, default=1000)
+    parser.add_argument("--legacy-limit", type=int, default=2000,
+                        help="skip the quadratic legacy loop above this many pages")
+    parser.add_argument("--fake-tokenizer", action="store_true",
+                        help="count whitespace separated words instead of tiktoken tokens")
+    args = parser.parse_args()
+
+    count = (lambda text: len(text.split())) if args.fake_tokenizer else count_tokens
+
+    print(f"{'pages':>8} {'pack_pages (s)':>16} {'us/page':>10} {'legacy (s)':>12} {'blocks':>8}")
+    for num_pages in [int(size) for size in args.sizes.split(",")]:
+        pages = make_pages(num_pages)
+        packed_time, blocks = time_call(pack_pages, pages, args.max_tokens, count)
+
+        legacy = "skipped"
+        if num_pages <= args.legacy_limit:
+            legacy_time, legacy_blocks = time_call(legacy_pack, pages, args.max_tokens, count)
+            assert legacy_blocks == blocks, "pack_pages should match the legacy grouping for pages that fit"
+            legacy = f"{legacy_time:.4f}"
+
+        per_page = packed_time / num_pages * 1e6
+        print(f"{num_pages:>8} {packed_time:>16.4f} {per_page:>10.1f} {legacy:>12} {len(blocks):>8}")
+
+
+if __name__ == "__main__":
+    main()
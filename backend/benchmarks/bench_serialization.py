@@ -0,0 +1,84 @@
+"""
+Micro-benchmark for serializing large flashcard listings.
+
+Compares three ways of turning supabase rows into a response body:
+  response_model  what FastAPI did for a List[FlashcardOut] response_model: validate
+                  every row, jsonable_encoder, json.dumps
+  validated       build_page with the default path (model_validate + json.dumps)
+  fast            build_page with FAST_JSON_RESPONSES (orjson, no re-validation)
+
+Run from the backend directory:
+    python -m benchmarks.bench_serialization
+    python -m benchmarks.bench_serialization --sizes 1000,10000,50000 --repeat 5
+"""
+import argparse
+import json
+import time
+import uuid
+from typing import List
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+from app.endpoints.decks import FlashcardOut, build_page
+
+
+def make_rows(num_cards, deck_id="deck-1"):
+    """ Rows shaped like PostgREST returns them for the flashcards table """
+    return [
+        {
+            "id": str(uuid.UUID(int=card_num)),
+            "deck_id": deck_id,
+            "question": f"What does theorem {card_num} state about the eigenvalues of a symmetric matrix?",
+            "answer": f"Theorem {card_num}: all eigenvalues are real and the eigenvectors can be chosen orthonormal.",
+            "created_at": "2025-03-09T17:06:10.123456+00:00",
+            "updated_at": "2025-03-09T17:06:10.123456+00:00",
+        }
+        for card_num in range(num_cards)
+    ]
+
+
+def response_model_path(rows):
+    adapter = TypeAdapter(List[FlashcardOut])
+    validated = adapter.validate_python(rows)
+    return json.dumps(jsonable_encoder(adapter.dump_python(validated, mode="json"))).encode("utf-8")
+
+
+def validated_path(rows):
+    return build_page(rows, None, FlashcardOut, partial=False, fast=False).body
+
+
+def fast_path(rows):
+    return build_page(rows, None, FlashcardOut, partial=False, fast=True).body
+
+
+def best_time(func, rows, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = func(rows)
+        best = min(best, time.perf_counter() - start)
+    return best, body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="100,1000,10000", help="comma separated card counts")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per path, the best one is reported")
+    args = parser.parse_args()
+
+    paths = [("response_model", response_model_path), ("validated", validated_path), ("fast", fast_path)]
+    print(f"{'cards':>8} {'path':>15} {'time (ms)':>10} {'us/card':>9} {'bytes':>10} {'speedup':>8}")
+    for num_cards in [int(size) for size in args.sizes.split(",")]:
+        rows = make_rows(num_cards)
+        baseline = None
+        for name, func in paths:
+            elapsed, body = best_time(func, rows, args.repeat)
+            assert len(json.loads(body)) == num_cards
+            baseline = baseline or elapsed
+            print(f"{num_cards:>8} {name:>15} {elapsed * 1e3:>10.2f} {elapsed / num_cards * 1e6:>9.2f} "
+                  f"{len(body):>10} {baseline / elapsed:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Cold start benchmark: how long `import main` takes in a fresh interpreter.
+
+Every run is a new process, like a container scaled out under load. Reports the median
+and worst import time, the slowest packages (from python -X importtime), and
+whether any of the ingestion-only dependencies were imported at startup. Those are loaded
+on first use (see file_service.load_llama_parse, openai_scheduler.get_openai_client,
+page_packer.get_encoding, pdf_text.extract_pdf_pages and dedup_service) and must stay out of
+the startup path.
+
+Exits with status 1 when a lazy dependency is imported at startup or the median import
+time exceeds --budget, so it can guard deploys against import latency regressions.
+
+Run from the backend directory:
+    python -m benchmarks.bench_startup
+    python -m benchmarks.bench_startup --runs 10 --budget 2.5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+
+# heavy packages only the file ingestion path needs
+LAZY_MODULES = ("llama_parse", "llama_index", "llama_cloud_services", "nest_asyncio", "openai", "tiktoken", "pypdf", "numpy")
+
+PROBE = (
+    "import json, sys, time\n"
+    "start = time.perf_counter()\n"
+    "import main\n"
+    "seconds = time.perf_counter() - start\n"
+    "lazy = sorted(name for name in {lazy!r} if name in sys.modules)\n"
+    "print(json.dumps({{'seconds': seconds, 'lazy_imported': lazy}}))\n"
+)
+
+
+def backend_dir() -> str:
+    return os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_main(importtime: bool = False) -> tuple:
+    """ Imports main in a fresh interpreter, returns (probe result, importtime report on stderr) """
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", PROBE.format(lazy=LAZY_MODULES)]
+    completed = subprocess.run(command, cwd=backend_dir(), capture_output=True, text=True, check=False)
+    if completed.returncode != 0:
+        raise RuntimeError(f"import main failed:\n{completed.stderr}")
+    return json.loads(completed.stdout.strip().splitlines()[-1]), completed.stderr
+
+
+def top_packages(importtime_report: str, limit: int) -> list:
+    """
+    (package, cumulative seconds) of the slowest packages in an importtime report. A package
+    is counted where another package first imports it, and its time includes what it imports.
+    """
+    lines = []
+    for line in importtime_report.splitlines():
+        parts = line.split("|")
+        if not line.startswith("import time:") or len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        lines.append((depth, name.strip().split(".")[0], int(parts[1])))
+
+    totals = defaultdict(int)
+    # importtime prints a module after everything it imports, walk the report backwards to see parents first
+    parents = []
+    for depth, package, microseconds in reversed(lines):
+        del parents[depth:]
+        if depth and package != parents[-1]:
+            totals[package] += microseconds
+        parents.append(package)
+    ranked = sorted(totals.items(), key=lambda item: item[1], reverse=True)
+    return [(package, microseconds / 1e6) for package, microseconds in ranked[:limit]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters to time")
+    parser.add_argument("--budget", type=float, default=0.0, help="fail when the median import takes longer (seconds)")
+    parser.add_argument("--top", type=int, default=10, help="slowest packages to list")
+    args = parser.parse_args()
+
+    results = [import_main()[0] for _ in range(args.runs)]
+    times = [result["seconds"] for result in results]
+    lazy_imported = sorted({name for result in results for name in result["lazy_imported"]})
+    _, report = import_main(importtime=True)
+
+    median = statistics.median(times)
+    print(f"import main: median {median:.3f}s, min {min(times):.3f}s, max {max(times):.3f}s over {args.runs} runs")
+    print()
+    print(f"{'package':<28} {'cumulative (s)':>15}")
+    for package, seconds in top_packages(report, args.top):
+        print(f"{package:<28} {seconds:>15.3f}")
+    print()
+
+    failed = False
+    if lazy_imported:
+        print(f"FAIL: imported at startup but should load on first use: {', '.join(lazy_imported)}")
+        failed = True
+    else:
+        print(f"ok: none of {', '.join(LAZY_MODULES)} imported at startup")
+    if args.budget and median > args.budget:
+        print(f"FAIL: median import time {median:.3f}s is over the {args.budget:.3f}s budget")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,337 @@
+"""
+Deterministic local stand-ins for the services the backend talks to, for benchmarks.
+
+  FakeOpenAI      openai.AsyncOpenAI: answers chunking and flashcard prompts in the shape
+                  file_service expects, with latency, 429s and malformed replies injected
+  FakeLlamaParse  llama_parse.LlamaParse: returns the markdown of the requested pages
+  FakeSupabase    the async supabase client: an in-memory table store with latency and
+                  transient errors, supporting the query builder calls the API makes
+
+Each fake counts the requests it served in `.requests` (a Counter keyed by operation).
+All randomness comes from a seeded random.Random, so runs are reproducible.
+"""
+import asyncio
+import json
+import random
+import re
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import httpx
+import openai
+
+
+TOPICS = ["photosynthesis", "mitosis", "entropy", "recursion", "inflation", "plate tectonics",
+          "the krebs cycle", "supply and demand", "the french revolution", "eigenvalues",
+          "natural selection", "ohm's law", "the water cycle", "hash tables", "game theory"]
+SYLLABLES = ["ka", "lo", "mi", "ter", "vin", "dro", "sa", "pel", "qui", "nor", "zu", "fen", "bra", "tho", "ix", "gum"]
+
+
+class Latency:
+    """
+    Sleeps base seconds plus up to jitter * base more, drawn from a shared seeded rng.
+    A blocking latency sleeps with time.sleep, like a sync client called from async code,
+    and stalls the whole event loop for the duration.
+    """
+
+    def __init__(self, base: float, jitter: float, rng: random.Random, blocking: bool = False):
+        self.base = base
+        self.jitter = jitter
+        self.rng = rng
+        self.blocking = blocking
+
+    async def wait(self, scale: float = 1.0):
+        delay = self.base * scale * (1 + self.jitter * self.rng.random())
+        if delay <= 0:
+            return
+        if self.blocking:
+            time.sleep(delay)
+        else:
+            await asyncio.sleep(delay)
+
+
+def make_term(rng: random.Random) -> str:
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+
+
+def make_page_texts(num_pages: int, sentences_per_page: int = 8, seed: int = 0) -> list:
+    """
+    Lecture-like pages, each about one topic. Sentences are built from made up terms,
+    so the flashcards generated from them are distinct enough to survive dedup.
+    """
+    rng = random.Random(seed)
+    pages = []
+    for page_num in range(num_pages):
+        topic = TOPICS[page_num % len(TOPICS)]
+        sentences = [
+            f"In {topic}, the {make_term(rng)} of a {make_term(rng)} drives the "
+            f"{make_term(rng)} {make_term(rng)} toward {make_term(rng)}."
+            for _ in range(sentences_per_page)
+        ]
+        pages.append(f"Lecture {page_num} on {topic}\n" + "\n".join(sentences))
+    return pages
+
+
+def make_pdf(page_texts: list, scanned: set = frozenset()) -> bytes:
+    """
+    A PDF with one Helvetica text line per line of each page text.
+    Pages in `scanned` get no text layer, like an image-only scan, so they go to LlamaParse.
+    """
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for page_num, text in enumerate(page_texts):
+        stream = ""
+        if page_num not in scanned:
+            lines = [line.replace("\\", "").replace("(", "").replace(")", "") for line in text.split("\n")]
+            stream = "BT /F1 10 Tf 12 TL 40 760 Td " + " ".join(f"({line}) Tj T*" for line in lines) + " ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        page_ids.append(len(objects))
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids)
+    objects[1] = f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>"
+
+    parts = ["%PDF-1.4\n"]
+    size = len(parts[0])
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(size)
+        part = f"{number} 0 obj\n{body}\nendobj\n"
+        parts.append(part)
+        size += len(part)
+    parts.append(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n")
+    parts.append("".join(f"{offset:010d} 00000 n \n" for offset in offsets))
+    parts.append(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{size}\n%%EOF\n")
+    return "".join(parts).encode("latin-1")
+
+
+def flashcard_for(chunk: str) -> dict:
+    """ A question/answer pair derived from the chunk's first sentence """
+    first = chunk.strip().split("\n")[0].strip() or "this passage"
+    return {"question": f"{first[:160]} Why?", "answer": first[:200]}
+
+
+class FakeOpenAI:
+    """
+    Stand-in for openai.AsyncOpenAI. Chunking prompts get <CHUNK_BREAK> inserted every
+    sentences_per_chunk lines; flashcard and flashcard batch prompts get structured replies.
+    error_rate of the calls raise a 429 (retried by the OpenAI scheduler) and malformed_rate
+    of the flashcard replies are not JSON (retried by create_flashcard).
+    """
+
+    def __init__(self, latency: Latency, rng: random.Random, error_rate: float = 0.0,
+                 malformed_rate: float = 0.0, sentences_per_chunk: int = 3):
+        self.latency = latency
+        self.rng = rng
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self.sentences_per_chunk = sentences_per_chunk
+        self.requests = Counter()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, model, messages, response_format=None, **kwargs):
+        prompt = messages[-1]["content"]
+        operation = response_format["json_schema"]["name"] if response_format else "chunk_text"
+        self.requests[operation] += 1
+        # replies take longer the more text they echo back
+        await self.latency.wait(1 + len(prompt) / 20000)
+
+        if self.rng.random() < self.error_rate:
+            self.requests["rate_limited"] += 1
+            request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+            raise openai.RateLimitError("Rate limit reached", response=httpx.Response(429, request=request), body=None)
+
+        if operation != "chunk_text" and self.rng.random() < self.malformed_rate:
+            self.requests["malformed"] += 1
+            content = "Sorry, here is your flashcard: {"
+        elif operation == "chunk_text":
+            content = self.chunk(prompt.split("Provided text: ", 1)[-1])
+        elif operation == "flashcard":
+            content = json.dumps(flashcard_for(prompt.split("Text chunk: ", 1)[-1]))
+        else:
+            chunks = re.findall(r'<chunk id="(\d+)">\n(.*?)\n</chunk>', prompt, re.S)
+            content = json.dumps({"flashcards": [
+                {"chunk_id": int(chunk_id), **flashcard_for(chunk)} for chunk_id, chunk in chunks
+            ]})
+
+        usage = SimpleNamespace(prompt_tokens=len(prompt) // 4, completion_tokens=len(content) // 4,
+                                prompt_tokens_details=SimpleNamespace(cached_tokens=0))
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=usage)
+
+    def chunk(self, text: str) -> str:
+        lines = text.split("\n")
+        groups = ["\n".join(lines[start:start + self.sentences_per_chunk])
+                  for start in range(0, len(lines), self.sentences_per_chunk)]
+        return "<CHUNK_BREAK>".join(groups)
+
+
+class FakeLlamaParse:
+    """
+    Stand-in for the LlamaParse class: aload_data returns one document per requested page
+    with the page's markdown. Build it with page_texts, then use the instance as the class.
+    """
+
+    def __init__(self, page_texts: list, latency: Latency, error_rate: float = 0.0, rng: random.Random = None):
+        self.page_texts = page_texts
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rng = rng or random.Random(0)
+        self.requests = Counter()
+
+    def __call__(self, api_key=None, result_type="markdown", target_pages=None, **kwargs):
+        pages = [int(page) for page in target_pages.split(",")] if target_pages else range(len(self.page_texts))
+        return SimpleNamespace(aload_data=lambda file_path, extra_info=None: self.aload_data(list(pages), file_path))
+
+    async def aload_data(self, pages: list, stream):
+        self.requests["aload_data"] += 1
+        self.requests["pages"] += len(pages)
+        stream.read()
+        # LlamaParse works through a whole job, per page latency adds up
+        await self.latency.wait(len(pages))
+        if self.rng.random() < self.error_rate:
+            raise RuntimeError("Simulated LlamaParse failure")
+        return [SimpleNamespace(text="# " + self.page_texts[page].replace("\n", "\n\n", 1)) for page in pages]
+
+
+class FakeQuery:
+    """ One query against a FakeSupabase table, mirrors the postgrest builder calls the API uses """
+
+    def __init__(self, store: "FakeSupabase", table_name: str):
+        self.store = store
+        self.table_name = table_name
+        self.operation = "select"
+        self.payload = None
+        self.filters = {}
+        self.after = None
+        self.row_limit = None
+
+    def select(self, columns="*"):
+        self.operation = "select"
+        return self
+
+    def insert(self, rows):
+        self.operation, self.payload = "insert", rows
+        return self
+
+    def upsert(self, rows, on_conflict=""):
+        self.operation, self.payload = "upsert", rows
+        return self
+
+    def update(self, values):
+        self.operation, self.payload = "update", values
+        return self
+
+    def delete(self):
+        self.operation = "delete"
+        return self
+
+    def eq(self, column, value):
+        self.filters[column] = value
+        return self
+
+    def match(self, conditions):
+        self.filters.update(conditions)
+        return self
+
+    def or_(self, filters):
+        # the keyset filter built by deck_service.fetch_page
+        created_at, row_id = re.search(r'created_at\.eq\."([^"]*)",id\.gt\."([^"]*)"', filters).groups()
+        self.after = (created_at, row_id)
+        return self
+
+    def order(self, column, desc=False):
+        return self
+
+    def limit(self, size):
+        self.row_limit = size
+        return self
+
+    async def execute(self):
+        return await self.store.execute(self)
+
+
+class FakeSupabase:
+    """
+    In-memory stand-in for the async supabase client. Every execute() waits for latency and
+    error_rate of them raise a ConnectionError, like a dropped PostgREST connection.
+    """
+
+    def __init__(self, latency: Latency, rng: random.Random, error_rate: float = 0.0):
+        self.latency = latency
+        self.rng = rng
+        self.error_rate = error_rate
+        self.tables = {}
+        self.requests = Counter()
+        self._clock = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+    def table(self, table_name: str) -> FakeQuery:
+        return FakeQuery(self, table_name)
+
+    def rpc(self, fn: str, params: dict):
+        store = self
+
+        class Call:
+            async def execute(self):
+                store.requests[f"rpc:{fn}"] += 1
+                await store.latency.wait()
+                decks = store.tables.get("flashcard_decks", {})
+                deck = decks.get(params["p_deck_id"])
+                if deck is None or deck["user_id"] != params["p_user_id"]:
+                    return SimpleNamespace(data=False)
+                del decks[params["p_deck_id"]]
+                cards = store.tables.get("flashcards", {})
+                for card_id in [card_id for card_id, card in cards.items() if card["deck_id"] == params["p_deck_id"]]:
+                    del cards[card_id]
+                return SimpleNamespace(data=True)
+
+        return Call()
+
+    def _stamp(self, row: dict) -> dict:
+        self._clock += timedelta(microseconds=1)
+        now = self._clock.isoformat()
+        return {"id": str(uuid.uuid4()), "created_at": now, "updated_at": now, **row}
+
+    def seed(self, table_name: str, rows: list) -> list:
+        """ Adds rows directly, without latency or counting """
+        table = self.tables.setdefault(table_name, {})
+        stamped = [self._stamp(row) for row in rows]
+        for row in stamped:
+            table[row["id"]] = row
+        return stamped
+
+    async def execute(self, query: FakeQuery):
+        self.requests[f"{query.operation}:{query.table_name}"] += 1
+        await self.latency.wait()
+        if self.rng.random() < self.error_rate:
+            raise ConnectionError("Simulated transient PostgREST failure")
+
+        table = self.tables.setdefault(query.table_name, {})
+        if query.operation in ("insert", "upsert"):
+            rows = query.payload if isinstance(query.payload, list) else [query.payload]
+            written = [self._stamp(row) for row in rows]
+            for row in written:
+                table[row["id"]] = row
+            return SimpleNamespace(data=written)
+
+        # filtering by id is a lookup, so the fake's own cost doesn't grow with the table
+        rows = [table[query.filters["id"]]] if query.filters.get("id") in table else [] if "id" in query.filters else table.values()
+        matching = [row for row in rows
+                    if all(str(row.get(column)) == str(value) for column, value in query.filters.items())]
+        if query.operation == "update":
+            for row in matching:
+                row.update(query.payload)
+            return SimpleNamespace(data=matching)
+        if query.operation == "delete":
+            for row in matching:
+                del table[row["id"]]
+            return SimpleNamespace(data=matching)
+
+        matching.sort(key=lambda row: (row["created_at"], row["id"]))
+        if query.after is not None:
+            matching = [row for row in matching if (row["created_at"], row["id"]) > query.after]
+        if query.row_limit is not None:
+            matching = matching[:query.row_limit]
+        return SimpleNamespace(data=[dict(row) for row in matching])
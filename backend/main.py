@@ -1,7 +1,23 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
+from app.core.metrics import INGESTION_ACTIVE, INGESTION_QUEUE_DEPTH, REGISTRY, RequestMetricsMiddleware
+from app.core.request_context import REQUEST_ID_HEADER
+from app.core.supabase import open_supabase_client, close_supabase_client
 from app.endpoints import decks
-app = FastAPI()
+from app.services.job_service import get_ingestion_admission, get_job_manager
+from app.services.upload_service import UploadSizeLimitMiddleware
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # one pooled supabase client is shared by every request for the life of the process
+    await open_supabase_client()
+    yield
+    await close_supabase_client()
+
+
+app = FastAPI(lifespan=lifespan)
 
 origins = [
     "http://localhost:8000",
@@ -11,12 +27,28 @@ origins = [
 
 ]
 
+# refuse oversized uploads while they stream in, before they are spooled to disk,
+# added before CORS so the 413 still carries the CORS headers
+app.add_middleware(UploadSizeLimitMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[decks.NEXT_CURSOR_HEADER, "ETag", "Retry-After", REQUEST_ID_HEADER],
 )
 
+# outermost, so the request id and latency cover everything including CORS and 413s
+app.add_middleware(RequestMetricsMiddleware)
+
 app.include_router(decks.router)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """ Prometheus scrape endpoint, in the text exposition format """
+    INGESTION_QUEUE_DEPTH.set(get_job_manager().queue_depth)
+    INGESTION_ACTIVE.set(get_ingestion_admission().active)
+    return Response(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
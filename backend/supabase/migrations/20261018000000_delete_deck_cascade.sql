@@ -0,0 +1,24 @@
+-- Deletes a deck and its flashcards in one transaction, only if the deck belongs to the user.
+-- Called by DELETE /api/decks/{deck_id} through supabase.rpc("delete_deck", ...).
+-- Returns false when the deck doesn't exist or isn't owned by p_user_id, so nothing is deleted.
+create or replace function public.delete_deck(p_deck_id uuid, p_user_id uuid)
+returns boolean
+language plpgsql
+security invoker
+as $$
+begin
+    -- lock the deck so a concurrent insert can't add flashcards between the two deletes
+    perform 1
+    from public.flashcard_decks
+    where id = p_deck_id and user_id = p_user_id
+    for update;
+
+    if not found then
+        return false;
+    end if;
+
+    delete from public.flashcards where deck_id = p_deck_id;
+    delete from public.flashcard_decks where id = p_deck_id;
+    return true;
+end;
+$$;
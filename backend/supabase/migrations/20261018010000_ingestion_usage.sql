@@ -0,0 +1,28 @@
+-- OpenAI usage of every file ingestion, one row per upload (job or stream).
+-- Written by usage_service.save_ingestion_usage; stages holds the same totals per prompt
+-- (chunk_text, flashcard, flashcard_batch). Rows outlive the deck so spend stays on record.
+create table if not exists public.ingestion_usage (
+    id uuid primary key default gen_random_uuid(),
+    job_id uuid,
+    deck_id uuid references public.flashcard_decks (id) on delete set null,
+    user_id uuid not null,
+    requests integer not null default 0,
+    cache_hits integer not null default 0,
+    prompt_tokens integer not null default 0,
+    cached_prompt_tokens integer not null default 0,
+    completion_tokens integer not null default 0,
+    cost_usd numeric(12, 6) not null default 0,
+    stages jsonb not null default '{}'::jsonb,
+    created_at timestamptz not null default now()
+);
+
+create index if not exists ingestion_usage_user_id_created_at_idx on public.ingestion_usage (user_id, created_at);
+create index if not exists ingestion_usage_deck_id_idx on public.ingestion_usage (deck_id);
+
+-- users can read their own spend, rows are only written by the backend
+alter table public.ingestion_usage enable row level security;
+
+drop policy if exists "Users read their own ingestion usage" on public.ingestion_usage;
+create policy "Users read their own ingestion usage"
+    on public.ingestion_usage for select
+    using (auth.uid() = user_id);
@@ -22,9 +22,18 @@ export function DeckGrid() {
   const fetchDecks = async () => {
     setLoading(true);
     try {
-      const res = await fetch('http://localhost:8000/api/decks');
+      let res = await fetch('http://localhost:8000/api/decks');
       if (res.ok) {
-        const data = await res.json();
+        let data = await res.json();
+        // decks are paginated, keep following the cursor until the last page
+        let cursor = res.headers.get('X-Next-Cursor');
+        while (cursor && res.ok) {
+          res = await fetch(`http://localhost:8000/api/decks?cursor=${encodeURIComponent(cursor)}`);
+          if (res.ok) {
+            data = data.concat(await res.json());
+            cursor = res.headers.get('X-Next-Cursor');
+          }
+        }
         setDecks(data);
       } else {
         notifications.show({ color: 'red', title: 'Error', message: 'Failed to fetch decks' });
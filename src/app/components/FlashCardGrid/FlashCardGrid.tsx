@@ -41,10 +41,21 @@ export function FlashCardGrid({ deck }: FlashCardGridProps) {
     console.log("fetching flashcards for deck", deck.id)
     setLoading(true);
     try {
-      const res = await fetch(`http://localhost:8000/api/decks/${deck.id}/flashcards`);
+      let res = await fetch(`http://localhost:8000/api/decks/${deck.id}/flashcards`);
       if (res.ok) {
-        const data = await res.json();
+        let data: FlashCard[] = await res.json();
         setFlashcards(data);
+        setLoading(false);
+        // show the first page right away, then follow the cursor for the rest of the deck
+        let cursor = res.headers.get('X-Next-Cursor');
+        while (cursor && res.ok) {
+          res = await fetch(`http://localhost:8000/api/decks/${deck.id}/flashcards?cursor=${encodeURIComponent(cursor)}`);
+          if (res.ok) {
+            data = data.concat(await res.json());
+            setFlashcards(data);
+            cursor = res.headers.get('X-Next-Cursor');
+          }
+        }
       } else {
         notifications.show({ color: 'red', title: 'Error', message: 'Failed to fetch flashcards' });
       }
@@ -84,6 +95,21 @@ export function FlashCardGrid({ deck }: FlashCardGridProps) {
     }
   };
 
+  // Poll an ingestion job until it has completed or failed
+  const waitForJob = async (jobId: string) => {
+    while (true) {
+      const res = await fetch(`http://localhost:8000/api/jobs/${jobId}`);
+      if (!res.ok) {
+        throw new Error('Failed to fetch job status');
+      }
+      const job = await res.json();
+      if (job.status === 'completed' || job.status === 'failed') {
+        return job;
+      }
+      await new Promise((resolve) => setTimeout(resolve, 2000));
+    }
+  };
+
   // Handle file upload (PDF) to generate flashcards using AI
   const handleFileUpload = async (files: File[]) => {
     // For simplicity, assume a single file upload
@@ -97,12 +123,28 @@ export function FlashCardGrid({ deck }: FlashCardGridProps) {
         body: formData,
       });
       if (res.ok) {
+        // the upload only queues an ingestion job, poll it until it finishes
+        const job = await res.json();
         notifications.show({
-          color: 'teal',
-          title: 'Success',
-          message: 'Flashcards generated from PDF',
+          color: 'blue',
+          title: 'Processing',
+          message: 'Generating flashcards from PDF...',
         });
-        fetchFlashcards();
+        const finishedJob = await waitForJob(job.id);
+        if (finishedJob.status === 'completed') {
+          notifications.show({
+            color: 'teal',
+            title: 'Success',
+            message: 'Flashcards generated from PDF',
+          });
+          fetchFlashcards();
+        } else {
+          notifications.show({
+            color: 'red',
+            title: 'Error',
+            message: finishedJob.error || 'Failed to generate flashcards from PDF',
+          });
+        }
       } else {
         notifications.show({
           color: 'red',